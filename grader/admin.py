@@ -15,16 +15,14 @@ class ProcessedFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == "yes":
-            return queryset.filter(
-                models.Q(grading__isnull=False) | models.Q(errorlog__isnull=False)
-            ).distinct()
+            return queryset.exclude(state__in=GradingProcess.UNFINISHED)
         if self.value() == "no":
-            return queryset.filter(grading__isnull=True, errorlog__isnull=True)
+            return queryset.filter(state__in=GradingProcess.UNFINISHED)
 
 
 @admin.action(description="Delete unprocessed grading processes")
 def delete_unprocessed_action(modeladmin, request, queryset):
-    to_delete = queryset.filter(grading__isnull=True, errorlog__isnull=True)
+    to_delete = queryset.filter(state__in=GradingProcess.UNFINISHED)
     count, _ = to_delete.delete()
     modeladmin.message_user(request, f"{count} unprocessed grading process(es) deleted.", messages.SUCCESS)
 
@@ -60,9 +58,18 @@ class SubExercisesAdmin(admin.ModelAdmin):
     list_filter = ["in_notebook"]
     list_display = ["in_notebook", "label"]
 
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.select_related("in_notebook__in_exercise").defer(*(f"in_notebook__{blob}" for blob in Notebook.BLOBS))
+
 
 class NotebookAdmin(admin.StackedInline):
+    # the files are not loaded, only their description
     model = Notebook
+    readonly_fields = [
+        "uploaded_at", "version",
+        "data_size", "data_sha256", "assets_size", "assets_sha256", "release_data_size", "release_data_sha256",
+    ]
 
 class ExerciseAdmin(admin.ModelAdmin):
     model = Exercise
@@ -77,16 +84,32 @@ class ExerciseAdmin(admin.ModelAdmin):
 class ProcessAdmin(admin.ModelAdmin):
     model = GradingProcess
     inlines = [GradingInline, StudentNotebookInline, ErrorLogInline]
-    list_display = ["identifier", "email", "requested_at", "for_exercise", "processed"]
-    list_filter = [ProcessedFilter, "for_exercise"]
+    list_display = ["identifier", "email", "requested_at", "for_exercise", "state", "processed"]
+    list_filter = [ProcessedFilter, "state", "for_exercise"]
+    readonly_fields = ["claimed_at", "graded_at", "errored_at", "notified_at"]
     ordering = ["-requested_at"]
     actions = [delete_unprocessed_action]
 
+class WorkerAssignmentAdmin(admin.ModelAdmin):
+    model = WorkerAssignment
+    list_display = ["process", "worker_id", "assigned_at", "lease_expires_at", "attempts"]
+    ordering = ["-assigned_at"]
+
+class WorkerHeartbeatAdmin(admin.ModelAdmin):
+    model = WorkerHeartbeat
+    list_display = ["worker_id", "started_at", "last_seen", "alive", "slots", "running"]
+    ordering = ["-last_seen"]
+
 class DailyLimitAdmin(admin.ModelAdmin):
     model = DailyLimit
     list_display = ["user_id", "limit"]
     readonly_fields = ["user_id"]
 
+class SubmissionCounterAdmin(admin.ModelAdmin):
+    model = SubmissionCounter
+    list_display = ["user", "day", "used", "last_process"]
+    readonly_fields = ["user", "last_process"]
+
 admin.site.register(Exercise, ExerciseAdmin)
 
 admin.site.register(SubExercise, SubExercisesAdmin)
@@ -95,9 +118,13 @@ admin.site.register(GradingProcess, ProcessAdmin)
 
 admin.site.register(DailyLimit, DailyLimitAdmin)
 
+admin.site.register(SubmissionCounter, SubmissionCounterAdmin)
+
 admin.site.register(StudentNotebook)
 
-admin.site.register(WorkerAssignment)
+admin.site.register(WorkerAssignment, WorkerAssignmentAdmin)
+
+admin.site.register(WorkerHeartbeat, WorkerHeartbeatAdmin)
 
 admin.site.register(Grading)
 
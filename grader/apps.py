@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GraderConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "grader"
+
+    def ready(self):
+        # connects the signals invalidating the cached exercise catalogue
+        from grader import catalogue  # noqa: F401
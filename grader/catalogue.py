@@ -0,0 +1,104 @@
+"""
+The catalogue of the exercises with their time windows and the files offered for download, read by the landing pages.
+It changes when a lecturer uploads a notebook, so it is kept in the cache instead of being queried on every request.
+The catalogue is stored under a version, which is replaced after a transaction saving an exercise or notebook
+commits: a request building the catalogue from the previous state stores it under the outdated version.
+Without NBBB_CACHE_URL every server process has a cache of its own, whose catalogue is only invalidated by
+the changes made in that process, the others see them after CATALOGUE_TIMEOUT seconds.
+"""
+import datetime
+import time
+import typing
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from grader.models import Exercise, Notebook
+
+KEY = "grader:catalogue"
+VERSION_KEY = "grader:catalogue:version"
+# while the workers generate the release notebook of an exercise, its download is looked for more often
+PENDING_RELEASE_TIMEOUT = 10
+
+
+@dataclass(frozen=True)
+class CatalogueExercise:
+    identifier: str
+    start_date: datetime.datetime
+    stop_date: datetime.datetime
+    # the notebook of the exercise, None if it has none
+    filename: typing.Optional[str] = None
+    uploaded_at: typing.Optional[datetime.datetime] = None
+    has_data: bool = False
+    has_assets: bool = False
+    has_release: bool = False
+
+    def running(self) -> bool:
+        """Same as Exercise.running()"""
+        n = datetime.datetime.now().timestamp()
+        return self.start_date.timestamp() <= n <= self.stop_date.timestamp()
+
+
+def _build() -> typing.Dict[str, CatalogueExercise]:
+    # the sizes of the files instead of the files themselves
+    notebooks = {
+        notebook["in_exercise"]: notebook
+        for notebook in Notebook.objects.values(
+            "in_exercise", "filename", "uploaded_at", "data_size", "assets_size", "release_data_size"
+        )
+    }
+    catalogue = {}
+    for identifier, start_date, stop_date in Exercise.objects.values_list("identifier", "start_date", "stop_date"):
+        notebook = notebooks.get(identifier)
+        if notebook is None:
+            catalogue[identifier] = CatalogueExercise(identifier, start_date, stop_date)
+            continue
+        catalogue[identifier] = CatalogueExercise(
+            identifier,
+            start_date,
+            stop_date,
+            filename=notebook["filename"],
+            uploaded_at=notebook["uploaded_at"],
+            has_data=bool(notebook["data_size"]),
+            has_assets=bool(notebook["assets_size"]),
+            has_release=bool(notebook["release_data_size"]),
+        )
+    return catalogue
+
+
+def exercises() -> typing.Dict[str, CatalogueExercise]:
+    """The exercises by their identifier, from the cache or built from the database if it is outdated"""
+    version = cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+    catalogue = cache.get(KEY, version=version)
+    if catalogue is None:
+        catalogue = _build()
+        # the workers store the release notebook without telling the web tier
+        pending = any(ex.has_data and not ex.has_release for ex in catalogue.values())
+        cache.set(KEY, catalogue, PENDING_RELEASE_TIMEOUT if pending else settings.CATALOGUE_TIMEOUT, version=version)
+    return catalogue
+
+
+def exercise(identifier: str) -> typing.Optional[CatalogueExercise]:
+    return exercises().get(identifier)
+
+
+def invalidate() -> None:
+    """Outdates the catalogue once the current transaction commits, or right away outside of a transaction"""
+    transaction.on_commit(_new_version)
+
+
+def _new_version() -> None:
+    # a new value rather than an increment, so a version evicted from the cache is not used again
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+@receiver(post_save, sender=Exercise)
+@receiver(post_delete, sender=Exercise)
+@receiver(post_save, sender=Notebook)
+@receiver(post_delete, sender=Notebook)
+def _changed(sender, **kwargs):
+    invalidate()
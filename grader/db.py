@@ -0,0 +1,28 @@
+"""
+Connections of the web tier to the database.
+Queries go through the connection of django, which is opened on the first query, reused for CONN_MAX_AGE seconds
+and checked before it is reused after an error (CONN_HEALTH_CHECKS), see DATABASES in the settings.
+Only listening for notifications needs a connection of its own, since LISTEN is bound to the session:
+it is opened here, directly to the database even if the queries go through pgbouncer.
+"""
+import psycopg2
+import psycopg2.extensions
+from django.conf import settings
+
+
+def listen(*channels: str) -> psycopg2.extensions.connection:
+    """Opens a connection in autocommit mode listening on the channels, the caller closes it"""
+    db = settings.DATABASES["default"]
+    connection = psycopg2.connect(
+        host=settings.DB_LISTEN_HOST,
+        port=settings.DB_LISTEN_PORT,
+        dbname=db["NAME"],
+        user=db["USER"],
+        password=db["PASSWORD"],
+        application_name="nbblackbox-listen",
+    )
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with connection.cursor() as cursor:
+        for channel in channels:
+            cursor.execute(f"LISTEN {channel};")
+    return connection
@@ -0,0 +1,71 @@
+"""Report of the grading latencies per exercise and day, from the lifecycle timestamps of the grading processes."""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+# the phases of a grading process, as the interval between two of its timestamps
+PHASES = {
+    "queue wait": ("requested_at", "claimed_at"),
+    "execution": ("claimed_at", "coalesce(graded_at, errored_at)"),
+    "notification": ("coalesce(graded_at, errored_at)", "notified_at"),
+    "total": ("requested_at", "coalesce(graded_at, errored_at)"),
+}
+
+
+class Command(BaseCommand):
+    help = "Reports the p50/p95/p99 latencies of the grading processes per exercise and day, and the share finished within the SLO"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Number of days to report, including today")
+        parser.add_argument("--exercise", help="Report only this exercise")
+        parser.add_argument("--slo", type=int, default=300, help="Seconds from the request to the result a grading should take")
+
+    def handle(self, *args, **options):
+        end = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        start = end - timedelta(days=options["days"])
+        percentiles = ",\n".join(
+            f"percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY extract(epoch FROM {until} - {since}))"
+            for since, until in PHASES.values()
+        )
+        # a range scan on the requested_at indexes, the timestamps are columns of the process itself
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT for_exercise, date_trunc('day', requested_at AT TIME ZONE %s)::date AS day,
+                    count(*), count(graded_at), count(errored_at),
+                    count(*) FILTER (WHERE coalesce(graded_at, errored_at) <= requested_at + %s * interval '1 second'),
+                    {percentiles}
+                FROM gradingprocess
+                WHERE requested_at >= %s AND requested_at < %s AND (%s::text IS NULL OR for_exercise = %s)
+                GROUP BY GROUPING SETS ((for_exercise, day), (for_exercise))
+                ORDER BY for_exercise, day NULLS LAST;
+                """,
+                [settings.TIME_ZONE, options["slo"], start, end, options["exercise"], options["exercise"]],
+            )
+            rows = cursor.fetchall()
+
+        if not rows:
+            self.stdout.write(f"No grading requests since {start:%Y-%m-%d}")
+            return
+        header = ["exercise", "day", "requests", "graded", "errors", f"<= {options['slo']}s"] + list(PHASES)
+        table = [header]
+        for exercise, day, requests, graded, errors, within_slo, *latencies in rows:
+            finished = graded + errors
+            table.append(
+                [
+                    exercise,
+                    day.isoformat() if day else "all",
+                    str(requests),
+                    str(graded),
+                    str(errors),
+                    f"{within_slo / finished:.1%}" if finished else "-",
+                ]
+                + ["/".join(f"{value:.1f}" for value in latency) if latency else "-" for latency in latencies]
+            )
+        widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+        self.stdout.write("Latencies in seconds as p50/p95/p99")
+        for row in table:
+            self.stdout.write("  ".join(value.ljust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,370 @@
+"""Load test of the whole grading pipeline, from the request of a student to the notification of the result."""
+import os
+import select
+import shlex
+import signal
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import typing
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from grader import db
+from grader.models import DailyLimit, ErrorLog, Exercise, Grading, GradingProcess, SubmissionCounter
+
+DEFAULT_NOTEBOOK = settings.BASE_DIR / "testdata" / "source" / "UB-1" / "UB-1.ipynb"
+USER_PREFIX = "loadtest-"
+# the simulated users log in without keycloak
+BACKEND = "django.contrib.auth.backends.ModelBackend"
+
+# counters of pg_stat_database compared before and after the run
+DB_COUNTERS = [
+    "xact_commit",
+    "xact_rollback",
+    "tup_returned",
+    "tup_fetched",
+    "tup_inserted",
+    "tup_updated",
+    "tup_deleted",
+    "blks_read",
+    "blks_hit",
+]
+
+
+def percentile(values: typing.List[float], p: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+class ResultListener(threading.Thread):
+    """Records when the result of each process is announced on notify_student, on its own connection"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.conn = db.listen("notify_student")
+        self.finished: typing.Dict[str, float] = {}
+        self.events: typing.Dict[str, threading.Event] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def event(self, process_id: str) -> threading.Event:
+        with self.lock:
+            return self.events.setdefault(process_id, threading.Event())
+
+    def run(self):
+        while not self.stopped.is_set():
+            if select.select([self.conn], [], [], 0.5) == ([], [], []):
+                continue
+            self.conn.poll()
+            now = time.monotonic()
+            while self.conn.notifies:
+                process_id = self.conn.notifies.pop(0).payload
+                self.finished.setdefault(process_id, now)
+                self.event(process_id).set()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.conn.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a load test: seeds an exercise from a notebook, lets simulated students request gradings "
+        "through the grading view while nbworker processes grade them, and reports throughput, latency and database load"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=10, help="Number of concurrent simulated students")
+        parser.add_argument("--workers", type=int, default=1, help="Number of nbworker processes to start, 0 to use running workers")
+        parser.add_argument("--duration", type=int, default=60, help="Seconds the students keep submitting")
+        parser.add_argument("--think", type=float, default=5, help="Seconds a student waits after a result or rejection")
+        parser.add_argument("--drain", type=int, default=300, help="Seconds to wait for outstanding results at the end")
+        parser.add_argument("--warmup", type=int, default=15, help="Seconds the started workers get to generate the assignment")
+        parser.add_argument("--bench", action="store_true", help="Bypass the daily limit and REQUEST_TIME_LIMIT")
+        parser.add_argument("--exercise", default="LOADTEST-UB-1", help="Identifier of the exercise seeded for the test")
+        parser.add_argument("--notebook", default=str(DEFAULT_NOTEBOOK), help="Source notebook of the exercise, also submitted by the students")
+        parser.add_argument("--submission", help="Notebook submitted by the students instead of the source notebook")
+        parser.add_argument("--worker-command", default="nbworker", help="Command starting one worker")
+        parser.add_argument("--replay", type=float, metavar="SPEED", help="Replay the requests recorded in gradingprocess at this speed instead of simulating students")
+        parser.add_argument("--trace-exercise", help="Replay only the requests of this exercise")
+        parser.add_argument("--trace-from", help="Replay only the requests from this time on (ISO 8601)")
+        parser.add_argument("--trace-to", help="Replay only the requests up to this time (ISO 8601)")
+
+    def handle(self, *args, **options):
+        self.options = options
+        with open(options["notebook"], "rb") as f:
+            source = f.read()
+        self.submission = source
+        if options["submission"]:
+            with open(options["submission"], "rb") as f:
+                self.submission = f.read()
+
+        trace = self.load_trace() if options["replay"] else None
+        students = len({student for student, _ in trace}) if trace is not None else options["students"]
+
+        overrides = {
+            # the grading view only works with authenticated users
+            "NEED_GRADING_AUTH": True,
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+        }
+        if options["bench"]:
+            overrides["REQUEST_TIME_LIMIT"] = 0
+        with override_settings(**overrides):
+            self.seed(source, students)
+            workers = self.start_workers()
+            listener = ResultListener()
+            listener.start()
+            self.submitted: typing.Dict[str, float] = {}
+            self.rejected = 0
+            self.lock = threading.Lock()
+            activity = []
+            try:
+                if workers:
+                    self.stdout.write(f"Waiting {options['warmup']}s for the workers to start")
+                    time.sleep(options["warmup"])
+                stats_before = self.database_stats()
+                sampling = threading.Event()
+                sampler = threading.Thread(target=self.sample_activity, args=(sampling, activity), daemon=True)
+                sampler.start()
+                started = time.monotonic()
+                if trace is not None:
+                    self.replay(trace, listener)
+                else:
+                    self.simulate(students, listener)
+                self.wait_for_results(listener)
+                ended = time.monotonic()
+                sampling.set()
+                sampler.join()
+                stats_after = self.database_stats()
+            finally:
+                listener.stop()
+                self.stop_workers(workers)
+        self.report(listener, started, ended, stats_before, stats_after, activity)
+
+    def load_trace(self) -> typing.List[typing.Tuple[int, float]]:
+        """Returns the simulated student and offset in seconds of the recorded requests to replay, in order"""
+        processes = GradingProcess.objects.exclude(email__startswith=USER_PREFIX).order_by("requested_at")
+        if self.options["trace_exercise"]:
+            processes = processes.filter(for_exercise=self.options["trace_exercise"])
+        for option, lookup in (("trace_from", "requested_at__gte"), ("trace_to", "requested_at__lte")):
+            if self.options[option]:
+                moment = parse_datetime(self.options[option])
+                if moment is None:
+                    raise CommandError(f"Invalid time {self.options[option]}")
+                processes = processes.filter(**{lookup: moment})
+        recorded = list(processes.values_list("email", "requested_at"))
+        if not recorded:
+            raise CommandError("No recorded requests to replay")
+        start = recorded[0][1]
+        # every recorded student is replayed by one simulated student
+        students = {}
+        for email, _ in recorded:
+            students.setdefault(email, len(students))
+        return [(students[email], (requested_at - start).total_seconds()) for email, requested_at in recorded]
+
+    def seed(self, source: bytes, students: int) -> None:
+        """Creates the exercise through the autocreation view and the simulated students"""
+        staff, _ = User.objects.get_or_create(
+            username=f"{USER_PREFIX}staff", defaults={"email": f"{USER_PREFIX}staff@example.org", "is_staff": True}
+        )
+        # the results of previous runs would count against the limits of the students
+        GradingProcess.objects.filter(email__startswith=USER_PREFIX).delete()
+        SubmissionCounter.objects.filter(user__username__startswith=USER_PREFIX).delete()
+        client = Client()
+        client.force_login(staff, backend=BACKEND)
+        now = timezone.localtime()
+        response = client.post(
+            reverse("autocreate"),
+            {
+                "exercise_identifier": self.options["exercise"],
+                "start_date": (now - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M"),
+                "stop_date": (now + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M"),
+                # the filename identifies the notebook, so it must not collide with the one of a real exercise
+                "notebook": SimpleUploadedFile(f"{self.options['exercise']}.ipynb", source),
+            },
+        )
+        if response.status_code != 200:
+            raise CommandError(f"Creating the exercise failed with status {response.status_code}")
+        self.exercise = Exercise.objects.get(identifier=self.options["exercise"])
+
+        self.students = []
+        for i in range(students):
+            user, _ = User.objects.get_or_create(
+                username=f"{USER_PREFIX}{i}", defaults={"email": f"{USER_PREFIX}{i}@example.org"}
+            )
+            if self.options["bench"]:
+                DailyLimit.objects.update_or_create(user_id=user, defaults={"limit": 1_000_000})
+            else:
+                DailyLimit.objects.filter(user_id=user).delete()
+            self.students.append(user)
+        self.stdout.write(f"Seeded exercise {self.exercise.identifier} and {students} student(s)")
+
+    def start_workers(self) -> typing.List[subprocess.Popen]:
+        db = settings.DATABASES["default"]
+        directory = tempfile.mkdtemp(prefix="loadtest-")
+        workers = []
+        for i in range(self.options["workers"]):
+            root = os.path.join(directory, f"worker-{i}")
+            os.makedirs(os.path.join(root, "course", "source"))
+            env = {
+                **os.environ,
+                "POSTGRES_HOST": db["HOST"],
+                "POSTGRES_PORT": str(db["PORT"]),
+                "POSTGRES_DB": db["NAME"],
+                "POSTGRES_USER": db["USER"],
+                "POSTGRES_PASSWORD": db["PASSWORD"],
+                "COURSE_DIRECTORY": os.path.join(root, "course"),
+                "SLOT_DIRECTORY": os.path.join(root, "slots"),
+                "METRICS_PORT": "0",
+            }
+            with open(os.path.join(root, "worker.log"), "wb") as log:
+                workers.append(
+                    subprocess.Popen(shlex.split(self.options["worker_command"]), env=env, stdout=log, stderr=subprocess.STDOUT)
+                )
+        if workers:
+            self.stdout.write(f"Started {len(workers)} worker(s), logs in {directory}")
+        return workers
+
+    def stop_workers(self, workers: typing.List[subprocess.Popen]) -> None:
+        for worker in workers:
+            worker.send_signal(signal.SIGTERM)
+        for worker in workers:
+            try:
+                worker.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+    def submit(self, student: User) -> typing.Optional[str]:
+        """Requests a grading as the student, returns the process id or None if the request was rejected"""
+        client = Client()
+        try:
+            client.force_login(student, backend=BACKEND)
+            requested = time.monotonic()
+            response = client.post(
+                reverse("request", args=[self.exercise.identifier]),
+                {"notebook": SimpleUploadedFile("submission.ipynb", self.submission)},
+            )
+        finally:
+            # the test client does not end the request like a server, the connection would stay with the thread
+            # until the student stops, and the students would wait for each other on the pool of this process
+            connection.close()
+        location = response.get("Location", "")
+        if response.status_code != 302 or "id=" not in location:
+            with self.lock:
+                self.rejected += 1
+            return None
+        process_id = str(uuid.UUID(location.split("id=", 1)[1]))
+        with self.lock:
+            self.submitted[process_id] = requested
+        return process_id
+
+    def simulate(self, students: int, listener: ResultListener) -> None:
+        """Every student submits, waits for the result and submits again until the duration is over"""
+        end = time.monotonic() + self.options["duration"]
+
+        def student_loop(student: User):
+            try:
+                while time.monotonic() < end:
+                    process_id = self.submit(student)
+                    if process_id is not None:
+                        listener.event(process_id).wait(max(0.0, end - time.monotonic()))
+                    time.sleep(self.options["think"])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=students) as pool:
+            for result in [pool.submit(student_loop, student) for student in self.students]:
+                result.result()
+
+    def replay(self, trace: typing.List[typing.Tuple[int, float]], listener: ResultListener) -> None:
+        """Submits the recorded requests at the recorded offsets divided by the speed"""
+        started = time.monotonic()
+
+        def request(student: User):
+            try:
+                self.submit(student)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(self.students)) as pool:
+            for student, offset in trace:
+                time.sleep(max(0.0, started + offset / self.options["replay"] - time.monotonic()))
+                pool.submit(request, self.students[student])
+
+    def wait_for_results(self, listener: ResultListener) -> None:
+        end = time.monotonic() + self.options["drain"]
+        for process_id in list(self.submitted):
+            if not listener.event(process_id).wait(max(0.0, end - time.monotonic())):
+                break
+
+    def database_stats(self) -> typing.Dict[str, int]:
+        with connection.cursor() as cursor:
+            # the statistics are cached per transaction
+            cursor.execute("SELECT pg_stat_clear_snapshot();")
+            cursor.execute(
+                f"SELECT {', '.join(DB_COUNTERS)} FROM pg_stat_database WHERE datname = current_database();"
+            )
+            return dict(zip(DB_COUNTERS, cursor.fetchone()))
+
+    def sample_activity(self, stopped: threading.Event, samples: typing.List[int]) -> None:
+        """Samples the number of active connections to the database every second"""
+        try:
+            while not stopped.wait(1):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND state = 'active';"
+                    )
+                    samples.append(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def report(self, listener, started, ended, stats_before, stats_after, activity) -> None:
+        latencies = [
+            listener.finished[process_id] - requested
+            for process_id, requested in self.submitted.items()
+            if process_id in listener.finished
+        ]
+        graded = Grading.objects.filter(process__in=self.submitted.keys()).values("process").distinct().count()
+        failed = ErrorLog.objects.filter(process__in=self.submitted.keys()).count()
+        elapsed = ended - started
+
+        self.stdout.write("")
+        self.stdout.write(f"Duration:           {elapsed:.1f}s")
+        self.stdout.write(f"Submissions:        {len(self.submitted)} accepted, {self.rejected} rejected")
+        self.stdout.write(f"Results:            {len(latencies)} ({graded} graded, {failed} errors), {len(self.submitted) - len(latencies)} outstanding")
+        self.stdout.write(f"Throughput:         {len(latencies) / elapsed * 60:.1f} submissions/min")
+        if latencies:
+            self.stdout.write(
+                "Latency:            "
+                + ", ".join(f"p{p} {percentile(latencies, p):.2f}s" for p in (50, 95, 99))
+                + f", max {max(latencies):.2f}s"
+            )
+        delta = {counter: stats_after[counter] - stats_before[counter] for counter in DB_COUNTERS}
+        self.stdout.write(
+            f"Database:           {delta['xact_commit'] / elapsed:.1f} commits/s, {delta['xact_rollback']} rollbacks, "
+            f"{(delta['tup_returned'] + delta['tup_fetched']) / elapsed:.0f} rows read/s, "
+            f"{(delta['tup_inserted'] + delta['tup_updated'] + delta['tup_deleted']) / elapsed:.1f} rows written/s"
+        )
+        blocks = delta["blks_hit"] + delta["blks_read"]
+        if blocks:
+            self.stdout.write(f"Buffer hit ratio:   {delta['blks_hit'] / blocks:.1%}")
+        if activity:
+            self.stdout.write(
+                f"Active connections: mean {statistics.mean(activity):.1f}, max {max(activity)}"
+            )
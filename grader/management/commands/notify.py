@@ -3,9 +3,12 @@ from django.core.management.base import BaseCommand
 from datetime import timedelta
 from django.core.mail import send_mail
 from django.conf import settings
-import psycopg2, os, asyncio
+from django.db import close_old_connections, connection
+import psycopg2, select, time
 import logging
 
+from grader import db
+
 # import asyncpg, asyncio, os
 
 MAIL_TEMPLATE = lambda x: f"""Hallo,
@@ -35,32 +38,61 @@ HTML_MAIL_TEMPLATE = lambda x: f"""
 <br>
 <footer style="color: darkgrey; font_size: small;">Diese Email ist autogeneriert. Bitte antworten Sie nicht auf diese E-Mail. Bei Fragen wenden Sie sich bitte an dbis-ticket@dbis.rwth-aachen.de.</footer>
 """
-conn = psycopg2.connect(host=os.getenv("NBBB_DB_HOST", "localhost"), 
-                dbname=os.getenv("NBBB_DB_NAME", "grader"), 
-                user=os.getenv("NBBB_DB_USER", "user"), 
-                password=os.getenv("NBBB_DB_PASSWD", "password"))
-conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-
-cursor = conn.cursor()
-cursor.execute(f"LISTEN notify_student;")
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# seconds to wait before listening again after the connection was lost
+RECONNECT_DELAY = 5
+# how long ago a process may have finished to be caught up, older ones are never mailed
+# (e.g. processes failed before the failures were mailed, which would be announced months later)
+CATCH_UP_WINDOW = timedelta(days=1)
+
 class Command(BaseCommand):
     # help = 'Flush emails to students to notify them of finished grading processes'
     # asyncio.run(notify_students())
 
     def handle(self, *args, **options):
-        cursor.execute(f"LISTEN notify_student;")
-
-        loop = asyncio.get_event_loop()
-        loop.add_reader(conn, self.handle_notify)
-        loop.run_forever()
-
-    def handle_notify(self):
+        # the queries use the connection of django, which must not be used in an event loop, so wait with select
+        while True:
+            try:
+                conn = db.listen("notify_student")
+            except psycopg2.Error as e:
+                logger.error(f"Could not listen for finished grading processes: {e}")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                # after LISTEN, so a process finishing meanwhile is announced as well
+                self.catch_up()
+                while True:
+                    select.select([conn], [], [])
+                    self.handle_notify(conn)
+            except psycopg2.Error as e:
+                logger.error(f"Lost the connection listening for finished grading processes: {e}")
+                conn.close()
+                time.sleep(RECONNECT_DELAY)
+
+    def catch_up(self) -> None:
+        """Notifies for the processes finished while no command was listening in the last CATCH_UP_WINDOW, on start and after a lost connection"""
+        close_old_connections()
+        with connection.cursor() as cursor:
+            # processes finished before the lifecycle was recorded have neither graded_at nor errored_at
+            cursor.execute(
+                """
+                SELECT identifier FROM gradingprocess
+                WHERE state IN ('graded', 'failed') AND NOT notified
+                    AND coalesce(graded_at, errored_at, requested_at) > now() - %s
+                ORDER BY requested_at;
+                """,
+                [CATCH_UP_WINDOW],
+            )
+            for (process_id,) in cursor.fetchall():
+                self.send_mail_to_student(process_id)
+
+    def handle_notify(self, conn):
         conn.poll()
+        # the connection of django is kept open between the notifications, reconnect if it broke meanwhile
+        close_old_connections()
         for notify in conn.notifies:
             # logger.info("Received notification for process: %s", notify.payload)
             process_id = notify.payload
@@ -69,12 +101,16 @@ class Command(BaseCommand):
 
     def send_mail_to_student(self, process_id) -> None:
         try:
-            cursor.execute("""SELECT identifier, email FROM gradingprocess WHERE identifier = %s;""", [str(process_id)])
-            process = cursor.fetchone()
+            with connection.cursor() as cursor:
+                # a process announced again, e.g. found by catch_up before its notification arrived, is mailed once
+                cursor.execute("""SELECT identifier, email, notified FROM gradingprocess WHERE identifier = %s;""", [str(process_id)])
+                process = cursor.fetchone()
             
             if not process:
                 logger.warning(f"No process found for identifier: {process_id}")
                 return
+            if process[2]:
+                return
             
             send_mail(
                 settings.EMAIL_HEADER,
@@ -90,10 +126,13 @@ class Command(BaseCommand):
             return
         else:
             try:
-              cursor.execute("""
-                             UPDATE gradingprocess SET notified = true WHERE identifier = %s;""",
-                             [process[0]]
-                             )
+              with connection.cursor() as cursor:
+                cursor.execute("""
+                               UPDATE gradingprocess SET notified = true, notified_at = now(),
+                                   state = CASE WHEN state = 'graded' THEN 'notified' ELSE state END
+                               WHERE identifier = %s;""",
+                               [process[0]]
+                               )
             except Exception as e:
                 logger.error(f"Error updating tables: {e}")
                 return
@@ -0,0 +1,67 @@
+"""
+The middlewares of whitenoise and django-maintenance-mode are only sync capable. Under ASGI, django would run every
+request from the first of them on in a thread of its own, including the async views and the waiting event streams.
+These subclasses also handle the requests asynchronously and only use a thread for the rare requests which need one.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpRequest
+from maintenance_mode.core import get_maintenance_mode
+from maintenance_mode.middleware import MaintenanceModeMiddleware as BaseMaintenanceModeMiddleware
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """Serves the static files in a thread, the other requests are passed on right away"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request: HttpRequest):
+        if self.autorefresh:
+            # looks for the file on disk, only with DEBUG
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class MaintenanceModeMiddleware(BaseMaintenanceModeMiddleware):
+    """
+    Passes the requests on right away while the maintenance mode is off.
+    The views are not forced into maintenance mode with the decorators of django-maintenance-mode,
+    otherwise they would have to be checked while it is off, too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request: HttpRequest):
+        # the state is an environment variable or a small file
+        if get_maintenance_mode():
+            # which users and addresses are let through is checked on the user loaded synchronously
+            response = await sync_to_async(self.process_request)(request)
+            if response is not None:
+                return response
+        return await self.get_response(request)
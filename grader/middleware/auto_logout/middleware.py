@@ -1,13 +1,15 @@
 import logging
+from datetime import datetime, timedelta
 from typing import Callable
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from django.contrib.auth import get_user_model, logout
 from django.contrib.messages import info
 from django.shortcuts import redirect
+from django.utils.decorators import sync_and_async_middleware
 from grader.auth import provider_logout
 from django.db import connection
-from django.contrib.sessions.models import Session
 
 from .utils import now, seconds_until_idle_time_end, seconds_until_session_end
 
@@ -15,7 +17,17 @@ UserModel = get_user_model()
 logger = logging.getLogger(__name__)
 
 
-def _auto_logout(request: HttpRequest, options):
+def _idle_timestamp_outdated(request: HttpRequest, options, current_time) -> bool:
+    """Whether the timestamp of the last request is missing or older than IDLE_TIME_RESOLUTION"""
+    last_request = request.session.get('django_auto_logout_last_request')
+    if last_request is None:
+        return True
+    resolution = options.get('IDLE_TIME_RESOLUTION', timedelta(0))
+    return current_time - datetime.fromisoformat(last_request) >= resolution
+
+
+def _auto_logout(request: HttpRequest, options) -> bool:
+    """Renews the time of the last request in the session and tells whether the user has to be logged out"""
     should_logout = False
     current_time = now()
 
@@ -31,39 +43,56 @@ def _auto_logout(request: HttpRequest, options):
 
         if should_logout and 'django_auto_logout_last_request' in request.session:
             del request.session['django_auto_logout_last_request']
-        else:
+        elif _idle_timestamp_outdated(request, options, current_time):
+            # every change saves the session, so the timestamp is only renewed once it is older than the resolution
             request.session['django_auto_logout_last_request'] = current_time.isoformat()
 
-    if should_logout:
-        logger.debug('Logout user %s', request.user)
+    return should_logout
+
 
-        # Remove Django session from the database
-        sid = request.session.session_key
-        try:
-            Session.objects.filter(session_key=sid).delete()
-            print("Django session deleted for session key: %s", sid)
-        except Exception as e:
-            logger.error("Error deleting Django session: %s", str(e))
+def _logout(request: HttpRequest, options):
+    logger.debug('Logout user %s', request.user)
 
-        # Remove Keycloak session from the database
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("DELETE FROM keycloak_session WHERE django_sid = %s", [sid])
-                print("Keycloak session deleted for session key: %s", sid)
-        except Exception as e:
-            logger.error("Error deleting Keycloak session: %s", str(e))
+    # the Django session is deleted by logout(), also from the cache of the session engine
+    sid = request.session.session_key
 
-        # Redirect to the logout URL
-        logout(request)
+    # Remove Keycloak session from the database
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM keycloak_session WHERE django_sid = %s", [sid])
+            print("Keycloak session deleted for session key: %s", sid)
+    except Exception as e:
+        logger.error("Error deleting Keycloak session: %s", str(e))
 
-        if 'MESSAGE' in options:
-            info(request, options['MESSAGE'])
+    # Redirect to the logout URL
+    logout(request)
 
+    if 'MESSAGE' in options:
+        info(request, options['MESSAGE'])
 
+
+@sync_and_async_middleware
 def auto_logout(get_response: Callable[[HttpRequest], HttpResponse]) -> Callable:
+    """
+    Logs out idle users. Under ASGI the async views are not run in a thread because of it:
+    the user and the session are loaded asynchronously, only logging out runs in a thread.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest) -> HttpResponse:
+            user = await request.auser()
+            if not user.is_anonymous and hasattr(settings, 'AUTO_LOGOUT'):
+                # the checks below read the user and the session loaded by auser() instead of loading them again
+                request.user = user
+                if _auto_logout(request, settings.AUTO_LOGOUT):
+                    await sync_to_async(_logout)(request, settings.AUTO_LOGOUT)
+
+            return await get_response(request)
+        return middleware
+
     def middleware(request: HttpRequest) -> HttpResponse:
         if not request.user.is_anonymous and hasattr(settings, 'AUTO_LOGOUT'):
-            _auto_logout(request, settings.AUTO_LOGOUT)
+            if _auto_logout(request, settings.AUTO_LOGOUT):
+                _logout(request, settings.AUTO_LOGOUT)
 
         return get_response(request)
     return middleware
@@ -0,0 +1,129 @@
+"""
+Measures the queries, the database time and the template rendering time of every request.
+The measurements are sent in the Server-Timing header, shown by the network tab of the browsers,
+and requests running more queries than QUERY_BUDGET are logged with their view.
+"""
+import contextvars
+import logging
+import time
+import typing
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Timing:
+    queries: int = 0
+    db: float = 0.0
+    template: float = 0.0
+
+    def header(self, total: float) -> str:
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f"template;dur={self.template * 1000:.1f}, total;dur={total * 1000:.1f}"
+        )
+
+
+# the timing of the current request, copied into the threads running the sync code of async views
+_current: contextvars.ContextVar[typing.Optional[Timing]] = contextvars.ContextVar("timing", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.queries += 1
+        timing.db += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def _install(sender, connection, **kwargs):
+    # on every connection, the connections of django are per thread
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timing = _current.get()
+        if timing is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timing.template += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The template backend of django, measuring the time spent rendering templates"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class ServerTimingMiddleware:
+    """
+    Outermost middleware, so the measurements cover the other middlewares.
+    The timing of the request is available as request.timing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing, token, start = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, start)
+
+    async def __acall__(self, request: HttpRequest):
+        timing, token, start = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, start)
+
+    def start(self, request: HttpRequest):
+        timing = Timing()
+        request.timing = timing
+        return timing, _current.set(timing), time.perf_counter()
+
+    def finish(self, request: HttpRequest, response: HttpResponse, timing: Timing, start: float) -> HttpResponse:
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = timing.header(time.perf_counter() - start)
+        if timing.queries > settings.QUERY_BUDGET:
+            view = request.resolver_match.view_name if request.resolver_match else request.path
+            logger.warning(
+                f"{view} ran {timing.queries} queries in {timing.db * 1000:.1f} ms, "
+                f"more than the budget of {settings.QUERY_BUDGET}"
+            )
+        return response
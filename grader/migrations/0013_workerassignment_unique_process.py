@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0012_dailylimit_delete_dailycontingent"),
+    ]
+
+    operations = [
+        # every listening worker used to grade each process, keep only the first assignment
+        migrations.RunSQL(
+            """
+            DELETE FROM workerassignment WHERE id NOT IN (
+                SELECT MIN(id) FROM workerassignment GROUP BY process
+            );
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="workerassignment",
+            constraint=models.UniqueConstraint(
+                fields=("process",), name="unique_workerassignment_for_process"
+            ),
+        ),
+    ]
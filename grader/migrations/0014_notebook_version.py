@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 11:40
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def compute_versions(apps, schema_editor):
+    Notebook = apps.get_model("grader", "Notebook")
+    for notebook in Notebook.objects.all():
+        h = hashlib.sha256(bytes(notebook.data))
+        if notebook.assets is not None:
+            h.update(bytes(notebook.assets))
+        notebook.version = h.hexdigest()
+        notebook.save(update_fields=["version"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0013_workerassignment_unique_process"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notebook",
+            name="version",
+            field=models.CharField(
+                db_column="version",
+                default="",
+                editable=False,
+                max_length=64,
+                verbose_name="Content hash",
+            ),
+        ),
+        migrations.RunPython(compute_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0014_notebook_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WorkerHeartbeat",
+            fields=[
+                ("worker_id", models.UUIDField(db_column="worker_id", editable=False, primary_key=True, serialize=False)),
+                ("started_at", models.DateTimeField(db_column="started_at")),
+                ("last_seen", models.DateTimeField(db_column="last_seen")),
+                ("expires_at", models.DateTimeField(db_column="expires_at")),
+                ("slots", models.PositiveIntegerField(db_column="slots", verbose_name="Grading slots")),
+                ("running", models.PositiveIntegerField(db_column="running", default=0, verbose_name="Running jobs")),
+            ],
+            options={
+                "db_table": "workerheartbeat",
+            },
+        ),
+        migrations.AddField(
+            model_name="workerassignment",
+            name="attempts",
+            field=models.PositiveIntegerField(db_column="attempts", default=1),
+        ),
+        migrations.AddField(
+            model_name="workerassignment",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, db_column="lease_expires_at", null=True, verbose_name="Lease expires at"),
+        ),
+    ]
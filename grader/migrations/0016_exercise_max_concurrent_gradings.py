@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0015_worker_heartbeat_and_leases"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exercise",
+            name="max_concurrent_gradings",
+            field=models.PositiveIntegerField(
+                blank=True,
+                db_column="max_concurrent_gradings",
+                null=True,
+                verbose_name="Maximal concurrent gradings",
+            ),
+        ),
+    ]
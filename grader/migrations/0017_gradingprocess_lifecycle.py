@@ -0,0 +1,49 @@
+# Generated by Django 5.1.3 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0016_exercise_max_concurrent_gradings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, db_column="claimed_at", null=True, verbose_name="Claimed by a worker at"),
+        ),
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="errored_at",
+            field=models.DateTimeField(blank=True, db_column="errored_at", null=True, verbose_name="Failed at"),
+        ),
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="graded_at",
+            field=models.DateTimeField(blank=True, db_column="graded_at", null=True, verbose_name="Graded at"),
+        ),
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="notified_at",
+            field=models.DateTimeField(blank=True, db_column="notified_at", null=True, verbose_name="User notified at"),
+        ),
+        migrations.AddIndex(
+            model_name="gradingprocess",
+            index=models.Index(fields=["requested_at"], name="gradingprocess_requested"),
+        ),
+        migrations.AddIndex(
+            model_name="gradingprocess",
+            index=models.Index(fields=["for_exercise", "requested_at"], name="gradingprocess_ex_requested"),
+        ),
+        # only the claims were recorded before
+        migrations.RunSQL(
+            """
+            UPDATE gradingprocess SET claimed_at = workerassignment.assigned_at
+            FROM workerassignment WHERE workerassignment.process = gradingprocess.identifier;
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0017_gradingprocess_lifecycle"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("graded", "Graded"),
+                    ("failed", "Failed"),
+                    ("notified", "Graded and notified"),
+                ],
+                db_column="state",
+                default="queued",
+                max_length=16,
+                verbose_name="State",
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE gradingprocess SET state = CASE
+                WHEN EXISTS (SELECT 1 FROM errorlog WHERE errorlog.process = gradingprocess.identifier) THEN 'failed'
+                WHEN EXISTS (SELECT 1 FROM grading WHERE grading.process = gradingprocess.identifier)
+                    THEN CASE WHEN notified THEN 'notified' ELSE 'graded' END
+                WHEN EXISTS (SELECT 1 FROM workerassignment WHERE workerassignment.process = gradingprocess.identifier)
+                    THEN 'running'
+                ELSE 'queued'
+            END;
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="gradingprocess",
+            index=models.Index(fields=["email", "requested_at"], include=("state", "identifier"), name="gradingprocess_email"),
+        ),
+        migrations.AddIndex(
+            model_name="gradingprocess",
+            index=models.Index(fields=["email", "for_exercise", "requested_at"], include=("state", "identifier"), name="gradingprocess_email_ex"),
+        ),
+        migrations.AddIndex(
+            model_name="gradingprocess",
+            index=models.Index(condition=models.Q(("state__in", ["queued", "running"])), fields=["requested_at"], name="gradingprocess_unfinished"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0018_gradingprocess_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gradingprocess",
+            name="result_summary",
+            field=models.JSONField(
+                blank=True, db_column="result_summary", editable=False, null=True, verbose_name="Result summary"
+            ),
+        ),
+        # the summaries of processes graded before are written on their first view, see GradingProcess.summarize()
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("grader", "0019_gradingprocess_result_summary"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SubmissionCounter",
+            fields=[
+                ("user", models.OneToOneField(db_column="user_id", on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ("day", models.DateField(db_column="day", verbose_name="Day")),
+                ("used", models.PositiveIntegerField(db_column="used", default=0, verbose_name="Requests on the day")),
+                ("last_process", models.ForeignKey(blank=True, db_column="last_process", null=True, on_delete=django.db.models.deletion.SET_NULL, to="grader.gradingprocess")),
+            ],
+            options={
+                "db_table": "submission_counter",
+            },
+        ),
+        migrations.CreateModel(
+            name="LastRequest",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("requested_at", models.DateTimeField(db_column="requested_at", verbose_name="Requested at")),
+                ("exercise", models.ForeignKey(db_column="exercise", on_delete=django.db.models.deletion.CASCADE, to="grader.exercise")),
+                ("process", models.ForeignKey(db_column="process", on_delete=django.db.models.deletion.CASCADE, to="grader.gradingprocess")),
+                ("user", models.ForeignKey(db_column="user_id", on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "db_table": "last_request",
+                "constraints": [models.UniqueConstraint(fields=("user", "exercise"), name="unique_last_request_per_exercise")],
+            },
+        ),
+        # the counters of today and the latest request per exercise, from the processes requested before
+        migrations.RunSQL(
+            [
+                (
+                    """
+                    INSERT INTO submission_counter (user_id, day, used, last_process)
+                    SELECT auth_user.id, (now() AT TIME ZONE %s)::date,
+                        count(*) FILTER (WHERE (gradingprocess.requested_at AT TIME ZONE %s)::date = (now() AT TIME ZONE %s)::date),
+                        (array_agg(gradingprocess.identifier ORDER BY gradingprocess.requested_at DESC))[1]
+                    FROM gradingprocess JOIN auth_user ON auth_user.email = gradingprocess.email
+                    GROUP BY auth_user.id;
+                    """,
+                    [settings.TIME_ZONE] * 3,
+                ),
+                """
+                INSERT INTO last_request (user_id, exercise, process, requested_at)
+                SELECT DISTINCT ON (auth_user.id, gradingprocess.for_exercise)
+                    auth_user.id, gradingprocess.for_exercise, gradingprocess.identifier, gradingprocess.requested_at
+                FROM gradingprocess JOIN auth_user ON auth_user.email = gradingprocess.email
+                WHERE gradingprocess.state <> 'failed'
+                ORDER BY auth_user.id, gradingprocess.for_exercise, gradingprocess.requested_at DESC;
+                """,
+            ],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0020_submission_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studentnotebook",
+            name="sha256",
+            field=models.CharField(blank=True, db_column="sha256", default="", max_length=64, verbose_name="Content hash"),
+        ),
+    ]
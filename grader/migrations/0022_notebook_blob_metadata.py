@@ -0,0 +1,74 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0021_studentnotebook_sha256"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notebook",
+            name="assets_content_type",
+            field=models.CharField(db_column="assets_content_type", editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="assets_sha256",
+            field=models.CharField(db_column="assets_sha256", editable=False, max_length=64, null=True, verbose_name="Assets hash"),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="assets_size",
+            field=models.PositiveBigIntegerField(db_column="assets_size", editable=False, null=True, verbose_name="Assets size"),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="data_content_type",
+            field=models.CharField(db_column="data_content_type", editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="data_sha256",
+            field=models.CharField(db_column="data_sha256", editable=False, max_length=64, null=True, verbose_name="Notebook hash"),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="data_size",
+            field=models.PositiveBigIntegerField(db_column="data_size", editable=False, null=True, verbose_name="Notebook size"),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="release_data_content_type",
+            field=models.CharField(db_column="release_data_content_type", editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="release_data_sha256",
+            field=models.CharField(db_column="release_data_sha256", editable=False, max_length=64, null=True, verbose_name="Release hash"),
+        ),
+        migrations.AddField(
+            model_name="notebook",
+            name="release_data_size",
+            field=models.PositiveBigIntegerField(db_column="release_data_size", editable=False, null=True, verbose_name="Release size"),
+        ),
+        # describe the files stored so far
+        migrations.RunSQL(
+            """
+            UPDATE notebook SET
+                data_size = length(data),
+                data_sha256 = encode(sha256(data), 'hex'),
+                data_content_type = 'application/x-ipynb+json',
+                assets_size = length(assets),
+                assets_sha256 = encode(sha256(assets), 'hex'),
+                assets_content_type = CASE WHEN assets IS NOT NULL THEN 'application/zip' END,
+                release_data_size = length(release_data),
+                release_data_sha256 = encode(sha256(release_data), 'hex'),
+                release_data_content_type = CASE WHEN release_data IS NOT NULL THEN 'application/x-ipynb+json' END;
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("grader", "0022_notebook_blob_metadata"),
+    ]
+
+    operations = [
+        # the points per subexercise of a grading process, written by the worker and by GradingProcess.summarize()
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION result_summary(process uuid) RETURNS jsonb LANGUAGE sql STABLE AS $$
+                SELECT coalesce(
+                    jsonb_agg(jsonb_build_object('label', label, 'score', achieved, 'max_score', max_points) ORDER BY position),
+                    '[]'
+                ) FROM (
+                    SELECT subexercise.label, SUM(grading.points) AS achieved, SUM(cell.max_score) AS max_points,
+                        MIN(subexercise.id) AS position
+                    FROM grading
+                        JOIN cell ON grading.cell = cell.id
+                        JOIN subexercise ON cell.sub_exercise = subexercise.id
+                    WHERE grading.process = result_summary.process
+                    GROUP BY subexercise.label
+                ) AS summary
+            $$;
+            """,
+            "DROP FUNCTION result_summary(uuid);",
+        ),
+    ]
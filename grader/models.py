@@ -1,5 +1,7 @@
 import uuid
-from django.db import models
+import json
+import hashlib
+from django.db import connection, models
 from django.contrib import admin
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
@@ -19,6 +21,10 @@ class Exercise(models.Model):
     stop_date = models.DateTimeField("End date exercise grading", db_column="stop_date")
 
     last_updated = models.DateTimeField("Exercise last updated", db_column="last_updated", auto_now=True)
+    # the workers grade at most this many submissions of the exercise at the same time, to keep capacity for other exercises
+    max_concurrent_gradings = models.PositiveIntegerField(
+        "Maximal concurrent gradings", db_column="max_concurrent_gradings", null=True, blank=True
+    )
 
     def __str__(self):
         return f"ID: {self.identifier}. Correction from {self.start_date} to {self.stop_date}."
@@ -42,6 +48,14 @@ class Exercise(models.Model):
 Models a grading process
 """
 class GradingProcess(models.Model):
+    class State(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        GRADED = "graded", "Graded"
+        FAILED = "failed", "Failed"
+        # only graded processes become notified, failed ones stay failed
+        NOTIFIED = "notified", "Graded and notified"
+
     identifier = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False, db_column="identifier"
     )
@@ -51,21 +65,87 @@ class GradingProcess(models.Model):
         Exercise, on_delete=models.CASCADE, db_column="for_exercise"
     )
     notified = models.BooleanField("User Notified", db_column="notified", default=False)
+    # maintained by the workers and the notify command together with the grading and error log,
+    # so finding the running or latest process of a user does not need to look into these tables
+    state = models.CharField("State", max_length=16, choices=State.choices, default=State.QUEUED, db_column="state")
+    # the points per subexercise as [{"label", "score", "max_score"}], written once by the worker storing the result
+    result_summary = models.JSONField("Result summary", null=True, blank=True, editable=False, db_column="result_summary")
+    # the lifecycle of the process, recorded by the workers and the notify command when it happens
+    claimed_at = models.DateTimeField("Claimed by a worker at", null=True, blank=True, db_column="claimed_at")
+    graded_at = models.DateTimeField("Graded at", null=True, blank=True, db_column="graded_at")
+    errored_at = models.DateTimeField("Failed at", null=True, blank=True, db_column="errored_at")
+    notified_at = models.DateTimeField("User notified at", null=True, blank=True, db_column="notified_at")
 
     def __str__(self):
         return f"ID: {self.identifier} for email: {self.email}. Request at: {self.requested_at.__str__()}"
 
     @admin.display(boolean=True, description="Processed")
     def processed(self):
-        return Grading.objects.filter(process=self.identifier).exists() or ErrorLog.objects.filter(process=self.identifier).exists()
+        return self.state not in GradingProcess.UNFINISHED
 
     class Meta:
         db_table = "gradingprocess"
+        # the latency report scans the processes requested in a time range
+        indexes = [
+            models.Index(fields=["requested_at"], name="gradingprocess_requested"),
+            models.Index(fields=["for_exercise", "requested_at"], name="gradingprocess_ex_requested"),
+            # the latest or running process of a user, answered from the index alone
+            models.Index(
+                fields=["email", "requested_at"], include=["state", "identifier"], name="gradingprocess_email"
+            ),
+            models.Index(
+                fields=["email", "for_exercise", "requested_at"],
+                include=["state", "identifier"],
+                name="gradingprocess_email_ex",
+            ),
+            # the queue of the workers
+            models.Index(
+                fields=["requested_at"],
+                condition=models.Q(state__in=["queued", "running"]),
+                name="gradingprocess_unfinished",
+            ),
+        ]
     
-    def count_grading_per_day(self):
-        start_of_day = datetime.combine(datetime.now().date(), datetime.min.time(), tzinfo=datetime.now().tzinfo)
-        end_of_day = datetime.combine(datetime.now().date(), datetime.max.time(), tzinfo=datetime.now().tzinfo)
-        return GradingProcess.objects.filter(email=self.email, requested_at__range=(start_of_day, end_of_day)).count()
+    UNFINISHED = (State.QUEUED, State.RUNNING)
+
+    @staticmethod
+    def latest_identifier(email: str):
+        """The identifier of the latest process of the user which did not fail, an index only scan of gradingprocess_email"""
+        return (
+            GradingProcess.objects.filter(email=email)
+            .exclude(state=GradingProcess.State.FAILED)
+            .order_by("-requested_at")
+            .values_list("identifier", flat=True)
+            .first()
+        )
+
+    def summarize(self):
+        """
+        Writes and returns the result summary, for processes graded before the workers wrote it.
+        The summary is computed by the database function result_summary, which the worker uses as well (migration 0023).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE gradingprocess SET result_summary = result_summary(identifier) "
+                "WHERE identifier = %s RETURNING result_summary::text;",
+                [self.identifier],
+            )
+            self.result_summary = json.loads(cursor.fetchone()[0])
+        return self.result_summary
+
+
+class NotebookManager(models.Manager):
+    """
+    Loads the notebooks without their files, which are loaded when they are accessed or requested with files().
+    Related notebooks, e.g. exercise.notebook, are loaded with their files, select them here instead.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*Notebook.BLOBS)
+
+    def files(self, *blobs: str) -> models.QuerySet:
+        """The notebooks with only their filename and the given files with their content types loaded, to serve them"""
+        return super().get_queryset().only("filename", *blobs, *(f"{blob}_content_type" for blob in blobs))
 
 
 """
@@ -74,6 +154,14 @@ Currently, we associate notebook and Exercise with a 1-1 mapping.
 However, we leave notebook as its own entity to maybe support multiple notebooks in the future
 """
 class Notebook(models.Model):
+    # the files of a notebook, each described by a size, sha256 hash and content type column next to it
+    BLOBS = ("data", "assets", "release_data")
+    CONTENT_TYPES = {
+        "data": "application/x-ipynb+json",
+        "assets": "application/zip",
+        "release_data": "application/x-ipynb+json",
+    }
+
     filename = models.CharField(max_length=255, primary_key=True, db_column="filename")
     in_exercise = models.OneToOneField(
         Exercise, on_delete=models.CASCADE, db_column="in_exercise"
@@ -82,6 +170,21 @@ class Notebook(models.Model):
     assets = models.BinaryField(db_column="assets", blank=True, null=True)
     release_data = models.BinaryField(db_column="release_data", blank=True, null=True)
     uploaded_at = models.DateTimeField(db_column="uploaded_at", auto_now=True)
+    # the workers compare it to the version of the assignment they generated, instead of timestamps
+    version = models.CharField("Content hash", max_length=64, db_column="version", editable=False, default="")
+
+    # maintained by save(), and by the workers storing the release data
+    data_size = models.PositiveBigIntegerField("Notebook size", db_column="data_size", editable=False, null=True)
+    data_sha256 = models.CharField("Notebook hash", max_length=64, db_column="data_sha256", editable=False, null=True)
+    data_content_type = models.CharField(max_length=255, db_column="data_content_type", editable=False, null=True)
+    assets_size = models.PositiveBigIntegerField("Assets size", db_column="assets_size", editable=False, null=True)
+    assets_sha256 = models.CharField("Assets hash", max_length=64, db_column="assets_sha256", editable=False, null=True)
+    assets_content_type = models.CharField(max_length=255, db_column="assets_content_type", editable=False, null=True)
+    release_data_size = models.PositiveBigIntegerField("Release size", db_column="release_data_size", editable=False, null=True)
+    release_data_sha256 = models.CharField("Release hash", max_length=64, db_column="release_data_sha256", editable=False, null=True)
+    release_data_content_type = models.CharField(max_length=255, db_column="release_data_content_type", editable=False, null=True)
+
+    objects = NotebookManager()
 
     class Meta:
         db_table = "notebook"
@@ -89,6 +192,40 @@ class Notebook(models.Model):
     def __str__(self):
         return f"{self.filename} (exercise {self.in_exercise})"
 
+    @staticmethod
+    def compute_version(data, assets) -> str:
+        """Returns the sha256 hash of the notebook data and assets"""
+        h = hashlib.sha256(data)
+        if assets is not None:
+            h.update(assets)
+        return h.hexdigest()
+
+    def save(self, *args, **kwargs):
+        # only the files loaded (and so saved) are described again
+        update_fields = kwargs.get("update_fields")
+        deferred = self.get_deferred_fields()
+        saved = [
+            blob for blob in Notebook.BLOBS
+            if blob not in deferred and (update_fields is None or blob in update_fields)
+        ]
+        described = set()
+        for blob in saved:
+            content = getattr(self, blob)
+            if content is None:
+                size, sha256, content_type = None, None, None
+            else:
+                size, sha256, content_type = len(content), hashlib.sha256(content).hexdigest(), Notebook.CONTENT_TYPES[blob]
+            setattr(self, f"{blob}_size", size)
+            setattr(self, f"{blob}_sha256", sha256)
+            setattr(self, f"{blob}_content_type", content_type)
+            described |= {f"{blob}_size", f"{blob}_sha256", f"{blob}_content_type"}
+        if "data" in saved or "assets" in saved:
+            self.version = Notebook.compute_version(self.data, self.assets)
+            described.add("version")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, *described}
+        super().save(*args, **kwargs)
+
 
 """
 Describes a subexercise in the Notebook (such as 2). This defines the coarsness of the grading presented to the studies
@@ -163,7 +300,8 @@ class ErrorLog(models.Model):
 
 
 """
-Models the assignment to workers
+Models the assignment to workers.
+A process is claimed by inserting its assignment, the unique constraint guarantees that only one worker grades it.
 """
 class WorkerAssignment(models.Model):
     worker_id = models.UUIDField(
@@ -175,16 +313,54 @@ class WorkerAssignment(models.Model):
     process = models.ForeignKey(
         GradingProcess, on_delete=models.CASCADE, db_column="process"
     )
+    # renewed by the heartbeats of the worker, once expired the process is claimed again by another worker
+    lease_expires_at = models.DateTimeField(
+        "Lease expires at", null=True, blank=True, db_column="lease_expires_at"
+    )
+    attempts = models.PositiveIntegerField(default=1, db_column="attempts")
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["process"], name="unique_workerassignment_for_process"
+            )
+        ]
         db_table = "workerassignment"
 
 
+"""
+Models a running worker, which reports itself alive periodically.
+"""
+class WorkerHeartbeat(models.Model):
+    worker_id = models.UUIDField(primary_key=True, editable=False, db_column="worker_id")
+    started_at = models.DateTimeField(db_column="started_at")
+    last_seen = models.DateTimeField(db_column="last_seen")
+    expires_at = models.DateTimeField(db_column="expires_at")
+    slots = models.PositiveIntegerField("Grading slots", db_column="slots")
+    running = models.PositiveIntegerField("Running jobs", db_column="running", default=0)
+
+    class Meta:
+        db_table = "workerheartbeat"
+
+    def __str__(self):
+        return f"Worker {self.worker_id}, last seen at {self.last_seen}"
+
+    @admin.display(boolean=True, description="Alive")
+    def alive(self):
+        """
+        Returns whether the worker reported itself alive recently, i.e. still holds the leases of its jobs.
+        Note: uses system configured time!
+        """
+        return self.expires_at.timestamp() >= datetime.now().timestamp()
+
+
 """
 Models a notebook uploaded by a student
 """
 class StudentNotebook(models.Model):
     data = models.BinaryField(db_column="data")
+    # sha256 of the data, computed while it was uploaded
+    sha256 = models.CharField("Content hash", max_length=64, blank=True, default="", db_column="sha256")
     notebook = models.ForeignKey(
         Notebook, on_delete=models.CASCADE, db_column="notebook"
     )
@@ -219,4 +395,42 @@ class DailyLimit(models.Model):
         db_table = "daily_limit"
 
     def __str__(self):
-        return f"Daily limit for user {self.user_id}: {self.limit}"
\ No newline at end of file
+        return f"Daily limit for user {self.user_id}: {self.limit}"
+
+"""
+Counters of the grading requests of a user, maintained by grader.ratelimit when a grading is requested.
+The row of the user is locked while a request is checked, so concurrent requests of the same user are checked one after the other.
+"""
+class SubmissionCounter(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, db_column="user_id", primary_key=True
+    )
+    # the requests counted in used were made on this day, the counter starts again with the next day
+    day = models.DateField("Day", db_column="day")
+    used = models.PositiveIntegerField("Requests on the day", default=0, db_column="used")
+    # the latest process of the user, a user has at most one unfinished process
+    last_process = models.ForeignKey(
+        GradingProcess, on_delete=models.SET_NULL, null=True, blank=True, db_column="last_process"
+    )
+
+    class Meta:
+        db_table = "submission_counter"
+
+    def __str__(self):
+        return f"{self.used} request(s) of user {self.user} on {self.day}"
+
+
+"""
+The latest grading request of a user for an exercise, to enforce the time between two requests for the same exercise.
+"""
+class LastRequest(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_column="user_id")
+    exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE, db_column="exercise")
+    process = models.ForeignKey(GradingProcess, on_delete=models.CASCADE, db_column="process")
+    requested_at = models.DateTimeField("Requested at", db_column="requested_at")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "exercise"], name="unique_last_request_per_exercise")
+        ]
+        db_table = "last_request"
@@ -0,0 +1,138 @@
+"""
+Rate limiting of the grading requests: a user may request at most its daily limit of gradings per day,
+has at most one unfinished grading, and waits REQUEST_TIME_LIMIT seconds between two requests for the same exercise.
+The counters of a user are kept in submission_counter and last_request, so a check reads a few rows by their keys
+instead of counting the history of the user in gradingprocess.
+"""
+import datetime
+import typing
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from grader.models import Exercise, GradingProcess, LastRequest
+
+DAILY_LIMIT = "daily_limit"
+RUNNING = "running"
+TOO_SOON = "too_soon"
+
+
+class Quota(typing.NamedTuple):
+    # None if the request is allowed, otherwise DAILY_LIMIT, RUNNING or TOO_SOON
+    rejected: typing.Optional[str]
+    limit: int
+    # requests left today, including the checked one if it is allowed
+    remaining: int
+    # when the request can be made again, None if allowed or unknown (waiting for the running grading)
+    retry_after: typing.Optional[datetime.timedelta]
+
+    @property
+    def allowed(self) -> bool:
+        return self.rejected is None
+
+
+def _until_tomorrow() -> datetime.timedelta:
+    now = timezone.localtime()
+    tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    return tomorrow - now
+
+
+def reserve(user: User, exercise: Exercise) -> Quota:
+    """
+    Checks whether the user may request a grading of the exercise.
+    Must be called in the transaction creating the grading process, which is recorded afterwards with record().
+    The counter of the user stays locked until the transaction ends, so a concurrent request of the same user
+    waits and is checked against the recorded process.
+    """
+    with connection.cursor() as cursor:
+        # the upsert locks the counter of the user, even if it is created, and starts it again on a new day
+        cursor.execute(
+            """
+            WITH user_limit AS (
+                INSERT INTO daily_limit (user_id, "limit") VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET "limit" = daily_limit."limit"
+                RETURNING "limit"
+            ), counter AS (
+                INSERT INTO submission_counter (user_id, day, used) VALUES (%s, %s, 0)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    used = CASE WHEN submission_counter.day = EXCLUDED.day THEN submission_counter.used ELSE 0 END,
+                    day = EXCLUDED.day
+                RETURNING used, last_process
+            )
+            SELECT user_limit."limit", counter.used, counter.last_process FROM user_limit, counter;
+            """,
+            [user.pk, settings.DAILY_LIMIT, user.pk, timezone.localdate()],
+        )
+        limit, used, last_process = cursor.fetchone()
+        remaining = max(limit - used, 0)
+        if remaining == 0:
+            return Quota(DAILY_LIMIT, limit, 0, _until_tomorrow())
+
+        # a separate statement, to see the processes committed by a concurrent request while waiting for the lock
+        cursor.execute(
+            """
+            SELECT
+                EXISTS (SELECT 1 FROM gradingprocess WHERE identifier = %s AND state = ANY(%s)),
+                (
+                    SELECT last_request.requested_at FROM last_request
+                    JOIN gradingprocess ON gradingprocess.identifier = last_request.process
+                    WHERE last_request.user_id = %s AND last_request.exercise = %s AND gradingprocess.state <> %s
+                );
+            """,
+            [last_process, list(GradingProcess.UNFINISHED), user.pk, exercise.pk, GradingProcess.State.FAILED],
+        )
+        running, requested_at = cursor.fetchone()
+    if running:
+        return Quota(RUNNING, limit, remaining, None)
+    if requested_at is not None:
+        retry_after = requested_at + datetime.timedelta(seconds=settings.REQUEST_TIME_LIMIT) - timezone.now()
+        if retry_after.total_seconds() > 1:
+            return Quota(TOO_SOON, limit, remaining, retry_after)
+    return Quota(None, limit, remaining, None)
+
+
+def record(user: User, process: GradingProcess) -> None:
+    """Counts the process created after it was allowed by reserve(), in the same transaction"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE submission_counter SET used = used + 1, last_process = %s WHERE user_id = %s;",
+            [process.identifier, user.pk],
+        )
+        cursor.execute(
+            """
+            INSERT INTO last_request (user_id, exercise, process, requested_at) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id, exercise) DO UPDATE SET process = EXCLUDED.process, requested_at = EXCLUDED.requested_at;
+            """,
+            [user.pk, process.for_exercise_id, process.identifier, process.requested_at],
+        )
+
+
+def remaining(user: User) -> typing.Optional[int]:
+    """The requests the user has left today, without locking, None if the user has not requested a grading yet"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT coalesce(daily_limit."limit", %s) - CASE WHEN submission_counter.day = %s THEN submission_counter.used ELSE 0 END
+            FROM submission_counter LEFT JOIN daily_limit ON daily_limit.user_id = submission_counter.user_id
+            WHERE submission_counter.user_id = %s;
+            """,
+            [settings.DAILY_LIMIT, timezone.localdate(), user.pk],
+        )
+        row = cursor.fetchone()
+    return max(row[0], 0) if row else None
+
+
+def retry_after(user: User, exercise: str) -> typing.Optional[datetime.timedelta]:
+    """The time until the user may request a grading of the exercise with the identifier again, None if it may right now"""
+    last = (
+        LastRequest.objects.filter(user=user, exercise_id=exercise)
+        .exclude(process__state=GradingProcess.State.FAILED)
+        .values_list("requested_at", flat=True)
+        .first()
+    )
+    if last is None:
+        return None
+    remaining_time = last + datetime.timedelta(seconds=settings.REQUEST_TIME_LIMIT) - timezone.now()
+    return remaining_time if remaining_time.total_seconds() > 0 else None
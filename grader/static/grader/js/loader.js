@@ -1,9 +1,13 @@
+function showResults() {
+    window.location.href = `/grader/results/${window.processId}`;
+}
+
 function checkGradingStatus() {
     fetch(`/grader/check_grading_status/${window.processId}`)
         .then(response => response.json())
         .then(data => {
             if (data.finished) {
-                window.location.href = `/grader/results/${window.processId}`;
+                showResults();
             } else {
                 setTimeout(checkGradingStatus, 3000);
             }
@@ -12,4 +16,22 @@ function checkGradingStatus() {
             setTimeout(checkGradingStatus, 5000);
         });
 }
-document.addEventListener('DOMContentLoaded', checkGradingStatus);
\ No newline at end of file
+
+function waitForGrading() {
+    if (!window.EventSource) {
+        checkGradingStatus();
+        return;
+    }
+    // the server announces the end of the grading, the browser reconnects by itself if the stream ends
+    const source = new EventSource(`/grader/events/${window.processId}`);
+    source.addEventListener('finished', () => {
+        source.close();
+        showResults();
+    });
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            checkGradingStatus();
+        }
+    };
+}
+document.addEventListener('DOMContentLoaded', waitForGrading);
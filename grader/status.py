@@ -0,0 +1,94 @@
+"""
+Pushes the completion of grading processes to the waiting browsers, see views.grading_events.
+"""
+import asyncio
+import contextlib
+import logging
+import typing
+from collections import defaultdict
+
+import psycopg2
+
+from grader import db
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_INTERVAL = 15
+"""Seconds between two comments sent on an idle event stream, so proxies do not close it"""
+STREAM_TIMEOUT = 60
+"""Seconds after which an event stream is closed and the browser reconnects, which checks the state again"""
+
+
+class CompletionListener:
+    """
+    One connection per server process listening on notify_student, on which the workers announce finished processes.
+    Every waiting client subscribes to its process and is woken up by the notification, so waiting does not query the database.
+    The connection is opened on the first subscription in the event loop of the ASGI server and reopened after it was lost.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        # the descriptor the reader was added for, fileno() fails once psycopg2 closed a broken connection
+        self.fd: typing.Optional[int] = None
+        self.waiting: typing.Dict[str, typing.Set[asyncio.Event]] = defaultdict(set)
+
+    async def _ensure_connected(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.connection is not None and not self.connection.closed and self.loop is loop:
+            return
+        self.close()
+        connection = await asyncio.to_thread(db.listen, "notify_student")
+        if self.connection is not None:
+            # connected concurrently by another subscriber
+            connection.close()
+            return
+        self.connection = connection
+        self.loop = loop
+        self.fd = connection.fileno()
+        loop.add_reader(self.fd, self._on_notify)
+        logger.info("Listening for finished grading processes")
+
+    def _on_notify(self) -> None:
+        if self.connection is None:
+            return
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Lost the connection listening for finished grading processes: {str(e)}")
+            self.close()
+            # the clients check the state themselves after reconnecting
+            for events in self.waiting.values():
+                for event in events:
+                    event.set()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            for event in self.waiting.get(notify.payload, ()):
+                event.set()
+
+    def close(self) -> None:
+        # the reader is removed before the connection is closed, so the descriptor is released before it can be reused
+        if self.fd is not None and self.loop is not None and not self.loop.is_closed():
+            self.loop.remove_reader(self.fd)
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.loop = None
+        self.fd = None
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, process_id: str):
+        """Yields an event which is set when the process is announced as finished"""
+        await self._ensure_connected()
+        event = asyncio.Event()
+        self.waiting[process_id].add(event)
+        try:
+            yield event
+        finally:
+            self.waiting[process_id].discard(event)
+            if not self.waiting[process_id]:
+                del self.waiting[process_id]
+
+
+LISTENER = CompletionListener()
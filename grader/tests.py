@@ -1,3 +1,327 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from grader import catalogue, ratelimit
+from grader.management.commands import notify
+from grader.models import (
+    Cell,
+    DailyLimit,
+    ErrorLog,
+    Exercise,
+    Grading,
+    GradingProcess,
+    KeycloakSession,
+    LastRequest,
+    Notebook,
+    SubExercise,
+    SubmissionCounter,
+)
+
+# the users log in without keycloak
+BACKEND = "django.contrib.auth.backends.ModelBackend"
+NOTEBOOK = b'{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}'
+
+
+# the manifest of the static files is only written by collectstatic
+@override_settings(STORAGES={"staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}})
+class GraderTestCase(TestCase):
+    """An exercise running right now, with a notebook of two subexercises, and a logged in student"""
+
+    def setUp(self):
+        # the exercise catalogue and the sessions must not outlive the database of a test
+        cache.clear()
+        now = timezone.now()
+        self.exercise = Exercise.objects.create(
+            identifier="EX", start_date=now - datetime.timedelta(days=1), stop_date=now + datetime.timedelta(days=1)
+        )
+        self.notebook = Notebook.objects.create(
+            filename="ex.ipynb", in_exercise=self.exercise, data=NOTEBOOK, assets=b"PK", release_data=NOTEBOOK
+        )
+        self.cells = []
+        for label in ("Aufgabe 1", "Aufgabe 2"):
+            subexercise = SubExercise.objects.create(label=label, in_notebook=self.notebook)
+            self.cells.append(Cell.objects.create(cell_id=f"{label}-cell", sub_exercise=subexercise, max_score=2))
+        self.user = User.objects.create_user("student", email="student@example.org")
+        self.client.force_login(self.user, backend=BACKEND)
+
+    def create_process(self, state=GradingProcess.State.GRADED, **fields) -> GradingProcess:
+        return GradingProcess.objects.create(email=self.user.email, for_exercise=self.exercise, state=state, **fields)
+
+
+class QueryBudgetTests(GraderTestCase):
+    """The pages run at most their budget of queries, QUERY_BUDGET unless they have a budget of their own"""
+
+    def setUp(self):
+        super().setUp()
+        self.process = self.create_process(graded_at=timezone.now())
+        for cell in self.cells:
+            Grading.objects.create(process=self.process, cell=cell, points=1)
+        self.failed = self.create_process(GradingProcess.State.FAILED, errored_at=timezone.now())
+        ErrorLog.objects.create(process=self.failed, log="Error through grading")
+        # the first request stores the time of the request in the session and builds the cached exercise catalogue
+        self.client.get(reverse("show_exercises"))
+
+    def assertWithinBudget(
+        self, name: str, budget: int = settings.QUERY_BUDGET, method: str = "get", data=None, content_type=None, **kwargs
+    ):
+        # the content type of a body which is not a form
+        body = {"content_type": content_type} if content_type else {}
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(reverse(name, kwargs=kwargs), data, **body)
+        self.assertLess(response.status_code, 500)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f"{name} ran {len(queries)} queries, more than its budget of {budget}:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+        return response
+
+    def test_show_exercises(self):
+        # the session, the user and the latest process of the user, the exercises come from the catalogue
+        response = self.assertWithinBudget("show_exercises", 3)
+        self.assertContains(response, "EX")
+
+    def test_show_exercises_outdated_catalogue(self):
+        cache.delete(catalogue.VERSION_KEY)
+        # and the exercises and notebooks, once
+        self.assertWithinBudget("show_exercises", 5)
+
+    def test_request_grading_get(self):
+        # and the requests left today
+        response = self.assertWithinBudget("request", 4, for_exercise="EX")
+        self.assertContains(response, reverse("download_release", kwargs={"for_notebook": "ex.ipynb"}))
+
+    def test_request_grading_post(self):
+        response = self.assertWithinBudget(
+            "request",
+            13,
+            method="post",
+            data={"notebook": SimpleUploadedFile("submission.ipynb", NOTEBOOK)},
+            for_exercise="EX",
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(GradingProcess.objects.filter(state=GradingProcess.State.QUEUED).exists())
+
+    def test_counter(self):
+        self.assertWithinBudget("counter", 3, for_exercise="EX")
+
+    def test_check_grading_status(self):
+        response = self.assertWithinBudget("check_grading_status", for_process=str(self.process.identifier))
+        self.assertJSONEqual(response.content, {"finished": True})
+
+    def test_grading_events(self):
+        self.assertWithinBudget("grading_events", for_process=str(self.process.identifier))
+
+    def test_grading_results(self):
+        response = self.assertWithinBudget("grading_results", for_process=str(self.process.identifier))
+        self.assertContains(response, "Aufgabe 2")
+
+    def test_grading_results_failed(self):
+        self.assertWithinBudget("grading_results", for_process=str(self.failed.identifier))
+
+    def test_ping(self):
+        self.client.logout()
+        response = self.assertWithinBudget("ping", 0)
+        self.assertEqual(response.content, b"pong")
+
+    def test_login(self):
+        self.client.logout()
+        self.assertWithinBudget("login", 0)
+
+    def test_successful_request(self):
+        response = self.assertWithinBudget("successful_request", 2, data={"id": str(self.process.identifier)})
+        self.assertContains(response, str(self.process.identifier))
+
+    def autocreation(self, identifier: str, subexercises: int) -> dict:
+        """The form of the autocreation view, for a notebook with a grade cell in each subexercise"""
+        cells = [
+            {
+                "cell_type": "code",
+                "metadata": {"nbgrader": {"grade": True, "grade_id": f"test-{i}", "points": 1}},
+                "source": [f"#subexercise:Aufgabe {i}\n", "assert True"],
+            }
+            for i in range(subexercises)
+        ]
+        now = timezone.localtime()
+        return {
+            "exercise_identifier": identifier,
+            "start_date": (now - datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M"),
+            "stop_date": (now + datetime.timedelta(days=1)).strftime("%Y-%m-%dT%H:%M"),
+            "notebook": SimpleUploadedFile(
+                f"{identifier}.ipynb", json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}).encode()
+            ),
+        }
+
+    def test_autocreate_get(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertWithinBudget("autocreate", 2)
+
+    def test_autocreate(self):
+        self.user.is_staff = True
+        self.user.save()
+        # a save for the exercise, the notebook, each subexercise and each cell
+        response = self.assertWithinBudget("autocreate", 14, method="post", data=self.autocreation("NEW", 2))
+        self.assertContains(response, "Aufgabe 1")
+        self.assertEqual(Cell.objects.filter(sub_exercise__in_notebook__in_exercise="NEW").count(), 2)
+
+    def test_autocreate_update(self):
+        self.user.is_staff = True
+        self.user.save()
+        # the notebook of the existing exercise is deleted with its subexercises, cells and their gradings
+        self.assertWithinBudget("autocreate", 22, method="post", data=self.autocreation("EX", 2))
+        self.assertEqual(Notebook.objects.get(in_exercise="EX").filename, "EX.ipynb")
+
+    def test_keycloak_logout(self):
+        KeycloakSession.objects.create(keycloak_sid="keycloak", django_sid=self.client.session.session_key)
+        payload = base64.b64encode(json.dumps({"sid": "keycloak"}).encode()).decode().rstrip("=")
+        self.client.logout()
+        response = self.assertWithinBudget(
+            "keycloak_logout", 2, method="post", data=f"header.{payload}.signature", content_type="text/plain"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(KeycloakSession.objects.exists())
+
+    def test_downloads(self):
+        for name in ("download_notebook", "download_assets", "download_release"):
+            with self.subTest(name):
+                response = self.assertWithinBudget(name, for_notebook="ex.ipynb")
+                self.assertEqual(response.status_code, 200)
+
+
+@override_settings(REQUEST_TIME_LIMIT=300)
+class RateLimitTests(GraderTestCase):
+    """The daily limit, the unfinished grading and the time between two requests for an exercise"""
+
+    def setUp(self):
+        super().setUp()
+        DailyLimit.objects.create(user_id=self.user, limit=3)
+
+    def submit(self, ago: float = 3600, state=GradingProcess.State.GRADED) -> ratelimit.Quota:
+        """Requests a grading like the request_grading view, as if it was requested the given seconds ago"""
+        quota = ratelimit.reserve(self.user, self.exercise)
+        if quota.allowed:
+            process = self.create_process(state)
+            ratelimit.record(self.user, process)
+            LastRequest.objects.filter(process=process).update(
+                requested_at=timezone.now() - datetime.timedelta(seconds=ago)
+            )
+        return quota
+
+    def assertAlmostEqualSeconds(self, delta: datetime.timedelta, seconds: float):
+        self.assertAlmostEqual(delta.total_seconds(), seconds, delta=2)
+
+    def test_limit(self):
+        self.assertIsNone(ratelimit.remaining(self.user))
+        for remaining in (3, 2, 1):
+            quota = self.submit()
+            self.assertEqual(quota, ratelimit.Quota(None, 3, remaining, None))
+        self.assertEqual(ratelimit.remaining(self.user), 0)
+
+        quota = self.submit()
+        self.assertEqual(quota.rejected, ratelimit.DAILY_LIMIT)
+        self.assertEqual((quota.limit, quota.remaining), (3, 0))
+        # until midnight
+        tomorrow = timezone.localtime() + quota.retry_after
+        self.assertEqual(tomorrow.date(), timezone.localdate() + datetime.timedelta(days=1))
+        self.assertEqual(tomorrow.time().replace(microsecond=0), datetime.time(0))
+        self.assertEqual(GradingProcess.objects.count(), 3)
+
+    def test_limit_resets_on_the_next_day(self):
+        for _ in range(3):
+            self.submit()
+        SubmissionCounter.objects.filter(user=self.user).update(day=timezone.localdate() - datetime.timedelta(days=1))
+        self.assertEqual(ratelimit.remaining(self.user), 3)
+        self.assertEqual(self.submit(), ratelimit.Quota(None, 3, 3, None))
+        self.assertEqual(ratelimit.remaining(self.user), 2)
+
+    def test_unfinished_grading(self):
+        self.submit(state=GradingProcess.State.RUNNING)
+        self.assertEqual(self.submit(), ratelimit.Quota(ratelimit.RUNNING, 3, 2, None))
+        GradingProcess.objects.update(state=GradingProcess.State.GRADED)
+        self.assertTrue(self.submit().allowed)
+
+    def test_too_soon(self):
+        self.submit(ago=100)
+        quota = self.submit()
+        self.assertEqual(quota.rejected, ratelimit.TOO_SOON)
+        self.assertEqual(quota.remaining, 2)
+        self.assertAlmostEqualSeconds(quota.retry_after, 200)
+        self.assertAlmostEqualSeconds(ratelimit.retry_after(self.user, "EX"), 200)
+
+    def test_time_window_ends(self):
+        self.submit(ago=299.5)
+        # less than a second left is not worth a redirect to the counter
+        self.assertTrue(self.submit().allowed)
+        LastRequest.objects.update(requested_at=timezone.now() - datetime.timedelta(seconds=300))
+        self.assertIsNone(ratelimit.retry_after(self.user, "EX"))
+
+    def test_failed_grading_is_not_waited_for(self):
+        self.submit(ago=0, state=GradingProcess.State.FAILED)
+        self.assertIsNone(ratelimit.retry_after(self.user, "EX"))
+        self.assertEqual(self.submit(), ratelimit.Quota(None, 3, 2, None))
+
+    def test_retry_after_header(self):
+        self.submit(ago=100)
+        response = self.client.post(
+            reverse("request", kwargs={"for_exercise": "EX"}),
+            {"notebook": SimpleUploadedFile("submission.ipynb", NOTEBOOK)},
+        )
+        self.assertRedirects(response, reverse("counter", kwargs={"for_exercise": "EX"}), fetch_redirect_response=False)
+        self.assertAlmostEqual(int(response["Retry-After"]), 201, delta=2)
+
+        for _ in range(2):
+            LastRequest.objects.update(requested_at=timezone.now() - datetime.timedelta(hours=1))
+            self.submit()
+        response = self.client.post(
+            reverse("request", kwargs={"for_exercise": "EX"}),
+            {"notebook": SimpleUploadedFile("submission.ipynb", NOTEBOOK)},
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+
+class NotifyTests(GraderTestCase):
+    def test_catch_up(self):
+        now = timezone.now()
+        graded = self.create_process(graded_at=now - datetime.timedelta(hours=1))
+        failed = self.create_process(GradingProcess.State.FAILED, errored_at=now - datetime.timedelta(minutes=1))
+        self.create_process(GradingProcess.State.NOTIFIED, graded_at=now, notified=True)
+        self.create_process(GradingProcess.State.QUEUED)
+        # finished long ago, e.g. failed before the failures were mailed
+        old = self.create_process(GradingProcess.State.FAILED, errored_at=now - datetime.timedelta(days=30))
+
+        # the command reconnects first, which would leave the transaction of the test
+        with mock.patch.object(notify, "close_old_connections"):
+            notify.Command().catch_up()
+
+        self.assertEqual(len(mail.outbox), 2)
+        for process in (graded, failed, old):
+            process.refresh_from_db()
+        self.assertEqual((graded.state, graded.notified), (GradingProcess.State.NOTIFIED, True))
+        self.assertEqual((failed.state, failed.notified), (GradingProcess.State.FAILED, True))
+        self.assertFalse(old.notified)
+
+
+class MiddlewareTests(SimpleTestCase):
+    # the adapted middlewares are only logged with DEBUG
+    @override_settings(DEBUG=True)
+    def test_async_middleware_chain(self):
+        # a sync only middleware would run every request under ASGI in a thread, including the async views
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
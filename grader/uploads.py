@@ -0,0 +1,71 @@
+"""
+Handling of uploaded files: every upload is spooled to a temporary file while it is received, hashed on the fly
+and rejected as soon as it exceeds the maximal size, so the web workers never hold a whole upload in memory.
+"""
+import contextlib
+import hashlib
+import mmap
+import typing
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+def max_size(field_name: str) -> int:
+    """The maximal size in bytes of an upload of the form field"""
+    if field_name == "notebook":
+        return settings.MAX_NOTEBOOK_UPLOAD_SIZE
+    return settings.MAX_ASSETS_UPLOAD_SIZE
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Writes the uploaded files to temporary files, like the TemporaryFileUploadHandler of django, but for all sizes,
+    and computes the sha256 hash of the content, available as sha256 attribute of the uploaded file.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # reject a request too large for all files of a form before receiving it
+        limit = settings.MAX_NOTEBOOK_UPLOAD_SIZE + settings.MAX_ASSETS_UPLOAD_SIZE + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+        if content_length > limit:
+            raise RequestDataTooBig(f"The request exceeds the maximal size of {limit} bytes")
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.limit = max_size(field_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.limit:
+            self.file.close()
+            raise RequestDataTooBig(f"The upload of {self.field_name} exceeds the maximal size of {self.limit} bytes")
+        self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file: TemporaryUploadedFile = super().file_complete(file_size)
+        file.sha256 = self.hash.hexdigest()
+        return file
+
+
+@contextlib.contextmanager
+def mapped(file: TemporaryUploadedFile) -> typing.Iterator[memoryview]:
+    """
+    Yields the content of the uploaded file as a memoryview of its temporary file,
+    to save it in a BinaryField without copying it into the memory of the process first.
+    """
+    file.seek(0)
+    if file.size == 0:
+        yield memoryview(b"")
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        view = memoryview(content)
+        try:
+            yield view
+        finally:
+            view.release()
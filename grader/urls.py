@@ -9,6 +9,7 @@ urlpatterns = [
     path("request/<str:for_exercise>", views.request_grading, name="request"),
     path("request/<str:for_exercise>/counter", views.counter, name="counter"),
     path("check_grading_status/<str:for_process>", views.check_grading_status, name="check_grading_status"),
+    path("events/<str:for_process>", views.grading_events, name="grading_events"),
     path("results/<str:for_process>", views.show_results, name="grading_results"),
     path("successful_request", views.successful_request, name="successful_request"),
     path("autocreation", views.autoprocess_notebook, name="autocreate"),
@@ -5,27 +5,29 @@ import re
 import os
 import base64
 import json
-import time 
+import asyncio
+import contextlib
 from collections import defaultdict
+from importlib import import_module
 from datetime import timedelta
 
 from django.http import HttpResponseRedirect
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.db import transaction, connection
 from django.conf import settings
 from django.utils.translation import gettext
 from django.utils import translation
 from django.utils import timezone
-from django.contrib.sessions.models import Session
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 
 from django.http import JsonResponse
 from django.contrib.auth import logout
 from django.views.decorators.csrf import csrf_exempt
 
 from grader.models import *
-
-import psycopg2
+from grader import catalogue, ratelimit, status, uploads
 
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
@@ -35,14 +37,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-conn = psycopg2.connect(host=os.getenv("NBBB_DB_HOST", "localhost"), 
-                dbname=os.getenv("NBBB_DB_NAME", "grader"), 
-                user=os.getenv("NBBB_DB_USER", "user"), 
-                password=os.getenv("NBBB_DB_PASSWD", "password"))
-cursor = conn.cursor()
-conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+# the store of the configured session engine, to delete sessions of other requests
+SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
 
-def ping(request: http.HttpRequest):
+async def ping(request: http.HttpRequest):
 
     return http.HttpResponse(b"pong")
 
@@ -65,41 +63,30 @@ def store_sid(sender, request, user, **kwargs):
 
         # check if roles key is present in decoded token
         if "roles" in decoded_token:
-            roles = decoded_token["roles"]
-            admin_role = settings.ADMIN_ROLE
-
             # if user has role "ampel-testgroup" make the user to staff and superuser 
-            if admin_role in roles:
-                if not user.is_staff:
-                    user.is_staff = True
-                    user.save()
-                    logger.info(f"User {user.username} has been granted staff privileges.")
-                if not user.is_superuser:
-                    user.is_superuser = True
-                    user.save()
-                    logger.info(f"User {user.username} has been granted superuser privileges.")
-            else: 
-                user.is_staff = False
-                user.is_superuser = False
-                user.save()
-        elif settings.DEBUG:
+            privileged = settings.ADMIN_ROLE in decoded_token["roles"]
+        else:
             # for debugging purposes, set user automatically to superuser
-            user.is_staff = True
-            user.is_superuser = True
-            user.save()
-            logger.info(f"User {user.username} has been granted staff privileges.")
+            privileged = True if settings.DEBUG else None
+
+        # saved only if the privileges changed, most logins do not change them
+        if privileged is not None and (user.is_staff, user.is_superuser) != (privileged, privileged):
+            user.is_staff = privileged
+            user.is_superuser = privileged
+            user.save(update_fields=["is_staff", "is_superuser"])
+            if privileged:
+                logger.info(f"User {user.username} has been granted staff and superuser privileges.")
 
         # Update session key using keycloak sid
         try:
           with connection.cursor() as cursor:
-              # Check if the session already exists
-              cursor.execute("SELECT * FROM keycloak_session WHERE keycloak_sid = %s", [sid])
-              if cursor.fetchone() is None:
-                cursor.execute("INSERT INTO keycloak_session (keycloak_sid, django_sid) VALUES (%s, %s)", 
-                              [sid, request.session.session_key])
-              else:
-                cursor.execute("UPDATE keycloak_session SET django_sid = %s WHERE keycloak_sid = %s", 
-                              [request.session.session_key, sid])
+              cursor.execute(
+                  """
+                  INSERT INTO keycloak_session (keycloak_sid, django_sid) VALUES (%s, %s)
+                  ON CONFLICT (keycloak_sid) DO UPDATE SET django_sid = EXCLUDED.django_sid;
+                  """,
+                  [sid, request.session.session_key],
+              )
         except Exception as e:
             logger.error("Error occured: " + str(e))
 
@@ -108,90 +95,131 @@ def store_sid(sender, request, user, **kwargs):
     
     return 
 
-def check_grading_status(request: http.HttpRequest, for_process: str):
-    if settings.NEED_GRADING_AUTH and not request.user.is_authenticated:
+async def check_grading_status(request: http.HttpRequest, for_process: str):
+    user = await request.auser()
+    if settings.NEED_GRADING_AUTH and not user.is_authenticated:
         return http.HttpResponseRedirect("../login")
     try:
-        gq = GradingProcess.objects.get(identifier=for_process)
+        gq = await GradingProcess.objects.only("state").aget(identifier=for_process)
     except GradingProcess.DoesNotExist:
         return http.HttpResponseNotFound("Not found")
-    grading = Grading.objects.filter(process=gq)
-
-    if not grading.exists():
-        finished = False
-        if ErrorLog.objects.filter(process=gq).exists():
-            finished = True
-    else:
-        finished = True
+    finished = gq.processed()
 
     response = http.HttpResponse(json.dumps({"finished": finished}), content_type="application/json")
     return response
 
-def show_results(request: http.HttpRequest, for_process: str):
+async def grading_events(request: http.HttpRequest, for_process: str):
+    """
+    Server-sent events for the waiting page: sends a "finished" event once the grading process is finished.
+    Under ASGI, the stream waits for the notification of the worker on the shared connection of grader.status,
+    and is closed after a while, so the browser reconnects and checks again.
+    Under WSGI, it only reports the current state and lets the browser reconnect after a few seconds, like polling.
+    """
+    user = await request.auser()
+    if settings.NEED_GRADING_AUTH and not user.is_authenticated:
+        return http.HttpResponseForbidden("Login required")
+    if not await GradingProcess.objects.filter(identifier=for_process).aexists():
+        return http.HttpResponseNotFound("Not found")
+
+    async def finished() -> bool:
+        return not await GradingProcess.objects.filter(
+            identifier=for_process, state__in=GradingProcess.UNFINISHED
+        ).aexists()
+
+    async def finished_released() -> bool:
+        # the connection of the request is only given back when the stream ends, so a waiting stream would keep it
+        try:
+            return await finished()
+        finally:
+            # looked up in the thread of the query, the connections are kept per thread
+            await sync_to_async(lambda: connection.close())()
+
+    if not isinstance(request, ASGIRequest):
+        response = http.HttpResponse(
+            "event: finished\ndata: {}\n\n" if await finished() else "retry: 3000\n\n",
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    async def events():
+        async with status.LISTENER.subscribe(str(for_process)) as notified:
+            # the process may have finished before the subscription
+            if await finished_released():
+                yield "event: finished\ndata: {}\n\n"
+                return
+            for _ in range(status.STREAM_TIMEOUT // status.KEEPALIVE_INTERVAL):
+                try:
+                    await asyncio.wait_for(notified.wait(), status.KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if await finished_released():
+                    yield "event: finished\ndata: {}\n\n"
+                    return
+                notified.clear()
+        yield "retry: 1000\n\n"
+
+    response = http.StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # do not let nginx buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+async def show_results(request: http.HttpRequest, for_process: str):
     translation.activate(settings.LANGUAGE_CODE)
 
-    if settings.NEED_GRADING_AUTH and not request.user.is_authenticated:
+    user = await request.auser()
+    if settings.NEED_GRADING_AUTH and not user.is_authenticated:
         return http.HttpResponseRedirect("../login")
     
     try:
-        gq = GradingProcess.objects.get(identifier=for_process)
+        gq = await GradingProcess.objects.aget(identifier=for_process)
     except GradingProcess.DoesNotExist:
         return http.HttpResponseNotFound("Not found")
-    grading = Grading.objects.filter(process=gq)
-    if not grading.exists():
-        # Check if there was an error
-        if ErrorLog.objects.filter(process=gq).exists():
-            errorlog = str(ErrorLog.objects.get(process=gq).log)
-            logger.info(f"Grading process {gq.identifier} has an error: {errorlog}")
-            if 'convert_notebooks' in errorlog:
-                return render(request, "grader/grading_error.html", {"error": gettext("Ein Problem mit der Notebook-Konvertierung ist aufgetreten. Bitte lösche nicht die bestehenden Zellen im Notebook.")})
-            return render(request, "grader/grading_error.html", {"error": gettext("Etwas ist schief gelaufen. Bitte versuche es später noch einmal.")})
-        else:
-            return render(request, "grader/grading_processing.html", {})
+    if gq.state in GradingProcess.UNFINISHED:
+        return render(request, "grader/grading_processing.html", {"waiting_for": gq.identifier})
+    if gq.state == GradingProcess.State.FAILED:
+        errorlog = str((await ErrorLog.objects.aget(process=gq)).log)
+        logger.info(f"Grading process {gq.identifier} has an error: {errorlog}")
+        if 'convert_notebooks' in errorlog:
+            return render(request, "grader/grading_error.html", {"error": gettext("Ein Problem mit der Notebook-Konvertierung ist aufgetreten. Bitte lösche nicht die bestehenden Zellen im Notebook.")})
+        return render(request, "grader/grading_error.html", {"error": gettext("Etwas ist schief gelaufen. Bitte versuche es später noch einmal.")})
+    # written by the worker together with the result
+    summary = gq.result_summary if gq.result_summary is not None else await sync_to_async(gq.summarize)()
+
+    red_percentage = float(settings.PERCENTAGE_LIMITS['RED'])
+    yellow_percentage = float(settings.PERCENTAGE_LIMITS['YELLOW'])
+    red = red_percentage*100
+    yellow = yellow_percentage*100
+
     result = list()
-    with connection.cursor() as cursor:
-        cursor.execute("""
-        SELECT subexercise.label, SUM(grading.points) as achieved, SUM(cell.max_score) as max_points FROM grading 
-            JOIN cell ON grading.cell = cell.id
-            JOIN subexercise ON cell.sub_exercise = subexercise.id
-            WHERE
-                grading.process = %s 
-            GROUP BY subexercise.label
-        """, [str(gq.identifier)])
-
-        """calulate result percentage"""
-        for row in cursor.fetchall():
-            score = row[1]
-            max_score = row[2]
-            
-            """calculate result percentage"""
-            percentage_res = (score/max_score)
-
-            red_percentage = float(settings.PERCENTAGE_LIMITS['RED'])
-            yellow_percentage = float(settings.PERCENTAGE_LIMITS['YELLOW'])
-
-            """traffic light colour"""
-            lower_limit = red_percentage
-            upper_limit = yellow_percentage
-            if percentage_res < red_percentage:
-                t_light_colour = "red"
-            elif lower_limit <= percentage_res < upper_limit:
-                t_light_colour = "yellow"
-            else:
-                t_light_colour = "green"
-
-            result.append({
-                "label": row[0],
-                "score": score,
-                "max_score": max_score,
-                "percentage_res": percentage_res,
-                "t_light_colour": t_light_colour
-            })
-
-            red = red_percentage*100
-            yellow = yellow_percentage*100
-
-            allred = all(elem['t_light_colour'] == 'red' for elem in result)
+    for row in summary:
+        score = row["score"]
+        max_score = row["max_score"]
+
+        """calculate result percentage"""
+        percentage_res = (score/max_score)
+
+        """traffic light colour"""
+        lower_limit = red_percentage
+        upper_limit = yellow_percentage
+        if percentage_res < red_percentage:
+            t_light_colour = "red"
+        elif lower_limit <= percentage_res < upper_limit:
+            t_light_colour = "yellow"
+        else:
+            t_light_colour = "green"
+
+        result.append({
+            "label": row["label"],
+            "score": score,
+            "max_score": max_score,
+            "percentage_res": percentage_res,
+            "t_light_colour": t_light_colour
+        })
+
+    allred = all(elem['t_light_colour'] == 'red' for elem in result)
 
     return render(request, "grader/result.html", {"result": result, "red": red, "yellow": yellow, "allred": allred})
 
@@ -208,7 +236,7 @@ def show_exercises(request):
         return http.HttpResponseRedirect("../login")
     context_exercises = list()
 
-    for ex in Exercise.objects.all():
+    for ex in catalogue.exercises().values():
         context_exercises.append({
             "identifier": ex.identifier,
             "active": ex.running()
@@ -217,17 +245,7 @@ def show_exercises(request):
     user_email = request.user.email if settings.NEED_GRADING_AUTH else "donotusemeinproduction@example.org"
 
     # check if user has already a submission running
-    with transaction.atomic():
-        gp = GradingProcess.objects.raw(
-            """
-        SELECT identifier, email FROM gradingprocess WHERE 
-        identifier NOT IN (SELECT process FROM errorlog)
-        AND email = %s ORDER BY requested_at DESC LIMIT 1
-        """,
-            [user_email], 
-        )
-
-        id = gp[0].identifier if len(list(gp)) > 0 else None
+    id = GradingProcess.latest_identifier(user_email)
 
     return render(request, "grader/exercise_overview.html", {"exercises": context_exercises, "id": id})
 
@@ -235,14 +253,12 @@ def request_grading(request: http.HttpRequest, for_exercise: str):
     translation.activate(settings.LANGUAGE_CODE)
     if settings.NEED_GRADING_AUTH and not request.user.is_authenticated:
         return http.HttpResponseRedirect("../login")
-    try:
-        ex = Exercise.objects.get(identifier=for_exercise)
-        # first of all, check whether it is currently allowed to process this
-        if not ex.running() and not request.user.is_staff:
-            return render(request, "grader/grading_unavailable.html", {"message": gettext("Zurzeit ist keine Bewertung für diese Übung verfügbar!")})
-
-    except ObjectDoesNotExist:
+    ex = catalogue.exercise(for_exercise)
+    if ex is None:
         return http.HttpResponseNotFound("Exercise not found")
+    # first of all, check whether it is currently allowed to process this
+    if not ex.running() and not request.user.is_staff:
+        return render(request, "grader/grading_unavailable.html", {"message": gettext("Zurzeit ist keine Bewertung für diese Übung verfügbar!")})
     
     user = request.user if settings.NEED_GRADING_AUTH else "donotusemeinproduction@example.org"
 
@@ -250,134 +266,102 @@ def request_grading(request: http.HttpRequest, for_exercise: str):
         files = list()
         release = {}
         # check if user has already a submission running
-        with transaction.atomic():
-            gp = GradingProcess.objects.raw(
-                """
-            SELECT identifier, email FROM gradingprocess WHERE 
-            identifier NOT IN (SELECT process FROM errorlog)
-            AND email = %s ORDER BY requested_at DESC LIMIT 1
-            """,
-                [user.email],
-            )
-
-            notebook = Notebook.objects.filter(in_exercise=ex).first()
-
-        id = gp[0].identifier if len(list(gp)) > 0 else None
+        id = GradingProcess.latest_identifier(user.email)
         
-        if notebook and notebook.data:
+        if ex.has_data:
           files.append({
-              "name": notebook.filename if notebook.data else None,
-              "assets": f"{notebook.filename}_assets" if notebook.assets else None,
-              "updated_at": notebook.uploaded_at.strftime("%d.%m.%Y %H:%M") if notebook else None,
+              "name": ex.filename,
+              "assets": f"{ex.filename}_assets" if ex.has_assets else None,
+              "updated_at": ex.uploaded_at.strftime("%d.%m.%Y %H:%M"),
           })
         
-        if notebook and notebook.release_data:
-          release["filename"] = notebook.filename if notebook.release_data else None
+        if ex.has_release:
+          release["filename"] = ex.filename
 
         return render(
             request,
             "grader/request.html",
-            {"form": NoteBookForm(), "for_exercise": for_exercise, "id": id, "files": files, "release": release},
+            {
+                "form": NoteBookForm(),
+                "for_exercise": for_exercise,
+                "id": id,
+                "files": files,
+                "release": release,
+                "remaining": ratelimit.remaining(user),
+            },
         )
     
     if request.method != "POST":
         return http.HttpResponseNotAllowed("Method not allowed")
     
+    # the catalogue only decides what is shown, the grading is requested for the exercise in the database
+    try:
+        ex = Exercise.objects.get(identifier=for_exercise)
+    except ObjectDoesNotExist:
+        return http.HttpResponseNotFound("Exercise not found")
+
+    form = NoteBookForm(request.POST, request.FILES)
+    # check if the form is correct
+    if not form.is_valid():
+        return http.HttpResponseBadRequest("Invalid form")
+    # the uploaded notebook, spooled to a temporary file by grader.uploads
+    notebook_file = request.FILES["notebook"]
+    # get the one-to-one related notebook "blueprint" for the Exercise, without its files
+    valid_nb = Notebook.objects.get(in_exercise=ex)
+
+    # the limits are checked in the transaction creating the grading process, concurrent requests of the user wait for it
     with transaction.atomic():
-        # check if user has reached his daily limit
-        daily_limit, _ = DailyLimit.objects.get_or_create(user_id=user, defaults={"limit": settings.DAILY_LIMIT})
-        userlimit = daily_limit.limit
-        process_count = GradingProcess(email=user.email).count_grading_per_day()
-        if process_count >= userlimit:
-            return render(
+        quota = ratelimit.reserve(user, ex)
+        if quota.rejected == ratelimit.TOO_SOON:
+            response = HttpResponseRedirect("/grader/request/{}/counter".format(for_exercise))
+        elif quota.rejected == ratelimit.DAILY_LIMIT:
+            response = render(
                 request,
                 "grader/grading_unavailable.html",
-                {"message": gettext("Du hast dein tägliches Limit an {} Anfragen erreicht.").format(userlimit)},
+                {"message": gettext("Du hast dein tägliches Limit an {} Anfragen erreicht.").format(quota.limit)},
+                status=429,
             )
-      
-        # check if user has already a submission running
-        gp = GradingProcess.objects.raw(
-        """
-          SELECT identifier, email FROM gradingprocess WHERE 
-          identifier NOT IN (SELECT process FROM grading) AND identifier NOT IN (SELECT process FROM errorlog)
-          AND email = %s LIMIT 1
-        """,
-            [user.email],
-        )
-        # .exist() does not exist for RawQuerySet(lul)
-        if len(list(gp)) > 0:
-            return render(request, "grader/grading_unavailable.html", {"message": gettext("Du hast bereits eine Bewertung angefragt. Bitte warte, bis diese abgeschlossen ist.")})
-    
-        # check if user has made a request in the last 5 minutes
-        gp_time = GradingProcess.objects.raw(
-        """
-        SELECT identifier, requested_at FROM gradingprocess WHERE 
-        identifier NOT IN (SELECT process FROM errorlog) 
-        AND email = %s AND for_exercise = %s ORDER BY requested_at DESC LIMIT 1
-        """,
-            [user.email, for_exercise],
-        )
-
-        # check if the last request was less than 5 minutes ago
-        if len(list(gp_time)) > 0:
-            target_time = gp_time[0].requested_at + timedelta(seconds=settings.REQUEST_TIME_LIMIT)
-            remaining_time = target_time - timezone.now()
-            if remaining_time.total_seconds() > 1:
-                return HttpResponseRedirect(
-                    "/grader/request/{}/counter".format(for_exercise)
-                )
-            
-    form = NoteBookForm(request.POST, request.FILES)
-    # check if the form is correct
-    if form.is_valid():
-        # extract the binary file data of the notebook
-        notebook_data = request.FILES["notebook"].read()
-        # get the one-to-one related notebook "blueprint" for the Exercise
-        valid_nb = ex.notebook
-        # we have all the data we need to create the grading process
-        with transaction.atomic():
+        elif quota.rejected == ratelimit.RUNNING:
+            response = render(
+                request,
+                "grader/grading_unavailable.html",
+                {"message": gettext("Du hast bereits eine Bewertung angefragt. Bitte warte, bis diese abgeschlossen ist.")},
+                status=429,
+            )
+        else:
+            # we have all the data we need to create the grading process
             new_gp = GradingProcess(email=user.email, for_exercise=ex)
             new_gp.save()
-            new_sn = StudentNotebook(
-                data=notebook_data, process=new_gp, notebook=valid_nb
-            )
-            new_sn.save()
-
-        enqueue_grading_request(new_gp.identifier)
+            with uploads.mapped(notebook_file) as notebook_data:
+                new_sn = StudentNotebook(
+                    data=notebook_data, sha256=notebook_file.sha256, process=new_gp, notebook=valid_nb
+                )
+                # the process is its primary key, so save() would try an UPDATE with the notebook first
+                new_sn.save(force_insert=True)
+            ratelimit.record(user, new_gp)
+            enqueue_grading_request(new_gp.identifier)
+    if not quota.allowed:
+        if quota.retry_after is not None:
+            response["Retry-After"] = int(quota.retry_after.total_seconds()) + 1
+        return response
 
-        return HttpResponseRedirect("/grader/successful_request?id={}".format(new_gp.identifier))
-    else:
-        return http.HttpResponseBadRequest("Invalid form")
+    return HttpResponseRedirect("/grader/successful_request?id={}".format(new_gp.identifier))
 
 def counter(request: http.HttpRequest, for_exercise: str):
     translation.activate(settings.LANGUAGE_CODE)
 
     if settings.NEED_GRADING_AUTH and not request.user.is_authenticated:
         return http.HttpResponseRedirect("../login")
-    try:
-        ex = Exercise.objects.get(identifier=for_exercise)
-    except ObjectDoesNotExist:
+    ex = catalogue.exercise(for_exercise)
+    if ex is None:
         return http.HttpResponseNotFound("Exercise not found")
     if not ex.running() and not request.user.is_staff:
         return render(request, "grader/grading_unavailable.html", {"message": gettext("Zurzeit ist keine Bewertung für diese Übung verfügbar!")})
     
-    user_email = request.user.email if settings.NEED_GRADING_AUTH else "donotusemeinproduction@example.org"
-
-    with transaction.atomic():
-        gp_time = GradingProcess.objects.raw(
-            """
-        SELECT identifier, requested_at FROM gradingprocess WHERE 
-        identifier NOT IN (SELECT process FROM errorlog) 
-        AND email = %s AND for_exercise = %s ORDER BY requested_at DESC LIMIT 1
-        """,
-            [user_email, for_exercise],
-        )
-
-    target_time = gp_time[0].requested_at + timedelta(seconds=settings.REQUEST_TIME_LIMIT)
     time_limit_minutes = settings.REQUEST_TIME_LIMIT // 60
-    remaining_time = target_time - timezone.now()
-    
-    if remaining_time.total_seconds() <= 0:
+    remaining_time = ratelimit.retry_after(request.user, ex.identifier) if request.user.is_authenticated else None
+
+    if remaining_time is None:
         return HttpResponseRedirect("/grader/request/{}".format(for_exercise))
     
     hours = remaining_time.seconds // 3600
@@ -402,44 +386,45 @@ def successful_request(request: http.HttpRequest):
     return render(request, "grader/successful_request.html", {"id": id})
     #return http.HttpResponse(f"Grading was requested. You will hear from us. Your process ID is: {request.GET.get('id', default='UNKNOWN')}")
 
-def download_release(request: http.HttpRequest, for_notebook: str):
+async def download_release(request: http.HttpRequest, for_notebook: str):
     """
     Downloads the release of the exercise.
     """
     translation.activate(settings.LANGUAGE_CODE)
 
-    notebook = get_object_or_404(Notebook, filename=for_notebook)
+    notebook = await aget_object_or_404(Notebook.objects.files("release_data"), filename=for_notebook)
 
-    response = http.HttpResponse(notebook.release_data, content_type="application/x-ipynb+json")
+    response = http.HttpResponse(
+        notebook.release_data, content_type=notebook.release_data_content_type or Notebook.CONTENT_TYPES["release_data"]
+    )
     response["Content-Disposition"] = f'attachment; filename="{notebook.filename}"'
-    print(response)
     return response
 
-def download_notebook(request: http.HttpRequest, for_notebook: str):
+async def download_notebook(request: http.HttpRequest, for_notebook: str):
     """
     Downloads the notebook associated with the given exercise.
     """
     translation.activate(settings.LANGUAGE_CODE)
 
-    notebook = get_object_or_404(Notebook, filename=for_notebook)
+    notebook = await aget_object_or_404(Notebook.objects.files("data"), filename=for_notebook)
     
-    response = http.HttpResponse(notebook.data, content_type="application/x-ipynb+json")
+    response = http.HttpResponse(notebook.data, content_type=notebook.data_content_type or Notebook.CONTENT_TYPES["data"])
     response["Content-Disposition"] = f'attachment; filename="{notebook.filename}"'
         
     return response
 
-def download_assets(request: http.HttpRequest, for_notebook: str):
+async def download_assets(request: http.HttpRequest, for_notebook: str):
     """
     Downloads the assets associated with the given notebook.
     """
     translation.activate(settings.LANGUAGE_CODE)
 
-    notebook = get_object_or_404(Notebook, filename=for_notebook)
+    notebook = await aget_object_or_404(Notebook.objects.files("assets"), filename=for_notebook)
 
     if not notebook.assets:
         return render(request, "grader/grading_error.html", {"error": gettext("Ein Problem ist aufgetreten. Es sind keine Assets für dieses Notebook vorhanden. Bitte lade Dir die Assets in Moodle runter.")})
 
-    response = http.HttpResponse(notebook.assets, content_type="application/zip")
+    response = http.HttpResponse(notebook.assets, content_type=notebook.assets_content_type)
     response["Content-Disposition"] = f'attachment; filename="{notebook.filename}_assets.zip"'
 
     return response
@@ -447,7 +432,7 @@ def download_assets(request: http.HttpRequest, for_notebook: str):
 """
 Administration utilities
 """
-from json import loads
+from json import load
 from .forms import AutoCreationForm
 
 def parse_notebook(nb: typing.Dict) -> typing.Dict[str, typing.Dict[str, float]]:
@@ -509,11 +494,12 @@ def autoprocess_notebook(request: http.HttpRequest):
     form = AutoCreationForm(request.POST, request.FILES)
     if form.is_valid():
         notebook_file_name = request.FILES["notebook"].name
-        notebook_data = request.FILES["notebook"].read()
-        assets_files = request.FILES["assets"].read() if "assets" in request.FILES else None
         exercise_identifier = form.cleaned_data["exercise_identifier"]
-        subexercise_dict = parse_notebook(loads(notebook_data))
-        with transaction.atomic():
+        subexercise_dict = parse_notebook(load(request.FILES["notebook"]))
+        # the uploads are spooled to temporary files by grader.uploads and saved from there
+        with transaction.atomic(), contextlib.ExitStack() as stack:
+            notebook_data = stack.enter_context(uploads.mapped(request.FILES["notebook"]))
+            assets_files = stack.enter_context(uploads.mapped(request.FILES["assets"])) if "assets" in request.FILES else None
             # check if exercise with the same identifier already exists
             if Exercise.objects.filter(identifier=exercise_identifier).exists():
                 # update the existing exercise
@@ -561,8 +547,8 @@ def autoprocess_notebook(request: http.HttpRequest):
                       )
                       cell.save()                             
 
-        # trigger nbgrader to update notebook and generate assignments
-        enqueue_notebook_update(notebook_file_name)
+            # trigger nbgrader to update notebook and generate assignments, once the notebook is committed
+            enqueue_notebook_update(notebook_file_name)
 
         # transform the result into a structure easier to use in django template engine:
         # you cannot straigthforward use variables content as keys to access a dictionary
@@ -586,16 +572,26 @@ def autoprocess_notebook(request: http.HttpRequest):
         return http.HttpResponseBadRequest("Invalid form")
     
 def enqueue_grading_request(process_id) -> None:
+    """
+    Wakes up the workers. The notification is only a hint, workers claim the oldest ungraded process themselves,
+    so a lost notification only delays the grading until the next poll of a worker.
+    Call it in the transaction creating the process: postgres delivers the notification when the transaction commits,
+    so the workers never look for a process not visible yet, and a rolled back process is not announced.
+    """
     logger.info(f"Enqueuing grading request for process ID: {process_id}")
-    val = process_id
-    cursor.execute(f"NOTIFY grade_notebook, '{val}';")
-    time.sleep(1) 
+    with connection.cursor() as c:
+        c.execute("SELECT pg_notify('grade_notebook', %s);", [str(process_id)])
 
 def enqueue_notebook_update(filename) -> None:
+    """
+    Tells the workers to generate the assignment of the notebook again, delivered when the transaction saving it commits.
+    A lost notification is caught up by the workers, which read the version of the notebook with every process they grade.
+    """
     logger.info(f"Enqueuing notebook update for filename: {filename}")
-    val = str(filename)
-    cursor.execute(f"NOTIFY update_notebook, '{val}';")
-    time.sleep(1)
+    with connection.cursor() as c:
+        c.execute("SELECT pg_notify('update_notebook', %s);", [str(filename)])
+    # the release notebook is generated again as well
+    catalogue.invalidate()
 
 # Logout redirect 
 @csrf_exempt
@@ -608,25 +604,20 @@ def keycloak_logout(request: http.HttpRequest):
         
         sid = logout_token.get("sid")
 
+        django_sid = None
         try:
           with connection.cursor() as cursor:
-              cursor.execute("SELECT django_sid FROM keycloak_session WHERE keycloak_sid = %s", [str(sid)])
-              django_sid = cursor.fetchone()[0]
+              cursor.execute("DELETE FROM keycloak_session WHERE keycloak_sid = %s RETURNING django_sid", [str(sid)])
+              row = cursor.fetchone()
+              django_sid = row[0] if row else None
         except Exception as e:
             logger.error("Error occured: " + str(e))
         
         if not django_sid:
             return JsonResponse({"status": "error", "message": "No session ID found."})
         else:
-            # Delete the session from the database
-            session = Session.objects.get(session_key=django_sid)
-            Session.objects.filter(session_key=session.session_key).delete()
-        
-        try: 
-            with connection.cursor() as cursor:
-                cursor.execute("DELETE FROM keycloak_session WHERE keycloak_sid = %s", [sid])
-        except Exception as e:
-            logger.error("Error occured: " + str(e))
+            # Delete the session through the session engine, which also drops it from the cache
+            SessionStore().delete(django_sid)
 
         # Logout the user
         logout(request)
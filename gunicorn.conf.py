@@ -1,3 +1,29 @@
+import multiprocessing
+import os
+
 bind = "0.0.0.0:80"
 capture_output = True
 loglevel = "info"
+
+# the cores available to the container, not to the host
+cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else multiprocessing.cpu_count()
+
+if os.getenv("NBBB_SERVER", "asgi") == "asgi":
+    # every uvicorn worker serves many requests concurrently on its event loop,
+    # waiting students and slow uploads do not block a worker
+    wsgi_app = "nbblackbox.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    workers = int(os.getenv("GUNICORN_WORKERS", cores))
+else:
+    wsgi_app = "nbblackbox.wsgi:application"
+    worker_class = "gthread"
+    workers = int(os.getenv("GUNICORN_WORKERS", 2 * cores + 1))
+    threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# uploads of large notebooks and assets take a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+# restart the workers from time to time, against slowly growing memory
+max_requests = 10000
+max_requests_jitter = 1000
@@ -65,8 +65,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "grader.middleware.server_timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "grader.middleware.asgi.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -75,17 +76,40 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     'grader.middleware.auto_logout.middleware.auto_logout',
-    'maintenance_mode.middleware.MaintenanceModeMiddleware',
+    "grader.middleware.asgi.MaintenanceModeMiddleware",
     # "csp.middleware.CSPMiddleware",
 ]
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# requests running more queries are logged, see grader.middleware.server_timing; also the budget of the pages in grader/tests.py
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "15"))
+# send the queries, database and template time of every request in the Server-Timing header
+SERVER_TIMING = os.getenv("NBBB_SERVER_TIMING", "true").lower() == "true"
+
+# a cache shared by all server processes, the sessions are then read from it instead of the database
+CACHE_URL = os.getenv("NBBB_CACHE_URL")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+
+# cached_db needs the shared cache: a session deleted at the logout must be gone for all processes
+SESSION_ENGINE = os.getenv(
+    "NBBB_SESSION_ENGINE",
+    "django.contrib.sessions.backends.cached_db" if CACHE_URL else "django.contrib.sessions.backends.db",
+)
+
+# seconds the cached exercise catalogue is used, bounds how long a server process without the shared cache shows a changed exercise
+CATALOGUE_TIMEOUT = int(os.getenv("CATALOGUE_TIMEOUT", "300"))
 
 ROOT_URLCONF = "nbblackbox.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # measures the rendering time for the Server-Timing header
+        "BACKEND": "grader.middleware.server_timing.DjangoTemplates",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -106,6 +130,9 @@ WSGI_APPLICATION = "nbblackbox.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# "asgi" for the uvicorn workers, "wsgi" for the threaded workers of gunicorn, see gunicorn.conf.py
+SERVER = os.getenv("NBBB_SERVER", "asgi")
+
 DATABASES = {
     # "default": {
     #     "ENGINE": "django.db.backends.sqlite3",
@@ -118,9 +145,34 @@ DATABASES = {
         "PASSWORD": os.getenv("NBBB_DB_PASSWD", "secret"),
         "HOST": os.getenv("NBBB_DB_HOST", "127.0.0.1"),
         "PORT": os.getenv("NBBB_DB_PORT", "5432"),
+        "CONN_HEALTH_CHECKS": True,
+        # pgbouncer in transaction pooling mode cannot keep the cursors of django open between transactions
+        "DISABLE_SERVER_SIDE_CURSORS": os.getenv("NBBB_DB_PGBOUNCER", "false").lower() == "true",
     }
 }
 
+# every server process keeps a pool of at most NBBB_DB_POOL_MAX connections (needs psycopg 3), which the requests borrow.
+# Under ASGI the requests run in changing threads, so connections kept per thread (CONN_MAX_AGE) would be left open.
+# A request holds a connection from its first query until it ends (the event streams give theirs back after each check),
+# so the pool is sized for the requests served at the same time: the threads of a "wsgi" worker, more under ASGI.
+DB_POOL = os.getenv("NBBB_DB_POOL", "true").lower() == "true"
+if DB_POOL:
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("NBBB_DB_POOL_MIN", "1")),
+            "max_size": int(os.getenv("NBBB_DB_POOL_MAX", "16" if SERVER == "asgi" else os.getenv("GUNICORN_THREADS", "4"))),
+            # seconds a request waits for a free connection before it fails
+            "timeout": int(os.getenv("NBBB_DB_POOL_TIMEOUT", "10")),
+        }
+    }
+else:
+    # reuse the connection of a thread for the following requests, checked before it is reused
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("NBBB_DB_CONN_MAX_AGE", "0" if SERVER == "asgi" else "60"))
+
+# LISTEN needs a session of its own, so with pgbouncer in between it connects to the database directly, see grader.db
+DB_LISTEN_HOST = os.getenv("NBBB_DB_LISTEN_HOST", DATABASES["default"]["HOST"])
+DB_LISTEN_PORT = os.getenv("NBBB_DB_LISTEN_PORT", DATABASES["default"]["PORT"])
+
 STORAGES = {
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
@@ -266,6 +318,8 @@ IDLE_TIME_ENV = os.getenv("IDLE_TIME_ENV", "300")
 AUTO_LOGOUT = {
     'IDLE_TIME': timedelta(minutes=int(IDLE_TIME_ENV)),
     'REDIRECT_TO_LOGIN_IMMEDIATELY': True,
+    # the time of the last request is written to the session at most once per this interval
+    'IDLE_TIME_RESOLUTION': timedelta(seconds=int(os.getenv("IDLE_TIME_RESOLUTION", "60"))),
 }
 
 MAINTENANCE_MODE = os.getenv("MAINTENANCE_MODE", None)
@@ -276,4 +330,9 @@ MAINTENANCE_MODE_IGNORE_SUPERUSER = True
 MAINTENANCE_MODE_IGNORE_IP_ADDRESSES = os.getenv("MAINTENANCE_ADRESSES", ())
 MAINTENANCE_MODE_TEMPLATE = "maintenance.html"
 
-DAILY_LIMIT = os.getenv("DAILY_LIMIT", 10)
\ No newline at end of file
+DAILY_LIMIT = os.getenv("DAILY_LIMIT", 10)
+
+# uploads are spooled to temporary files and rejected once they exceed these sizes, see grader.uploads
+FILE_UPLOAD_HANDLERS = ["grader.uploads.HashingFileUploadHandler"]
+MAX_NOTEBOOK_UPLOAD_SIZE = int(os.getenv("MAX_NOTEBOOK_UPLOAD_MB", "20")) * 1024 * 1024
+MAX_ASSETS_UPLOAD_SIZE = int(os.getenv("MAX_ASSETS_UPLOAD_MB", "200")) * 1024 * 1024
@@ -1,21 +1,32 @@
 import os
 import sys
+import hashlib
 import typing
 from sys import argv
 import logging
 import pathlib
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 import uuid
 import datetime
 import signal
+import threading
 import asyncio
+import functools
+import multiprocessing
+import concurrent.futures
+import multiprocessing.util
 
 from zipfile import ZipFile
 
 from nbgrader.apps import NbGraderAPI
 from nbgrader.coursedir import CourseDirectory
 
+from nbworker import engine, kernels, metrics
+from nbworker.scheduler import Scheduler
+from nbworker.database import Database, CONNECTION_ERRORS
+
 POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.environ.get("POSTGRES_PORT", 5432)
 POSTGRES_USER = os.environ.get("POSTGRES_USER", "postgres")
@@ -26,13 +37,44 @@ POSTGRES_DB = os.environ.get("POSTGRES_DB", "")
 
 
 WAITING_TIME = int(os.environ.get("WAITING_TIME", "5"))
-"""The time waited in seconds between database access to check for pending jobs"""
+"""The time waited in seconds between database access to check for pending jobs, in case a notification was missed"""
+RECONNECT_DELAY_MAX = int(os.environ.get("RECONNECT_DELAY_MAX", "60"))
+"""The maximal time waited in seconds between two attempts to reconnect to the database"""
+HEARTBEAT_INTERVAL = int(os.environ.get("HEARTBEAT_INTERVAL", "10"))
+"""The time in seconds between two heartbeats of the worker, which renew the leases of its running jobs"""
+LEASE_TIMEOUT = int(os.environ.get("LEASE_TIMEOUT", "60"))
+"""The time in seconds after the last heartbeat of a worker, after which its jobs are claimed by other workers"""
+MAX_ATTEMPTS = int(os.environ.get("MAX_ATTEMPTS", "3"))
+"""How often the lease of a process may expire, before it is given up with an error for the student"""
+DRAIN_TIMEOUT = int(os.environ.get("DRAIN_TIMEOUT", "300"))
+"""The time in seconds running jobs get to finish after a term signal, before they are released to other workers"""
 COURSE_DIRECTORY = os.environ.get("COURSE_DIRECTORY", "/course")
 DUMMY_STUDENT_ID = "d"
 """A dummy student id, the only student in this system. THeir submissions is always overwritten with each new grading job"""
+GRADING_SLOTS = int(os.environ.get("GRADING_SLOTS", "1"))
+"""The number of notebooks graded in parallel by this worker. Each slot is a process with its own course root"""
+SLOT_DIRECTORY = os.environ.get("SLOT_DIRECTORY", "/tmp/nbworker")
+"""The directory in which the isolated course roots of the grading slots are created"""
+KERNEL_POOL_SIZE = int(os.environ.get("KERNEL_POOL_SIZE", "1"))
+"""The number of kernels each grading slot pre-starts per exercise, with the imports of the exercise done. 0 disables the pool"""
+KERNEL_POOL_EXERCISES = int(os.environ.get("KERNEL_POOL_EXERCISES", "3"))
+"""The number of recently graded exercises each grading slot keeps pre-started kernels for"""
+GRADING_ENGINE = os.environ.get("GRADING_ENGINE", "nbgrader")
+"""How the slots grade: "nbgrader" with autograde on the course root, "memory" on the notebook in memory, without the gradebook"""
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+"""The port the worker serves its metrics on for prometheus. 0 disables the endpoint"""
+METRICS_ADDRESS = os.environ.get("METRICS_ADDRESS", "0.0.0.0")
+"""The address the worker serves its metrics on"""
+SCHEDULER_WINDOW = int(os.environ.get("SCHEDULER_WINDOW", "50"))
+"""The number of oldest waiting processes per exercise the scheduler chooses from"""
+DEADLINE_WINDOW = int(os.environ.get("DEADLINE_WINDOW", "24"))
+"""The time in hours before the deadline of an exercise, in which its submissions get a larger share of the workers"""
+DEADLINE_WEIGHT = float(os.environ.get("DEADLINE_WEIGHT", "2"))
+"""The share of the workers of an exercise close to its deadline, relative to the other exercises"""
 
 
 WORKER_ID = uuid.uuid4()
+STARTED_AT = datetime.datetime.now(datetime.timezone.utc)
 
 # https://stackoverflow.com/questions/51105100/psycopg2-cant-adapt-type-uuid
 psycopg2.extras.register_uuid()
@@ -40,21 +82,47 @@ psycopg2.extras.register_uuid()
 # How to initialise the CourseDirectory is nowhere documented. using the root flag to set the according attribute seems to work
 API = NbGraderAPI(coursedir=CourseDirectory(root=str(COURSE_DIRECTORY)))
 
+SCHEDULER = Scheduler(
+    window=SCHEDULER_WINDOW,
+    max_attempts=MAX_ATTEMPTS,
+    deadline_window=datetime.timedelta(hours=DEADLINE_WINDOW),
+    deadline_weight=DEADLINE_WEIGHT,
+)
+"""Decides which of the waiting processes are claimed first"""
+SLOTS: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+"""The process pool running the grading slots, created in main()"""
+JOBS: typing.Dict[str, asyncio.Task] = {}
+"""The grading jobs currently handled by this worker by process id"""
+LISTENER_FD: typing.Optional[int] = None
+"""The file descriptor of the connection the event loop listens on for notifications"""
+RECONNECTING: typing.Optional[asyncio.Task] = None
+"""The running reconnect, if the connection to the database was lost"""
+UPDATES: typing.Set[asyncio.Task] = set()
+"""The notebook updates currently handled by this worker"""
+DRAINING = False
+"""Whether the worker received a term signal and finishes its running jobs"""
+MANIFEST: typing.Dict[str, str] = {}
+"""The newest version of the assignment of each exercise as recorded in the database, updated on update_notebook notifications and with every claimed process"""
+CELLS: typing.Dict[str, typing.Tuple[typing.Optional[str], typing.Dict[str, int]]] = {}
+"""The primary keys of the cells of each exercise by cell id, with the version of the assignment they were loaded for"""
+PREPARED: typing.Dict[str, str] = {}
+"""The version of the assignment of each exercise generated in the course root of this process"""
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-conn = psycopg2.connect(host=POSTGRES_HOST, 
-                dbname=POSTGRES_DB, 
-                user=POSTGRES_USER, 
+db = Database(host=POSTGRES_HOST,
+                port=POSTGRES_PORT,
+                dbname=POSTGRES_DB,
+                user=POSTGRES_USER,
                 password=POSTGRES_PASSWORD)
-conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-cursor = conn.cursor()
+"""The connection of this process to the database, (re)opened on first use"""
 
 def dump_notebook(notebooks: typing.Dict[str, bytes], for_assignment: str):
     """Dumps the notebook into the submission folder for the given assignment of the dummy student"""
     path = (
-        pathlib.Path(COURSE_DIRECTORY) / "submitted" / DUMMY_STUDENT_ID / for_assignment
+        pathlib.Path(API.coursedir.root) / "submitted" / DUMMY_STUDENT_ID / for_assignment
     )
     # create folder at the path for the assignment, if not exist yet
     path.mkdir(exist_ok=True)
@@ -67,30 +135,52 @@ def dump_notebook(notebooks: typing.Dict[str, bytes], for_assignment: str):
 
    
 def grade(
-    notebook: typing.Dict[str, bytes], assignment: str, id: str
-) -> typing.Dict[str, str]:
+    notebook: typing.Dict[str, bytes], assignment: str, id: str, version: typing.Optional[str]
+) -> typing.Tuple[typing.Dict[str, str], typing.Dict[str, float]]:
     """
-    Return: Dict with points for each cell in the notebook
+    Return: Dict with points for each cell in the notebook, and the durations of the phases of grading
     Raises an exception if something goes wrong
     """
     logging.info("Received assignment to grade")
+    timer = metrics.Timer()
+    try:
+        return _grade(notebook, assignment, version, timer), timer.durations
+    except Exception as err:
+        # pickled along with the exception, so the worker records the phases of failed jobs, too
+        err.durations = timer.durations
+        raise
+
+def _grade(
+    notebook: typing.Dict[str, bytes], assignment: str, version: typing.Optional[str], timer: metrics.Timer
+) -> typing.Dict[str, str]:
+    wait_for_refill()
+
+    with timer.phase("check_assignment"):
+        check_assignment(assignment, version)
 
-    check_assignment(assignment)
+    if GRADING_ENGINE == "memory":
+        return grade_in_memory(notebook, assignment, timer)
 
     # dump the notebook
-    dump_notebook(notebook, assignment)
+    with timer.phase("dump_notebook"):
+        dump_notebook(notebook, assignment)
 
     # start grading
     logger.info(f"Start grading for assignment {assignment}")
     # force: grade even if it is already autograded
     # create: create new student in the database if not already exist
+    if kernels.POOL is not None:
+        kernels.POOL.serving = assignment
     try: 
-      grading_result = API.autograde(
-          assignment, DUMMY_STUDENT_ID, force=True, create=True
-      )
+      with timer.phase("autograde"):
+        grading_result = API.autograde(
+            assignment, DUMMY_STUDENT_ID, force=True, create=True
+        )
     except RuntimeError as e:
         logger.error(f"Error while grading notebook: {str(e)}")
         raise RuntimeError(f"Error while grading notebook: {str(e)}")
+    finally:
+        refill_kernels_later(assignment)
     
     if not grading_result["success"]:
         logger.error(f"Grading error: {grading_result['error']}")
@@ -101,7 +191,7 @@ def grade(
 
     cell_point_dict = {}
 
-    with API.gradebook as g:
+    with timer.phase("gradebook"), API.gradebook as g:
         # retrieve the submission from the database
         sb = g.find_submission(assignment, DUMMY_STUDENT_ID)
         # we assume only one notebook, therefore just take the first one
@@ -116,287 +206,729 @@ def grade(
 
     return cell_point_dict
 
+def grade_in_memory(
+    notebook: typing.Dict[str, bytes], assignment: str, timer: metrics.Timer
+) -> typing.Dict[str, str]:
+    """Grades like grade(), but without the submission folder and the gradebook of the dummy student"""
+    logger.info(f"Start grading in memory for assignment {assignment}")
+    if kernels.POOL is not None:
+        kernels.POOL.serving = assignment
+    cell_point_dict = {}
+    try:
+        with timer.phase("autograde"):
+            for filename, data in notebook.items():
+                cell_point_dict.update(engine.grade(API, data, filename, assignment))
+    except Exception as e:
+        logger.error(f"Error while grading notebook: {str(e)}")
+        raise RuntimeError(f"Error while grading notebook: {str(e)}")
+    finally:
+        refill_kernels_later(assignment)
+    logger.info(f"Notebook achieved {sum(points or 0 for points in cell_point_dict.values())} points")
+    return cell_point_dict
+
+REFILL: typing.Optional[threading.Thread] = None
+"""The thread pre-starting kernels in this grading slot after its last grading"""
+
+def refill_kernels_later(assignment: str) -> None:
+    """Refills the kernel pool in the background, so the result is handed back to the worker before the kernels start"""
+    global REFILL
+    if kernels.POOL is None:
+        return
+    REFILL = threading.Thread(target=refill_kernels, args=(assignment,), name="refill-kernels", daemon=True)
+    REFILL.start()
+
+def wait_for_refill() -> None:
+    """Waits for the kernels started after the last grading, before the pool of this slot is used again"""
+    if REFILL is not None:
+        REFILL.join()
+
+def _shutdown_kernels() -> None:
+    wait_for_refill()
+    kernels.POOL.shutdown()
+
+def refill_kernels(assignment: str) -> None:
+    """Pre-starts the kernels for the next submission of the assignment, while this one is stored"""
+    if kernels.POOL is None:
+        return
+    try:
+        kernels.POOL.fill(
+            assignment,
+            str(pathlib.Path(API.coursedir.root) / API.coursedir.release_directory / assignment),
+            API.coursedir.root,
+        )
+    except Exception as e:
+        # grading works without the pool, only slower
+        logger.error(f"Error while pre-starting kernels for assignment {assignment}: {str(e)}")
+
+def log_error(process_id, log: str) -> None:
+    """Finishes the process with an error log, unless it is finished already"""
+    db.cursor.execute(
+    """
+    WITH failed AS (
+        INSERT INTO errorlog(process, log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING
+        RETURNING process
+    )
+    UPDATE gradingprocess SET errored_at = now(), state = 'failed' FROM failed
+    WHERE gradingprocess.identifier = failed.process AND gradingprocess.state IN ('queued', 'running');
+    """,
+        [process_id, log],
+    )
+
 # Enqueue the successful graded assignment to the database for further processing
 def enqueue_graded(process_id) -> None:
     logger.info(f"Enqueuing graded notebook with process id {process_id} to notify the student.")
-    cursor.execute(f"NOTIFY notify_student, '{process_id}';")
+    db.cursor.execute(f"NOTIFY notify_student, '{process_id}';")
+
+def cell_keys(exercise: str, notebook_filename: str, version: typing.Optional[str]) -> typing.Dict[str, int]:
+    """Returns the primary keys of the cells of the notebook by cell id as in the notebook, loaded once per version"""
+    cached = CELLS.get(exercise)
+    if cached is None or cached[0] != version:
+        # We need the correct pk of the cell, as grading has a foreign key on the pk
+        # of the cell, NOT ON THE CELL_ID AS IN THE NOTEBOOK
+        # for this we join the cell on subexercise on notebook on exercise
+        db.cursor.execute(
+        """
+        SELECT cell.cell_id, cell.id FROM cell
+            JOIN subexercise ON cell.sub_exercise=subexercise.id
+            JOIN notebook ON subexercise.in_notebook=notebook.filename
+        WHERE notebook.in_exercise=%s
+            AND notebook.filename=%s;
+        """,
+            [exercise, notebook_filename],
+        )
+        cached = (version, dict(db.cursor.fetchall()))
+        CELLS[exercise] = cached
+    return cached[1]
+
+def store_result(process_id, exercise: str, notebook_filename: str, version: typing.Optional[str], result: typing.Dict[str, str]) -> bool:
+    """
+    Inserts the points of all cells and notifies the student in a single statement,
+    i.e. in one transaction and one round trip. Points for cells unknown to the database are dropped.
+    Returns False if the result was dropped, because the lease of the process was lost.
+    """
+    for attempt in range(2):
+        cells = cell_keys(exercise, notebook_filename, version)
+        rows = [
+            db.cursor.mogrify("(%s, %s, %s)", [process_id, cells[cell_id], points]).decode()
+            for cell_id, points in result.items()
+            if cell_id in cells
+        ]
+        # only while the process is still assigned to this worker, i.e. its lease was not taken over by another worker
+        assigned = db.cursor.mogrify(
+            "FROM workerassignment WHERE process = %s AND worker_id = %s", [process_id, WORKER_ID]
+        ).decode()
+        statement = ""
+        if rows:
+            statement += (
+                "INSERT INTO grading(process, cell, points) SELECT * FROM (VALUES " + ", ".join(rows) + ") AS result"
+                f" WHERE EXISTS (SELECT 1 {assigned});"
+            )
+        # the points per subexercise, so the result page does not aggregate the gradings on every view,
+        # computed by the database function defined in the migrations of the grader app
+        statement += db.cursor.mogrify(
+            "UPDATE gradingprocess SET graded_at = now(), state = 'graded', result_summary = result_summary(identifier)"
+            f" WHERE identifier = %s AND EXISTS (SELECT 1 {assigned});",
+            [process_id],
+        ).decode()
+        statement += db.cursor.mogrify(f"SELECT pg_notify('notify_student', %s) {assigned};", [str(process_id)]).decode()
+        try:
+            db.cursor.execute(statement)
+            if db.cursor.fetchone() is None:
+                logger.warning(f"Lost the lease of process id {process_id} to another worker, dropped the result.")
+                return False
+            logger.info(f"Stored {len(rows)} result(s) of process id {process_id} and notified the student.")
+            return True
+        except psycopg2.errors.ForeignKeyViolation:
+            if attempt > 0:
+                raise
+            # the cells were recreated, e.g. by uploading the same notebook again
+            CELLS.pop(exercise, None)
+
+def claim_process(process_id=None) -> typing.Optional[str]:
+    """
+    Claims the given grading process, or the oldest one, if it is not assigned to a worker yet, or its lease expired,
+    by inserting the worker assignment. Processes locked by other claiming workers are skipped, the unique constraint
+    on the process of the assignment guarantees that every process is graded by one worker only.
+    Processes whose lease expired MAX_ATTEMPTS times are left to the reaper.
+    Returns None if there is no process left to claim.
+    """
+    db.cursor.execute(
+    """
+    WITH claimed AS (
+    INSERT INTO workerassignment (worker_id, process, assigned_at, lease_expires_at, attempts)
+        SELECT %s, gradingprocess.identifier, %s, now() + %s, 1 FROM gradingprocess
+        WHERE gradingprocess.state IN ('queued', 'running')
+            AND NOT EXISTS (SELECT 1 FROM workerassignment WHERE workerassignment.process = gradingprocess.identifier
+                AND (workerassignment.lease_expires_at >= now() OR workerassignment.attempts >= %s))
+            AND (%s::uuid IS NULL OR gradingprocess.identifier = %s)
+        ORDER BY gradingprocess.requested_at
+        LIMIT 1
+        FOR UPDATE OF gradingprocess SKIP LOCKED
+    ON CONFLICT (process) DO UPDATE SET worker_id = EXCLUDED.worker_id,
+        assigned_at = EXCLUDED.assigned_at,
+        lease_expires_at = EXCLUDED.lease_expires_at,
+        attempts = workerassignment.attempts + 1
+        WHERE workerassignment.lease_expires_at IS NULL OR workerassignment.lease_expires_at < now()
+    RETURNING process, attempts
+    )
+    UPDATE gradingprocess SET claimed_at = now(), state = 'running' FROM claimed
+    WHERE gradingprocess.identifier = claimed.process
+    RETURNING claimed.process, claimed.attempts;
+    """,
+        [WORKER_ID, datetime.datetime.now(), datetime.timedelta(seconds=LEASE_TIMEOUT), MAX_ATTEMPTS,
+         process_id, process_id],
+    )
+    claimed = db.cursor.fetchone()
+    if claimed is None:
+        return None
+    if claimed[1] > 1:
+        logger.warning(f"Lease of process {claimed[0]} expired, claimed it again (attempt {claimed[1]}).")
+    else:
+        logger.info(f"Worker assignment for process {claimed[0]} created.")
+    return claimed[0]
+
+def dispatch_jobs() -> None:
+    """
+    Claims grading processes in the order of the scheduler until all grading slots are busy or no process is left.
+    Processes claimed by another worker in the meantime are skipped.
+    """
+    if len(JOBS) >= GRADING_SLOTS or DRAINING:
+        return
+    try:
+        for candidate in SCHEDULER.plan(db.cursor):
+            if len(JOBS) >= GRADING_SLOTS or DRAINING:
+                return
+            process_id = claim_process(candidate)
+            if process_id is None:
+                continue
+            job = asyncio.ensure_future(grade_notebook(process_id))
+            JOBS[process_id] = job
+            job.add_done_callback(functools.partial(_job_done, process_id))
+    except CONNECTION_ERRORS as e:
+        logger.error(f"Lost connection to the database while claiming a grading process: {str(e)}")
+        ensure_reconnect()
+    except Exception as e:
+        logger.error(f"Error while claiming a grading process: {str(e)}")
+
+def _job_done(process_id, job: asyncio.Task) -> None:
+    """Frees the slot of a finished job and hands it the next process"""
+    JOBS.pop(process_id, None)
+    if job.cancelled() or DRAINING:
+        return
+    if isinstance(job.exception(), CONNECTION_ERRORS):
+        # the process stays assigned to this worker, it is released again by the sweep after the reconnect
+        logger.error(f"Lost connection to the database while handling process {process_id}")
+        ensure_reconnect()
+        return
+    dispatch_jobs()
+
+def release_orphaned() -> None:
+    """
+    Releases the processes assigned to this worker which are neither finished nor handled by a running job,
+    e.g. because the connection was lost while the result was stored. They are claimed again afterwards.
+    """
+    db.cursor.execute(
+    """
+    WITH released AS (
+        DELETE FROM workerassignment USING gradingprocess
+        WHERE workerassignment.process = gradingprocess.identifier AND workerassignment.worker_id = %s
+            AND NOT (workerassignment.process = ANY(%s)) AND gradingprocess.state IN ('queued', 'running')
+        RETURNING workerassignment.process
+    )
+    UPDATE gradingprocess SET state = 'queued' FROM released WHERE gradingprocess.identifier = released.process
+    RETURNING released.process;
+    """,
+        [WORKER_ID, list(JOBS.keys())],
+    )
+    for (process_id,) in db.cursor.fetchall():
+        logger.info(f"Released orphaned process {process_id}")
+
+def load_manifest() -> typing.List[str]:
+    """Loads the versions of the assignments of all running exercises, returns the exercises whose version changed"""
+    db.cursor.execute(
+    """
+    SELECT notebook.in_exercise, notebook.version FROM notebook
+        JOIN exercise ON notebook.in_exercise = exercise.identifier
+    WHERE now() BETWEEN exercise.start_date AND exercise.stop_date;
+    """
+    )
+    versions = dict(db.cursor.fetchall())
+    changed = [exercise for exercise, version in versions.items() if MANIFEST.get(exercise) != version]
+    MANIFEST.update(versions)
+    return changed
+
+def claim_version(exercise: str, version: typing.Optional[str]) -> typing.Optional[str]:
+    """
+    Records the version of the assignment read with a grading process in the manifest and returns it.
+    Catches up on an update_notebook notification lost while the worker was not listening, so the job is not
+    graded on the assignment generated before. None if the exercise has no notebook.
+    """
+    if version is not None:
+        if exercise in MANIFEST and MANIFEST[exercise] != version:
+            logger.info(f"Missed the update of the notebook of exercise {exercise}, grading with version {version}")
+        MANIFEST[exercise] = version
+    return version
+
+def refresh_manifest(notebook_name: str) -> None:
+    """Updates the version of the assignment of the notebook in the manifest"""
+    db.cursor.execute(
+    """
+    SELECT in_exercise, version FROM notebook WHERE filename = %s;
+    """,
+        [notebook_name],
+    )
+    row = db.cursor.fetchone()
+    if row is not None:
+        MANIFEST[row[0]] = row[1]
+        # the cells are recreated with every upload, even of the same version
+        CELLS.pop(row[0], None)
+
+def prefetch(exercises: typing.List[str]) -> None:
+    """Generates the assignments of the exercises in the grading slots, in parallel"""
+    for exercise in exercises:
+        update = asyncio.ensure_future(in_slot(check_assignment, exercise, MANIFEST[exercise]))
+        UPDATES.add(update)
+        update.add_done_callback(UPDATES.discard)
+
+def beat() -> None:
+    """Reports this worker alive and renews the leases of its running jobs"""
+    lease = datetime.timedelta(seconds=LEASE_TIMEOUT)
+    db.cursor.execute(
+    """
+    INSERT INTO workerheartbeat (worker_id, started_at, last_seen, expires_at, slots, running)
+        VALUES (%s, %s, now(), now() + %s, %s, %s)
+    ON CONFLICT (worker_id) DO UPDATE SET last_seen = EXCLUDED.last_seen,
+        expires_at = EXCLUDED.expires_at,
+        running = EXCLUDED.running;
+    UPDATE workerassignment SET lease_expires_at = now() + %s WHERE worker_id = %s AND process = ANY(%s);
+    """,
+        [WORKER_ID, STARTED_AT, lease, GRADING_SLOTS, len(JOBS), lease, WORKER_ID, list(JOBS.keys())],
+    )
 
-def grade_notebook(process_id) -> None:
+def heartbeat() -> None:
+    """Beats every HEARTBEAT_INTERVAL seconds, also while draining, so the running jobs keep their leases"""
+    asyncio.get_event_loop().call_later(HEARTBEAT_INTERVAL, heartbeat)
+    if not db.connected:
+        # the leases are renewed after the reconnect
+        return
+    try:
+        beat()
+    except CONNECTION_ERRORS as e:
+        logger.error(f"Lost connection to the database while reporting the heartbeat: {str(e)}")
+        if not DRAINING:
+            ensure_reconnect()
+    except Exception as e:
+        logger.error(f"Error while reporting the heartbeat: {str(e)}")
+
+def reap() -> None:
+    """
+    Gives up the processes whose lease expired MAX_ATTEMPTS times, as they took down the worker grading them each time.
+    They get an error log, so the student is notified and can submit again.
+    """
+    db.cursor.execute(
+    """
+    WITH failed AS (
+        INSERT INTO errorlog (process, log)
+            SELECT process, %s FROM workerassignment JOIN gradingprocess ON workerassignment.process = gradingprocess.identifier
+            WHERE lease_expires_at < now() AND attempts >= %s AND gradingprocess.state IN ('queued', 'running')
+        ON CONFLICT (process) DO NOTHING
+        RETURNING process
+    ), failed_at AS (
+        UPDATE gradingprocess SET errored_at = now(), state = 'failed' FROM failed
+        WHERE gradingprocess.identifier = failed.process
+    )
+    SELECT process, pg_notify('notify_student', process::text) FROM failed;
+    """,
+        [f"Error through grading: the grading was aborted {MAX_ATTEMPTS} times", MAX_ATTEMPTS],
+    )
+    for (process_id, _) in db.cursor.fetchall():
+        logger.error(f"Gave up process {process_id} after {MAX_ATTEMPTS} expired leases")
+    # keep the workers which stopped responding visible for a day
+    db.cursor.execute(
+    """
+    DELETE FROM workerheartbeat WHERE expires_at < now() - interval '1 day';
+    """
+    )
+
+def sweep() -> None:
+    """Grades everything which was requested or left unfinished while this worker was not connected"""
+    try:
+        beat()
+    except Exception as e:
+        logger.error(f"Error while reporting the heartbeat: {str(e)}")
+    try:
+        release_orphaned()
+    except Exception as e:
+        logger.error(f"Error while releasing orphaned processes: {str(e)}")
+    try:
+        # also catches up on notebook updates missed while not connected
+        prefetch(load_manifest())
+    except Exception as e:
+        logger.error(f"Error while loading the assignment versions: {str(e)}")
+    dispatch_jobs()
+
+def poll_jobs() -> None:
+    """Periodically checks the connection and claimable processes, in case a notification was missed"""
+    if DRAINING:
+        return
+    if db.alive():
+        try:
+            reap()
+        except Exception as e:
+            logger.error(f"Error while reaping expired processes: {str(e)}")
+        try:
+            metrics.QUEUE_DEPTH.set(SCHEDULER.depth(db.cursor))
+        except Exception as e:
+            logger.error(f"Error while counting waiting processes: {str(e)}")
+        dispatch_jobs()
+    else:
+        ensure_reconnect()
+    asyncio.get_event_loop().call_later(WAITING_TIME, poll_jobs)
+
+async def reconnect() -> None:
+    """Reconnects to the database, waiting exponentially longer between failed attempts"""
+    global RECONNECTING
+    delay = 1
+    try:
+        while True:
+            try:
+                db.connect()
+                return
+            except CONNECTION_ERRORS as e:
+                logger.error(f"Could not connect to the database, retrying in {delay}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+    finally:
+        RECONNECTING = None
+
+def ensure_reconnect() -> None:
+    """Stops listening on the lost connection and reconnects, unless a reconnect is already running"""
+    global RECONNECTING, LISTENER_FD
+    if LISTENER_FD is not None:
+        asyncio.get_event_loop().remove_reader(LISTENER_FD)
+        LISTENER_FD = None
+    db.close()
+    if RECONNECTING is None:
+        RECONNECTING = asyncio.ensure_future(reconnect())
+
+async def in_slot(function, *args) -> None:
+    """Updates a notebook in one of the grading slots, so the worker keeps listening and grading meanwhile"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(SLOTS, function, *args)
+    except concurrent.futures.process.BrokenProcessPool as e:
+        logger.error(f"Grading slot died while updating notebook {args[0]}: {str(e)}")
+        start_slots()
+    except Exception as e:
+        logger.error(f"Error while updating notebook {args[0]}: {str(e)}")
+
+def release(process_ids: typing.List[str]) -> None:
+    """Removes the assignment of the given processes to this worker, so other workers can claim them"""
+    db.cursor.execute(
+    """
+    WITH released AS (
+        DELETE FROM workerassignment WHERE worker_id = %s AND process = ANY(%s) RETURNING process
+    )
+    UPDATE gradingprocess SET state = 'queued' FROM released
+    WHERE gradingprocess.identifier = released.process AND gradingprocess.state = 'running';
+    """,
+        [WORKER_ID, process_ids],
+    )
+    logger.info(f"Released {len(process_ids)} unfinished process(es) to other workers")
+
+async def drain() -> None:
+    """
+    Stops claiming new processes and waits up to DRAIN_TIMEOUT seconds for the running jobs to finish.
+    Jobs still running afterwards are released, so other workers grade them.
+    """
+    global DRAINING
+    if DRAINING:
+        return
+    DRAINING = True
+    loop = asyncio.get_running_loop()
+    if LISTENER_FD is not None:
+        loop.remove_reader(LISTENER_FD)
+    if RECONNECTING is not None:
+        RECONNECTING.cancel()
+
+    pending = set(JOBS.values()) | UPDATES
+    if pending:
+        logger.info(f"Waiting up to {DRAIN_TIMEOUT}s for {len(JOBS)} running job(s) and {len(UPDATES)} update(s)")
+        await asyncio.wait(pending, timeout=DRAIN_TIMEOUT)
+
+    unfinished = list(JOBS.keys())
+    for job in list(JOBS.values()) + list(UPDATES):
+        job.cancel()
+    try:
+        if unfinished:
+            release(unfinished)
+        db.cursor.execute(
+        """
+        DELETE FROM workerheartbeat WHERE worker_id = %s;
+        """,
+            [WORKER_ID],
+        )
+    except Exception as e:
+        logger.error(f"Error while releasing unfinished processes: {str(e)}")
+
+    SLOTS.shutdown(wait=False, cancel_futures=True)
+    # the slots of cancelled jobs would otherwise keep grading
+    for child in multiprocessing.active_children():
+        child.terminate()
+    db.close()
+    loop.stop()
+
+def stop() -> None:
+    logger.info("Received term signal. Finishing running jobs...")
+    asyncio.ensure_future(drain())
+
+def _on_connect() -> None:
+    """Listens for notifications on the new connection and sweeps for the backlog"""
+    global LISTENER_FD
+    if DRAINING:
+        return
+    loop = asyncio.get_event_loop()
+    if LISTENER_FD is not None:
+        loop.remove_reader(LISTENER_FD)
+    LISTENER_FD = db.connection.fileno()
+    loop.add_reader(LISTENER_FD, handle_listener)
+    loop.call_soon(sweep)
+
+async def grade_notebook(process_id) -> None:
+    timer = metrics.Timer()
+    grading_process = None
+    # recorded with the phases of the job however it ends
+    outcome = "error"
     try:
         try: 
             logger.info(f"Fetching student notebook with process id {process_id}")
-            cursor.execute(
-              """
-              SELECT data, notebook FROM
-              studentnotebook WHERE process = %s; 
-              """,
-                  [process_id],
-              )
-            if cursor.rowcount == 0:
+            with timer.phase("fetch"):
+                db.cursor.execute(
+                  """
+                  SELECT data, notebook FROM
+                  studentnotebook WHERE process = %s; 
+                  """,
+                      [process_id],
+                  )
+            if db.cursor.rowcount == 0:
                 # we shouldnt be here
-                cursor.execute(
-                """
-                INSERT INTO errorlog(process, log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING;
-                """,
-                    [process_id, "No uploaded notebook found"],
-                )
+                log_error(process_id, "No uploaded notebook found")
                 return
-            (notebook_data, notebook_filename) = cursor.fetchone()
+            (notebook_data, notebook_filename) = db.cursor.fetchone()
 
+        except CONNECTION_ERRORS:
+            raise
         except Exception as e:
             logger.info("Error while fetching notebook:" + str(e))
 
-            cursor.execute(
-            """
-              INSERT INTO errorlog(process, log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING;
-            """,
-                [process_id, "No uploaded notebook found"],
-            )
+            log_error(process_id, "No uploaded notebook found")
 
-        grading_process = None
         try:
             # logger.info("Fetching grading process")
-            cursor.execute(
+            db.cursor.execute(
             """
-            SELECT gradingprocess.identifier, gradingprocess.requested_at, gradingprocess.for_exercise FROM gradingprocess WHERE identifier = %s;
+            SELECT gradingprocess.identifier, gradingprocess.requested_at, gradingprocess.for_exercise, notebook.version
+            FROM gradingprocess LEFT JOIN notebook ON notebook.in_exercise = gradingprocess.for_exercise
+            WHERE identifier = %s;
             """,
               [process_id],
             )
 
-            grading_process = cursor.fetchone()
+            grading_process = db.cursor.fetchone()
 
             # logger.info(f"Grading process: {grading_process}")
 
-            cursor.execute(
-            """
-            INSERT INTO workerassignment (worker_id, process, assigned_at)
-                VALUES(%s,%s,%s);
-            """,
-              [WORKER_ID, process_id, datetime.datetime.now()],
-            )
-            logger.info(f"Worker assignment for process {process_id} created.")
-
+        except CONNECTION_ERRORS:
+            raise
         except Exception as e:
-            logger.info("Error while fetching grading process and store workerassignment:" + str(e))
-            cursor.execute(
-            """
-              INSERT INTO errorlog(process, log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING;
-            """,
-                [process_id, "Error while fetching grading process" + str(e)],
-            )
+            logger.info("Error while fetching grading process:" + str(e))
+            log_error(process_id, "Error while fetching grading process" + str(e))
             if grading_process is None:
                 logger.info(f"Process with ID {process_id} not found.")
                 return
 
         try:
             logger.info("Starting grading process...")
-            result = grade(
+            # read with the process instead of taken from the manifest, which misses the notifications lost meanwhile
+            version = claim_version(grading_process[2], grading_process[3])
+            # grade in one of the slot processes, so the loop can hand out further jobs meanwhile
+            result, durations = await asyncio.get_running_loop().run_in_executor(
+                SLOTS,
+                grade,
                 {notebook_filename: notebook_data.tobytes()},
                 grading_process[2],
                 process_id,
+                version,
             )
 
             logger.info(f"Achieved result: {str(result)}")
+            timer.durations.update(durations)
+
+        except concurrent.futures.process.BrokenProcessPool as err:
+            # a slot process died (e.g. killed by the OOM killer), the pool is unusable afterwards
+            logger.error(f"Grading slot died while grading process {process_id}: {err}")
+            outcome = "slot_died"
+            log_error(process_id, f"Error through grading: grading slot died")
+            start_slots()
 
+            enqueue_graded(process_id)
         except RuntimeError as err:
             logger.error("Grading error!")
-            cursor.execute(
-            """
-            INSERT INTO errorlog(process,log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING;
-            """,
-            [process_id, f"Error through grading: {str(err)}"],
-            )
+            outcome = "failed"
+            # the phases the slot went through before it failed
+            timer.durations.update(getattr(err, "durations", {}))
+            log_error(process_id, f"Error through grading: {str(err)}")
 
             enqueue_graded(process_id)
         else:
-            
-            params = (
-                (
-                    process_id,
-                    result[cell_id],
-                    grading_process[2],
-                    notebook_filename,
-                    cell_id,
-                )
-                for cell_id in result.keys()
-            )
             logger.info("Inserting result into the database...")
-            # We need the correct pk of the cell, as grading has a foreign key on the pk
-            # of the cell, NOT ON THE CELL_ID AS IN THE NOTEBOOK
-            # for this we join the cell on subexercise on notebook on exercise
-            # and compare the cell_id in the cell table which holds the cell id as in the
-            # notebook
-            psycopg2.extras.execute_batch(
-                cursor,
-                """
-            INSERT INTO grading(process,cell,points)
-                SELECT %s, cell.id, %s FROM cell 
-                    JOIN subexercise ON cell.sub_exercise=subexercise.id
-                    JOIN notebook ON subexercise.in_notebook=notebook.filename
-                    JOIN exercise ON notebook.in_exercise=exercise.identifier
-                WHERE exercise.identifier=%s
-                    AND notebook.filename=%s
-                    AND cell.cell_id=%s
-            """,
-                params,
-            )
-
-            enqueue_graded(process_id)
-            
+            with timer.phase("store"):
+                stored = store_result(process_id, grading_process[2], notebook_filename, version, result)
+            outcome = "graded" if stored else "lost_lease"
+
+    except CONNECTION_ERRORS:
+        # do not log an error for the student, the process is graded again after the reconnect
+        outcome = "connection_lost"
+        raise
     except Exception as e:
     # to error handling?
         logger.info("Error while grading notebook:" + str(e))
-        cursor.execute(
-        """
-          INSERT INTO errorlog(process, log) VALUES(%s,%s) ON CONFLICT (process) DO NOTHING;
-        """,
-            [process_id, "Error while grading notebook: " + str(e)],
-        )
+        log_error(process_id, "Error while grading notebook: " + str(e))
     else:
         logger.info(f"Grading process with ID {grading_process[0]} finished.")
-
-def check_assignment(assignment: str) -> None:
+    finally:
+        exercise = grading_process[2] if grading_process else ""
+        # a job interrupted by a lost connection is not finished, it is graded again
+        if outcome != "connection_lost":
+            metrics.JOBS_FINISHED.labels(exercise=exercise, outcome=outcome).inc()
+        metrics.observe(exercise, outcome, timer.durations)
+
+def check_assignment(assignment: str, version: typing.Optional[str]) -> None:
     """
-    Sanity checking if the assignment exists and is the newest version in the source folder.
-    If not, the assignment will be updated.
+    Ensures the assignment is generated in the course root of this process in the given version or a newer one.
+    This is a dictionary lookup, unless the assignment was not generated yet or changed since.
     """
+    if version is not None and PREPARED.get(assignment) == version:
+        return
     try:
-        # check if the assignment exists
-        if API.get_assignment(assignment, released=[assignment]) is None:
-            # seems to return None if assignment does not exist: https://nbgrader.readthedocs.io/en/stable/_modules/nbgrader/apps/api.html#NbGraderAPI.get_assignment
-            logger.error(
-                f"Grading for Assignment {assignment} was requested but assignment was not found!"
-            )
-            cursor.execute("""
-                    SELECT * FROM notebook WHERE in_exercise=%s;
-                """,
-                [assignment]
-            )
-            # check if there is a notebook for the assignment in the database
-            notebook = cursor.fetchone()
-
-            if notebook is None:
-                logger.error(
-                    f"Notebook for assignment {assignment} was not found in the database!"
-                )
-                raise RuntimeError('Assignment for grading not found')
-            else:
-                update_notebook(notebook[0])
-                logger.info(f"Notebook for assignment {assignment} updated") 
-
-        # check if assignment also exist in release folder
-        elif not os.path.exists(f"{COURSE_DIRECTORY}/{API.coursedir.release_directory}/{assignment}"):
-            logger.error(
-                f"Grading for Assignment {assignment} was requested but assignment was not found in release folder!"
-            )
-            API.generate_assignment(assignment)
-            # logger.info(f"Assignment {assignment} generated in release folder")
-
-        # ensure each worker is uptodate with the newest assignment version, therefore check time of last update in directory
-        RELEASE_PATH = pathlib.Path(COURSE_DIRECTORY) / pathlib.Path(
-            API.coursedir.release_directory
-        )
-
-        last_release_update = datetime.datetime.fromtimestamp(os.path.getmtime(f"{RELEASE_PATH}/{assignment}"), tz=datetime.timezone.utc)
-        # logger.info(f"Last release updated at: {last_release_update}")
-
-        cursor.execute("""
-            SELECT * FROM notebook WHERE in_exercise = %s ORDER BY uploaded_at DESC LIMIT 1;
+        db.cursor.execute("""
+                SELECT filename FROM notebook WHERE in_exercise=%s;
             """,
             [assignment]
         )
-
-        last_notebook_v = cursor.fetchone()
-
-        # logger.info(f"Last notebook version: {last_notebook_v[3]}")
-
-        if last_notebook_v[3] > last_release_update :
-            logger.info(last_notebook_v[0])
-            update_notebook(last_notebook_v[0])
-            logger.info(f"Notebook for assignment {assignment} updated")
-        else: 
-            logger.info(f"Notebook for assignment {assignment} is the newest version")
-            
+        # check if there is a notebook for the assignment in the database
+        notebook = db.cursor.fetchone()
     except Exception as e:
         logger.error(f"Error while checking notebook version: {str(e)}")
         raise RuntimeError('Error while checking notebook version')
-    else:
-        logger.info(f"Notebook is the newest version")
 
-    return
+    if notebook is None:
+        logger.error(
+            f"Notebook for assignment {assignment} was not found in the database!"
+        )
+        raise RuntimeError('Assignment for grading not found')
+    update_notebook(notebook[0])
+    if assignment not in PREPARED:
+        raise RuntimeError('Error while checking notebook version')
+    logger.info(f"Notebook for assignment {assignment} is version {PREPARED[assignment]}")
 
 def store_release_data(notebook_name: str, release_data: bytes) -> None:
     """
     Store the release data of a notebook in the database.
     """
     try:
-        cursor.execute("""
-            UPDATE notebook SET release_data = %s WHERE filename = %s;
+        db.cursor.execute("""
+            UPDATE notebook SET
+                release_data = %s,
+                release_data_size = %s,
+                release_data_sha256 = %s,
+                release_data_content_type = 'application/x-ipynb+json'
+            WHERE filename = %s;
             """,
-            [release_data, notebook_name]
+            [release_data, len(release_data), hashlib.sha256(release_data).hexdigest(), notebook_name]
         )
-        conn.commit()
         logger.info(f"Release data for notebook {notebook_name} stored in database")
     except Exception as e:
         logger.error(f"Error while storing release data for notebook {notebook_name}: {str(e)}")
         raise RuntimeError(f"Error while storing release data for notebook {notebook_name}")
 
 def update_notebook(notebook_name) -> None:
+    """
+    Generates the assignment of the notebook in the course root of this process.
+    The source folder is shared, so it is only written (and the release data only stored) if it does not hold this version yet.
+    """
     try:
         try:
-            # Retreive the last updated notebook from the database
-            cursor.execute("""
-                SELECT * FROM notebook WHERE filename = %s ORDER BY uploaded_at DESC LIMIT 1;
+            # Retreive the notebook from the database, its files only if this version is not stored yet
+            db.cursor.execute("""
+                SELECT in_exercise, version FROM notebook WHERE filename = %s;
                 """,
                 [notebook_name]
             )
 
-            notebook = cursor.fetchone()
+            notebook = db.cursor.fetchone()
             
-            folder_name = notebook[1]
+            (folder_name, version) = notebook
 
-            RELEASE_PATH = pathlib.Path(COURSE_DIRECTORY) / pathlib.Path(
+            RELEASE_PATH = pathlib.Path(API.coursedir.root) / pathlib.Path(
                 API.coursedir.release_directory
             )
 
             # Store notebook into course directory
-            SOURCE_PATH = pathlib.Path(COURSE_DIRECTORY) / pathlib.Path(
+            SOURCE_PATH = pathlib.Path(API.coursedir.root) / pathlib.Path(
                 API.coursedir.source_directory
             )
+            # outside of the source folder, as nbgrader would copy it into the assignment otherwise
+            VERSION_PATH = pathlib.Path(COURSE_DIRECTORY) / "versions" / folder_name
+            fresh = not VERSION_PATH.exists() or VERSION_PATH.read_text() != version
+
+            if fresh:
+                # with the version again, the notebook may have been uploaded once more meanwhile
+                db.cursor.execute("""
+                    SELECT data, assets, version FROM notebook WHERE filename = %s;
+                    """,
+                    [notebook_name]
+                )
+                (data, assets, version) = db.cursor.fetchone()
 
-            # create directory if not exist
-            if not os.path.exists(f"{SOURCE_PATH}/{folder_name}"):
-                os.makedirs(f"{SOURCE_PATH}/{folder_name}")
-                logger.info(f"Directory {SOURCE_PATH}/{folder_name} created")
+                # create directory if not exist
+                if not os.path.exists(f"{SOURCE_PATH}/{folder_name}"):
+                    os.makedirs(f"{SOURCE_PATH}/{folder_name}")
+                    logger.info(f"Directory {SOURCE_PATH}/{folder_name} created")
 
-            with open(f"{SOURCE_PATH}/{folder_name}/{notebook_name}", "wb") as f:
-                f.write(notebook[2])
+                # replace the file at once, other slots may read it meanwhile
+                with open(f"{SOURCE_PATH}/{folder_name}/.{notebook_name}", "wb") as f:
+                    f.write(data)
+                os.replace(f"{SOURCE_PATH}/{folder_name}/.{notebook_name}", f"{SOURCE_PATH}/{folder_name}/{notebook_name}")
                 logger.info(f"Notebook {notebook_name} stored in {SOURCE_PATH}/{folder_name}")
 
-            # if assets are present, store them as well
-            if notebook[4] is not None:
-                with open(f"{SOURCE_PATH}/{folder_name}/assets.zip", "wb") as f:
-                    f.write(notebook[4])
-                    logger.info(f"Notebook assets.zip stored in {SOURCE_PATH}/{folder_name}")
-                
-                # unzip the assets.zip file
-                with ZipFile(f"{SOURCE_PATH}/{folder_name}/assets.zip", "r") as zip_file:
-                    zip_file.extractall(f"{SOURCE_PATH}/{folder_name}")
-                    logger.info(f"Notebook assets unzipped in {SOURCE_PATH}/{folder_name}")
-        
-                os.remove(f"{SOURCE_PATH}/{folder_name}/assets.zip")
+                # if assets are present, store them as well
+                if assets is not None:
+                    with open(f"{SOURCE_PATH}/{folder_name}/assets.zip", "wb") as f:
+                        f.write(assets)
+                        logger.info(f"Notebook assets.zip stored in {SOURCE_PATH}/{folder_name}")
+                    
+                    # unzip the assets.zip file
+                    with ZipFile(f"{SOURCE_PATH}/{folder_name}/assets.zip", "r") as zip_file:
+                        zip_file.extractall(f"{SOURCE_PATH}/{folder_name}")
+                        logger.info(f"Notebook assets unzipped in {SOURCE_PATH}/{folder_name}")
+            
+                    os.remove(f"{SOURCE_PATH}/{folder_name}/assets.zip")
                 
             try:
                 # generate the assignment 
                 # (store notebook in src dir to release and stripping all output cells)
                 # https://nbgrader.readthedocs.io/en/stable/user_guide/what_is_nbgrader.html#nbgrader-generate-assignment
                 API.generate_assignment(folder_name)
+                # the kernels imported the dependencies of the old version
+                if kernels.POOL is not None:
+                    wait_for_refill()
+                    kernels.POOL.discard(folder_name)
 
                 release_notebook = API.get_assignment(folder_name, released=[folder_name])
                 if release_notebook is None:
                     logger.error(f"Assignment {folder_name} could not be generated")
                     raise RuntimeError(f"Assignment {folder_name} could not be generated")
-                else:
+                elif fresh:
                     data = _file_to_bytes(f"{RELEASE_PATH}/{folder_name}/{notebook_name}")
                     store_release_data(notebook_name, data)
                     logger.info(f"Release data for assignment {folder_name} stored in database")
@@ -406,15 +938,19 @@ def update_notebook(notebook_name) -> None:
                 raise RuntimeError(f"Error while generating assignment {folder_name}")
             else:
                 logger.info(f"Assignment {folder_name} generated")
+                PREPARED[folder_name] = version
 
-                date_now = datetime.datetime.now()
+                if fresh:
+                    date_now = datetime.datetime.now()
 
-                # update last_updated field in exercise table
-                cursor.execute("""
-                        UPDATE exercise SET last_updated = %s WHERE identifier = %s;
-                    """,
-                    [date_now, folder_name]
-                )
+                    # update last_updated field in exercise table
+                    db.cursor.execute("""
+                            UPDATE exercise SET last_updated = %s WHERE identifier = %s;
+                        """,
+                        [date_now, folder_name]
+                    )
+                    VERSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+                    VERSION_PATH.write_text(version)
 
         except Exception as e:
             logger.error("Error while checking if assignment exists:" + str(e))
@@ -431,16 +967,80 @@ def _file_to_bytes(file_path: str) -> bytes:
     with open(file_path, "rb") as f:
         return f.read()
 
+def _prepare_course(api: NbGraderAPI) -> None:
+    """Ensures the dummy student exists in the gradebook and has a submission folder in the course root of the given api"""
+    gradebook = api.gradebook
+    # check if the dummy student exists and if not, create it
+    gradebook.update_or_create_student(DUMMY_STUDENT_ID)
+    gradebook.close()
+    # create the folder if not exist with all parents
+    path = pathlib.Path(api.coursedir.root) / "submitted" / DUMMY_STUDENT_ID
+    path.mkdir(parents=True, exist_ok=True)
+
+def _init_slot(slot_ids) -> None:
+    """
+    Initialises a grading slot process.
+    Every slot grades in its own course root (and therefore its own gradebook), so slots do not overwrite each others submissions.
+    The source folder is shared with the course directory of the worker.
+    """
+    global API
+    # the worker decides when a slot stops, e.g. after finishing the running job on Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    slot = slot_ids.get()
+    root = pathlib.Path(SLOT_DIRECTORY) / f"slot-{slot}"
+    root.mkdir(parents=True, exist_ok=True)
+    source = root / API.coursedir.source_directory
+    if not source.exists():
+        source.symlink_to(
+            pathlib.Path(COURSE_DIRECTORY) / API.coursedir.source_directory,
+            target_is_directory=True,
+        )
+    API = NbGraderAPI(coursedir=CourseDirectory(root=str(root)), config=kernels.autograde_config())
+    _prepare_course(API)
+    kernels.POOL = kernels.KernelPool(KERNEL_POOL_SIZE, KERNEL_POOL_EXERCISES)
+    # shut the idle kernels down when the slot exits, including the ones still starting
+    multiprocessing.util.Finalize(kernels.POOL, _shutdown_kernels, exitpriority=10)
+    logger.info(f"Grading slot {slot} uses course root {root}")
+
+def start_slots() -> None:
+    """(Re)creates the process pool of grading slots"""
+    global SLOTS
+    if SLOTS is not None:
+        SLOTS.shutdown(wait=False, cancel_futures=True)
+    # spawn instead of fork, so the slots do not inherit the database connection of the worker
+    context = multiprocessing.get_context("spawn")
+    slot_ids = context.Queue()
+    for slot in range(GRADING_SLOTS):
+        slot_ids.put(slot)
+    SLOTS = concurrent.futures.ProcessPoolExecutor(
+        max_workers=GRADING_SLOTS,
+        mp_context=context,
+        initializer=_init_slot,
+        initargs=(slot_ids,),
+    )
+    logger.info(f"Started {GRADING_SLOTS} grading slot(s) in {SLOT_DIRECTORY}")
+
 def handle_listener():
-    conn.poll()
+    try:
+        db.connection.poll()
+    except CONNECTION_ERRORS as e:
+        logger.error(f"Lost connection to the database: {str(e)}")
+        ensure_reconnect()
+        return
+    conn = db.connection
     while conn.notifies:
         notify = conn.notifies.pop(0)
         logger.info(f"Received notification: {notify.channel} - {notify.payload}")
         try:
             if notify.channel == "update_notebook":
-                update_notebook(notify.payload)
+                # jobs dispatched from now on carry the new version, so every slot regenerates the assignment
+                refresh_manifest(notify.payload)
+                update = asyncio.ensure_future(in_slot(update_notebook, notify.payload))
+                UPDATES.add(update)
+                update.add_done_callback(UPDATES.discard)
             elif notify.channel == "grade_notebook":
-                grade_notebook(notify.payload)
+                # the payload is only a hint, the process is claimed from the queue of all ungraded processes
+                dispatch_jobs()
             else:
                 logger.warning(f"Unknown notification channel: {notify.channel}")
         except Exception as e:
@@ -452,36 +1052,27 @@ def main():
     logger.info(f"NBWorker started with worker id {WORKER_ID}")
     logger.info(f"Using Course Directory: {API.coursedir.root}")
 
-    # register a kill method
-    class Killswitch:
-        """A small class which is used for signal handling and termination of the main loop"""
-
-        def __init__(self):
-            self.running = True
-
-        def kill(self, *kwargs):
-            logger.info("Received term signal. Exiting...")
-            self.running = False
-
-    k = Killswitch()
-    signal.signal(signal.SIGINT, k.kill)
-    signal.signal(signal.SIGTERM, k.kill)
-    while k.running:
-        cursor.execute(f"LISTEN update_notebook;")
-        cursor.execute(f"LISTEN grade_notebook;")
-
-        loop = asyncio.get_event_loop()
-        loop.add_reader(conn, handle_listener)
-        loop.run_forever()
+    start_slots()
+
+    loop = asyncio.get_event_loop()
+    # finish the running jobs before exiting
+    loop.add_signal_handler(signal.SIGINT, stop)
+    loop.add_signal_handler(signal.SIGTERM, stop)
+
+    # every (re)connect listens again and grades everything requested while no worker was listening
+    db.on_connect.append(_on_connect)
+    db.listen("update_notebook")
+    db.listen("grade_notebook")
+    loop.call_soon(ensure_reconnect)
+    loop.call_later(WAITING_TIME, poll_jobs)
+    loop.call_later(HEARTBEAT_INTERVAL, heartbeat)
+    metrics.JOBS_IN_FLIGHT.set_function(lambda: len(JOBS))
+    metrics.serve(METRICS_PORT, METRICS_ADDRESS)
+    loop.run_forever()
+    logger.info("NBWorker stopped")
 
 def cmd():
-    GRADEBOOK = API.gradebook
-    # check if the dummy student exists and if not, create it
-    GRADEBOOK.update_or_create_student(DUMMY_STUDENT_ID)
-    GRADEBOOK.close()
-    # create the folder if not exist with all parents
-    PATH = pathlib.Path(COURSE_DIRECTORY) / "submitted" / DUMMY_STUDENT_ID
-    PATH.mkdir(parents=True, exist_ok=True)
+    _prepare_course(API)
     # nbgrader will not work if the assignments are not in the database
     # it seems to be necessary to generate the assignments, so that nbgrader is correctly initialised
     # therefore we do that for every assignment present
@@ -493,10 +1084,10 @@ def cmd():
         main()
     except KeyboardInterrupt:
         try:
-            conn.close()
+            db.close()
             sys.exit(0)
         except SystemExit:
-            conn.close()
+            db.close()
             os._exit(0)
 
 if __name__ == "__main__":
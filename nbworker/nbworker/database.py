@@ -0,0 +1,79 @@
+import logging
+import typing
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+"""Errors raised by psycopg2 if the connection to the database is lost"""
+
+
+class Database:
+    """
+    A lazily opened connection to the postgres database in autocommit mode.
+    If the connection was lost, it is reopened on the next access of the connection or cursor
+    and all channels registered with listen() are listened on again.
+    The callbacks in on_connect are called after every (re)connect.
+    """
+
+    def __init__(self, **params):
+        self.params = params
+        self.channels: typing.List[str] = []
+        self.on_connect: typing.List[typing.Callable[[], None]] = []
+        self._connection = None
+        self._cursor = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None and not self._connection.closed
+
+    @property
+    def connection(self):
+        if not self.connected:
+            self.connect()
+        return self._connection
+
+    @property
+    def cursor(self):
+        if not self.connected:
+            self.connect()
+        return self._cursor
+
+    def connect(self) -> None:
+        """Opens a new connection, replacing the current one"""
+        self.close()
+        self._connection = psycopg2.connect(**self.params)
+        self._connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self._cursor = self._connection.cursor()
+        for channel in self.channels:
+            self._cursor.execute(f"LISTEN {channel};")
+        logger.info(f"Connected to database {self.params.get('dbname')} on {self.params.get('host')}")
+        for callback in self.on_connect:
+            callback()
+
+    def listen(self, channel: str) -> None:
+        """Listens on the channel, also after each reconnect"""
+        self.channels.append(channel)
+        if self.connected:
+            self._cursor.execute(f"LISTEN {channel};")
+
+    def alive(self) -> bool:
+        """Checks whether the database is still reachable over the current connection"""
+        if not self.connected:
+            return False
+        try:
+            self._cursor.execute("SELECT 1;")
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def close(self) -> None:
+        if self._connection is not None and not self._connection.closed:
+            try:
+                self._connection.close()
+            except CONNECTION_ERRORS:
+                pass
+        self._connection = None
+        self._cursor = None
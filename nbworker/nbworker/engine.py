@@ -0,0 +1,148 @@
+import logging
+import os
+import shutil
+import tempfile
+import types
+import typing
+
+import nbformat
+from nbgrader import utils
+from nbgrader.api import MissingEntry
+from nbgrader.apps import NbGraderAPI
+from nbgrader.converters import GenerateAssignment
+from nbgrader.preprocessors import CheckCellMetadata, ClearOutput, DeduplicateIds, OverwriteCells, SaveCells
+
+from nbworker.kernels import PooledExecute
+
+logger = logging.getLogger(__name__)
+
+
+class SourceNotebook:
+    """
+    The cells of a source notebook as generate_assignment saves them into the gradebook,
+    i.e. the master versions the cells of a submission are checked against.
+    """
+
+    def __init__(self, api: NbGraderAPI, assignment: str, path: str):
+        notebook = nbformat.read(path, as_version=4)
+        resources = {
+            "nbgrader": {
+                "notebook": os.path.splitext(os.path.basename(path))[0],
+                "assignment": assignment,
+                "db_url": api.coursedir.db_url,
+            },
+            "metadata": {"path": os.path.dirname(path)},
+        }
+        # all preprocessors of generate_assignment up to the one saving the cells into the gradebook
+        for preprocessor in GenerateAssignment.class_traits()["preprocessors"].default():
+            if preprocessor is SaveCells:
+                break
+            notebook, resources = preprocessor(parent=api).preprocess(notebook, resources)
+
+        self.kernelspec = notebook.metadata.get("kernelspec")
+        self.source_cells: typing.Dict[str, types.SimpleNamespace] = {}
+        self.grade_cells: typing.Dict[str, types.SimpleNamespace] = {}
+        for cell in notebook.cells:
+            if not (utils.is_grade(cell) or utils.is_solution(cell) or utils.is_locked(cell) or utils.is_task(cell)):
+                continue
+            grade_id = cell.metadata.nbgrader["grade_id"]
+            self.source_cells[grade_id] = types.SimpleNamespace(
+                name=grade_id,
+                cell_type=cell.cell_type,
+                locked=utils.is_locked(cell),
+                source=cell.source,
+                checksum=cell.metadata.nbgrader.get("checksum", None),
+            )
+            if utils.is_grade(cell):
+                self.grade_cells[grade_id] = types.SimpleNamespace(
+                    name=grade_id, max_score=float(cell.metadata.nbgrader["points"])
+                )
+
+    # the lookups of the gradebook used by OverwriteCells
+
+    def find_source_cell(self, grade_id: str, notebook: str, assignment: str) -> types.SimpleNamespace:
+        if grade_id not in self.source_cells:
+            raise MissingEntry()
+        return self.source_cells[grade_id]
+
+    def find_graded_cell(self, grade_id: str, notebook: str, assignment: str) -> types.SimpleNamespace:
+        if grade_id not in self.grade_cells:
+            raise MissingEntry()
+        return self.grade_cells[grade_id]
+
+
+class OverwriteSourceCells(OverwriteCells):
+    """OverwriteCells of nbgrader, checking against the cells of a SourceNotebook instead of the gradebook"""
+
+    def __init__(self, source: SourceNotebook, **kwargs):
+        super().__init__(**kwargs)
+        self.gradebook = source
+
+    def preprocess(self, nb, resources):
+        self.notebook_id = resources["nbgrader"]["notebook"]
+        self.assignment_id = resources["nbgrader"]["assignment"]
+        return super(OverwriteCells, self).preprocess(nb, resources)
+
+
+_SOURCES: typing.Dict[str, typing.Tuple[int, SourceNotebook]] = {}
+"""The source notebooks by path, with the modification time of the file they were read from"""
+
+
+def source_notebook(api: NbGraderAPI, assignment: str, filename: str) -> SourceNotebook:
+    """Returns the source notebook of the assignment, read again only if the file changed"""
+    path = os.path.join(api.coursedir.format_path(api.coursedir.source_directory, ".", assignment), filename)
+    modified = os.stat(path).st_mtime_ns
+    cached = _SOURCES.get(path)
+    if cached is None or cached[0] != modified:
+        cached = (modified, SourceNotebook(api, assignment, path))
+        _SOURCES[path] = cached
+    return cached[1]
+
+
+def grade(api: NbGraderAPI, notebook_data: bytes, filename: str, assignment: str) -> typing.Dict[str, typing.Optional[float]]:
+    """
+    Grades the submitted notebook like autograde of nbgrader, but without writing the submission,
+    the autograded notebook or the grades to disk.
+    Returns the points for each grade cell of the source notebook. Grade cells missing in the submission get no points
+    (autograde would keep the points of the previous submission of the dummy student for them).
+    """
+    source = source_notebook(api, assignment, filename)
+    notebook = nbformat.reads(notebook_data.decode("utf-8"), as_version=4)
+    source_path = api.coursedir.format_path(api.coursedir.source_directory, ".", assignment)
+
+    # the notebook runs in a fresh directory with the files of the source folder, like in the autograded folder
+    with tempfile.TemporaryDirectory(prefix=f"{assignment}-", dir=api.coursedir.root) as path:
+        for file in utils.find_all_files(source_path, api.coursedir.ignore + ["*.ipynb"]):
+            destination = os.path.join(path, os.path.relpath(file, source_path))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy(file, destination)
+
+        resources = {
+            "nbgrader": {
+                "notebook": os.path.splitext(filename)[0],
+                "assignment": assignment,
+                "student": None,
+                "db_url": None,
+            },
+            "metadata": {"path": path},
+        }
+        # sanitize
+        notebook, resources = ClearOutput(parent=api).preprocess(notebook, resources)
+        notebook, resources = DeduplicateIds(parent=api).preprocess(notebook, resources)
+        if source.kernelspec:
+            notebook.metadata["kernelspec"] = source.kernelspec
+        notebook, resources = OverwriteSourceCells(source, parent=api).preprocess(notebook, resources)
+        notebook, resources = CheckCellMetadata(parent=api).preprocess(notebook, resources)
+
+        # execute
+        with utils.setenv(NBGRADER_EXECUTION="autograde"):
+            notebook, resources = PooledExecute(parent=api).preprocess(notebook, resources)
+
+    # score
+    cell_point_dict = dict.fromkeys(source.grade_cells, 0.0)
+    for cell in notebook.cells:
+        if utils.is_grade(cell) and cell.metadata.nbgrader["grade_id"] in cell_point_dict:
+            auto_score, _ = utils.determine_grade(cell, logger)
+            # the gradebook stores the points as float
+            cell_point_dict[cell.metadata.nbgrader["grade_id"]] = None if auto_score is None else float(auto_score)
+    return cell_point_dict
@@ -0,0 +1,187 @@
+import ast
+import collections
+import logging
+import os
+import typing
+
+import nbformat
+from jupyter_client.blocking import BlockingKernelClient
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_core.utils import run_sync
+from nbgrader.converters import Autograde
+from nbgrader.preprocessors import Execute
+from traitlets.config import Config
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TIMEOUT = 60
+"""The time in seconds a pre-started kernel may take to import the dependencies of its exercise"""
+
+# Like nbclient, do not write the history of the grading kernels to disk
+KERNEL_ARGUMENTS = ["--HistoryManager.hist_file=:memory:"]
+
+
+def imported_modules(notebook: nbformat.NotebookNode) -> typing.List[str]:
+    """Returns the modules imported on the top level of the code cells of the notebook, in order of appearance"""
+    modules = []
+    for cell in notebook.cells:
+        if cell.cell_type != "code":
+            continue
+        # magics and shell commands are no python syntax
+        source = "\n".join(
+            line for line in cell.source.splitlines() if not line.lstrip().startswith(("%", "!"))
+        )
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                modules.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def _silent_code(body: str) -> str:
+    """Wraps the code into a function, so it leaves no names in the namespace of the notebook"""
+    return "def __nbworker():\n" + "".join(f"    {line}\n" for line in body.splitlines()) + "__nbworker()\ndel __nbworker\n"
+
+
+class WarmKernel:
+    """A started kernel which imports the dependencies of an exercise in the background"""
+
+    def __init__(self, kernel_name: str, modules: typing.List[str], cwd: str):
+        self.kernel_name = kernel_name
+        self.km = AsyncKernelManager(kernel_name=kernel_name)
+        run_sync(self.km.start_kernel)(extra_arguments=KERNEL_ARGUMENTS, cwd=cwd)
+        self.kc = BlockingKernelClient()
+        self.kc.load_connection_info(self.km.get_connection_info())
+        self.kc.start_channels()
+        # silent: neither the execution count nor the outputs of the notebook are affected
+        # the modules end up in sys.modules only, a notebook still has to import them itself
+        self.kc.execute(
+            _silent_code(
+                "import importlib\n"
+                f"for module in {modules!r}:\n"
+                "    try:\n"
+                "        importlib.import_module(module)\n"
+                "    except Exception:\n"
+                "        pass"
+            ),
+            silent=True,
+            store_history=False,
+        )
+
+    def ready(self, path: str) -> bool:
+        """
+        Changes the working directory of the kernel to the path of the notebook to execute and waits until
+        the imports are done. Returns False if the kernel died or did not get ready in time.
+        """
+        msg_id = self.kc.execute(
+            _silent_code(f"import os\nos.chdir({path!r})"), silent=True, store_history=False
+        )
+        try:
+            # the shell channel answers in order, so the reply to the chdir comes after the one of the imports
+            while True:
+                reply = self.kc.get_shell_msg(timeout=WARMUP_TIMEOUT)
+                if reply["parent_header"].get("msg_id") == msg_id:
+                    return reply["content"]["status"] == "ok"
+        except Exception as e:
+            logger.error(f"Pre-started kernel did not get ready: {str(e)}")
+            return False
+        finally:
+            self.kc.stop_channels()
+
+    def shutdown(self) -> None:
+        self.kc.stop_channels()
+        try:
+            run_sync(self.km.shutdown_kernel)(now=True)
+        except Exception as e:
+            logger.error(f"Error while shutting down pre-started kernel: {str(e)}")
+
+
+class KernelPool:
+    """
+    Pre-started kernels of a grading slot by exercise.
+    A kernel is used for one notebook only and replaced afterwards, so no state is shared between submissions.
+    Only the most recently graded exercises keep kernels, to bound the memory used by idle kernels.
+    """
+
+    def __init__(self, size: int, exercises: int):
+        self.size = size
+        self.exercises = exercises
+        self.kernels: typing.OrderedDict[str, typing.Deque[WarmKernel]] = collections.OrderedDict()
+        self.serving: typing.Optional[str] = None
+        """The exercise whose notebook is executed next"""
+
+    def fill(self, exercise: str, release_path: str, cwd: str) -> None:
+        """Starts kernels for the exercise until the pool of the exercise is full"""
+        if self.size <= 0:
+            return
+        kernels = self.kernels.setdefault(exercise, collections.deque())
+        self.kernels.move_to_end(exercise)
+        while len(self.kernels) > self.exercises:
+            _, evicted = self.kernels.popitem(last=False)
+            for kernel in evicted:
+                kernel.shutdown()
+        if len(kernels) >= self.size:
+            return
+        modules = []
+        kernel_name = "python3"
+        for filename in sorted(os.listdir(release_path)):
+            if filename.endswith(".ipynb"):
+                notebook = nbformat.read(os.path.join(release_path, filename), as_version=4)
+                modules.extend(imported_modules(notebook))
+                kernel_name = notebook.metadata.get("kernelspec", {}).get("name", kernel_name)
+        while len(kernels) < self.size:
+            kernels.append(WarmKernel(kernel_name, modules, cwd))
+        logger.info(f"Pre-started {self.size} kernel(s) for exercise {exercise} importing {', '.join(modules) or 'nothing'}")
+
+    def take(self, kernel_name: str, path: str) -> typing.Optional[AsyncKernelManager]:
+        """Returns the manager of a ready kernel for the exercise served, or None if there is none"""
+        kernels = self.kernels.get(self.serving)
+        while kernels:
+            kernel = kernels.popleft()
+            if kernel.kernel_name == kernel_name and kernel.ready(path):
+                return kernel.km
+            kernel.shutdown()
+        return None
+
+    def discard(self, exercise: str) -> None:
+        """Shuts down the kernels of the exercise, e.g. because its notebook was updated"""
+        for kernel in self.kernels.pop(exercise, ()):
+            kernel.shutdown()
+
+    def shutdown(self) -> None:
+        for exercise in list(self.kernels):
+            self.discard(exercise)
+
+
+POOL: typing.Optional[KernelPool] = None
+"""The kernel pool of this grading slot, used by PooledExecute"""
+
+
+class PooledExecute(Execute):
+    """The Execute preprocessor of nbgrader, executing on a pre-started kernel of the pool if there is one"""
+
+    def create_kernel_manager(self):
+        if POOL is not None:
+            kernel_name = self.kernel_name or self.nb.metadata.get("kernelspec", {}).get("name", "python3")
+            path = self.resources.get("metadata", {}).get("path") or os.getcwd()
+            km = POOL.take(kernel_name, path)
+            if km is not None:
+                # still owned by the preprocessor, i.e. shut down after the notebook was executed
+                self.km = km
+                return km
+        return super().create_kernel_manager()
+
+
+def autograde_config() -> Config:
+    """Configures autograde of the nbgrader API to execute the notebooks with PooledExecute"""
+    preprocessors = Autograde.class_traits()["autograde_preprocessors"].default()
+    config = Config()
+    config.Autograde.autograde_preprocessors = [
+        PooledExecute if preprocessor is Execute else preprocessor for preprocessor in preprocessors
+    ]
+    return config
@@ -0,0 +1,50 @@
+import contextlib
+import time
+import typing
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+QUEUE_DEPTH = Gauge("nbworker_queue_depth", "Grading processes waiting to be claimed by any worker")
+JOBS_IN_FLIGHT = Gauge("nbworker_jobs_in_flight", "Grading jobs currently handled by this worker")
+JOBS_FINISHED = Counter(
+    "nbworker_jobs_finished", "Grading jobs finished by this worker by outcome", ["exercise", "outcome"]
+)
+# fetch, check_assignment, dump_notebook, autograde, gradebook and store (insert of the result and notification),
+# of all jobs by the outcome of the job, as in nbworker_jobs_finished and connection_lost
+PHASE_SECONDS = Histogram(
+    "nbworker_phase_seconds",
+    "Duration of the phases of a grading job",
+    ["phase", "exercise", "outcome"],
+    # from a cached lookup to a notebook running into the timeout of nbgrader
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf")),
+)
+
+
+class Timer:
+    """
+    Measures the durations of the phases of one grading job.
+    The slots measure their phases with a timer and hand the durations over to the worker, which records them.
+    """
+
+    def __init__(self):
+        self.durations: typing.Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+def observe(exercise: str, outcome: str, durations: typing.Dict[str, float]) -> None:
+    """Records the durations of the phases a job of the exercise went through before it ended with the outcome"""
+    for phase, seconds in durations.items():
+        PHASE_SECONDS.labels(phase=phase, exercise=exercise, outcome=outcome).observe(seconds)
+
+
+def serve(port: int, address: str) -> None:
+    """Serves the metrics of this process over http in a background thread, port 0 disables the endpoint"""
+    if port:
+        start_http_server(port, addr=address)
@@ -0,0 +1,137 @@
+import collections
+import datetime
+import typing
+import uuid
+
+
+class Candidate(typing.NamedTuple):
+    """A waiting grading process"""
+
+    process: uuid.UUID
+    exercise: str
+    email: str
+    requested_at: datetime.datetime
+    staff: bool
+    stop_date: datetime.datetime
+    cap: typing.Optional[int]
+
+
+class Scheduler:
+    """
+    Decides in which order the waiting grading processes are claimed, on three levels:
+    Submissions of staff members come first.
+    Then the exercises take turns, each one gets a share of the running jobs (of all workers) proportional to its weight,
+    which is higher close to its deadline, and at most its cap.
+    Within an exercise, the users take turns, the one with the fewest running jobs first.
+    Ties are broken by the time of the request.
+    """
+
+    def __init__(self, window: int, max_attempts: int, deadline_window: datetime.timedelta, deadline_weight: float):
+        self.window = window
+        self.max_attempts = max_attempts
+        self.deadline_window = deadline_window
+        self.deadline_weight = deadline_weight
+
+    def waiting(self, cursor) -> typing.List[Candidate]:
+        """Returns the oldest waiting processes of each exercise and all waiting processes of staff members"""
+        cursor.execute(
+        """
+        SELECT identifier, for_exercise, email, requested_at, staff, stop_date, max_concurrent_gradings FROM (
+            SELECT gradingprocess.identifier, gradingprocess.for_exercise, gradingprocess.email, gradingprocess.requested_at,
+                EXISTS (SELECT 1 FROM auth_user WHERE auth_user.email = gradingprocess.email AND auth_user.is_staff) AS staff,
+                exercise.stop_date, exercise.max_concurrent_gradings,
+                row_number() OVER (PARTITION BY gradingprocess.for_exercise ORDER BY gradingprocess.requested_at) AS position
+            FROM gradingprocess JOIN exercise ON gradingprocess.for_exercise = exercise.identifier
+            WHERE gradingprocess.state IN ('queued', 'running')
+                AND NOT EXISTS (SELECT 1 FROM workerassignment WHERE workerassignment.process = gradingprocess.identifier
+                    AND (workerassignment.lease_expires_at >= now() OR workerassignment.attempts >= %s))
+        ) AS waiting
+        WHERE position <= %s OR staff;
+        """,
+            [self.max_attempts, self.window],
+        )
+        return [Candidate(*row) for row in cursor.fetchall()]
+
+    def depth(self, cursor) -> int:
+        """Returns the number of all waiting processes"""
+        cursor.execute(
+        """
+        SELECT count(*) FROM gradingprocess
+        WHERE gradingprocess.state IN ('queued', 'running')
+            AND NOT EXISTS (SELECT 1 FROM workerassignment WHERE workerassignment.process = gradingprocess.identifier
+                AND (workerassignment.lease_expires_at >= now() OR workerassignment.attempts >= %s));
+        """,
+            [self.max_attempts],
+        )
+        return cursor.fetchone()[0]
+
+    def running(self, cursor) -> typing.List[typing.Tuple[str, str]]:
+        """Returns the exercise and email of all processes currently graded by any worker"""
+        cursor.execute(
+        """
+        SELECT gradingprocess.for_exercise, gradingprocess.email FROM workerassignment
+            JOIN gradingprocess ON workerassignment.process = gradingprocess.identifier
+        WHERE workerassignment.lease_expires_at >= now() AND gradingprocess.state = 'running';
+        """
+        )
+        return cursor.fetchall()
+
+    def weight(self, candidate: Candidate, now: datetime.datetime) -> float:
+        if candidate.stop_date - now <= self.deadline_window:
+            return self.deadline_weight
+        return 1.0
+
+    def order(
+        self,
+        candidates: typing.List[Candidate],
+        running: typing.List[typing.Tuple[str, str]],
+        now: datetime.datetime,
+    ) -> typing.Iterator[uuid.UUID]:
+        """Yields the waiting processes in the order they should be claimed, assuming each one is claimed"""
+        running_exercises = collections.Counter(exercise for exercise, _ in running)
+        running_users = collections.Counter(email for _, email in running)
+
+        # staff members test their exercises, they should not wait behind the students
+        for candidate in sorted((c for c in candidates if c.staff), key=lambda c: c.requested_at):
+            running_exercises[candidate.exercise] += 1
+            running_users[candidate.email] += 1
+            yield candidate.process
+
+        queues: typing.Dict[str, typing.Dict[str, typing.Deque[Candidate]]] = collections.defaultdict(
+            lambda: collections.defaultdict(collections.deque)
+        )
+        for candidate in sorted((c for c in candidates if not c.staff), key=lambda c: c.requested_at):
+            queues[candidate.exercise][candidate.email].append(candidate)
+
+        while queues:
+            def exercise_share(exercise):
+                first = min((queue[0] for queue in queues[exercise].values()), key=lambda c: c.requested_at)
+                return (running_exercises[exercise] / self.weight(first, now), first.requested_at)
+
+            eligible = [
+                exercise
+                for exercise, users in queues.items()
+                if next(iter(users.values()))[0].cap is None
+                or running_exercises[exercise] < next(iter(users.values()))[0].cap
+            ]
+            if not eligible:
+                return
+            exercise = min(eligible, key=exercise_share)
+            users = queues[exercise]
+            email = min(users, key=lambda email: (running_users[email], users[email][0].requested_at))
+            candidate = users[email].popleft()
+            if not users[email]:
+                del users[email]
+            if not users:
+                del queues[exercise]
+            running_exercises[exercise] += 1
+            running_users[email] += 1
+            yield candidate.process
+
+    def plan(self, cursor) -> typing.Iterator[uuid.UUID]:
+        """Yields the waiting processes in the order they should be claimed"""
+        candidates = self.waiting(cursor)
+        if not candidates:
+            return iter(())
+        running = self.running(cursor)
+        return self.order(candidates, running, datetime.datetime.now(datetime.timezone.utc))
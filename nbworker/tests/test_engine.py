@@ -0,0 +1,108 @@
+import copy
+import pathlib
+import shutil
+import tempfile
+import typing
+import unittest
+
+import nbformat
+from nbgrader.apps import NbGraderAPI
+from nbgrader.coursedir import CourseDirectory
+
+from nbworker import engine, kernels
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+ASSIGNMENT = "exercise"
+FILENAME = "exercise.ipynb"
+
+
+def answer(notebook: nbformat.NotebookNode, grade_id: str, source: str) -> nbformat.NotebookNode:
+    for cell in notebook.cells:
+        if cell.metadata.get("nbgrader", {}).get("grade_id") == grade_id:
+            cell.source = source
+    return notebook
+
+
+class EngineTests(unittest.TestCase):
+    """The in-memory engine grades a submission with the same points as autograde of nbgrader"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.TemporaryDirectory(prefix="nbworker-")
+        shutil.copytree(FIXTURES / ASSIGNMENT, pathlib.Path(cls.root.name) / "source" / ASSIGNMENT)
+        cls.api = NbGraderAPI(coursedir=CourseDirectory(root=cls.root.name), config=kernels.autograde_config())
+        result = cls.api.generate_assignment(ASSIGNMENT)
+        assert result["success"], result["error"]
+        release = pathlib.Path(cls.root.name) / "release" / ASSIGNMENT / FILENAME
+        cls.release = nbformat.read(str(release), as_version=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.gradebook.close()
+        cls.root.cleanup()
+
+    def submission(self, **answers) -> nbformat.NotebookNode:
+        notebook = copy.deepcopy(self.release)
+        for grade_id, source in answers.items():
+            answer(notebook, grade_id, source)
+        return notebook
+
+    def autograde(self, data: bytes) -> dict:
+        # a student of its own for every submission, so no points are left from a previous one
+        student = self.id().rsplit(".", 1)[-1]
+        path = pathlib.Path(self.root.name) / "submitted" / student / ASSIGNMENT
+        path.mkdir(parents=True)
+        (path / FILENAME).write_bytes(data)
+        result = self.api.autograde(ASSIGNMENT, student, force=True, create=True)
+        self.assertTrue(result["success"], result.get("error") or result.get("log"))
+        with self.api.gradebook as gradebook:
+            notebook = gradebook.find_submission(ASSIGNMENT, student).notebooks[0]
+            return {grade.cell.name: grade.auto_score for grade in notebook.grades}
+
+    def grade(self, notebook: nbformat.NotebookNode) -> typing.Tuple[dict, dict]:
+        """The points of the engine and of autograde"""
+        data = nbformat.writes(notebook).encode("utf-8")
+        return engine.grade(self.api, data, FILENAME, ASSIGNMENT), self.autograde(data)
+
+    def assertSamePoints(self, notebook: nbformat.NotebookNode, expected: dict):
+        points, autograded = self.grade(notebook)
+        self.assertEqual(points, expected)
+        self.assertEqual(points, autograded)
+
+    def test_correct(self):
+        notebook = self.submission(
+            area="def area(r):\n    return math.pi * r * r", read='data = open("data.txt").read().strip()'
+        )
+        self.assertSamePoints(notebook, {"test-area": 2.0, "test-read": 3.0, "test-partial": 1.0})
+
+    def test_wrong(self):
+        notebook = self.submission(area="def area(r):\n    return 2 * r", read='data = "41"')
+        self.assertSamePoints(notebook, {"test-area": 0.0, "test-read": 0.0, "test-partial": 0.5})
+
+    def test_tampered_tests(self):
+        # the tests are restored from the source notebook, including the hidden ones
+        notebook = self.submission(
+            **{"area": "def area(r):\n    return 0", "test-area": "pass", "read": 'data = "0"', "test-read": "pass"}
+        )
+        self.assertSamePoints(notebook, {"test-area": 0.0, "test-read": 0.0, "test-partial": 0.5})
+
+    def test_blank(self):
+        self.assertSamePoints(self.submission(), {"test-area": 0.0, "test-read": 0.0, "test-partial": 0.0})
+
+    def test_error(self):
+        notebook = self.submission(area="def area(r):\n    return math.pi * r ** 2", read="data = 1 / 0")
+        self.assertSamePoints(notebook, {"test-area": 2.0, "test-read": 0.0, "test-partial": 0.0})
+
+    def test_deleted_grade_cell(self):
+        notebook = self.submission(
+            area="def area(r):\n    return math.pi * r ** 2", read='data = open("data.txt").read().strip()'
+        )
+        notebook.cells = [cell for cell in notebook.cells if cell.metadata.nbgrader["grade_id"] != "test-read"]
+        points, autograded = self.grade(notebook)
+        self.assertEqual(points, {"test-area": 2.0, "test-read": 0.0, "test-partial": 1.0})
+        # autograde has no points for it either on the first submission of a student, and keeps them afterwards
+        self.assertEqual(autograded, {**points, "test-read": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
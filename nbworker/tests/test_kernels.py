@@ -0,0 +1,139 @@
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import nbformat
+from nbgrader.apps import NbGraderAPI
+from nbgrader.coursedir import CourseDirectory
+
+import nbworker
+from nbworker import engine, kernels, metrics
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+ASSIGNMENT = "exercise"
+FILENAME = "exercise.ipynb"
+
+
+def notebook(*sources: str) -> nbformat.NotebookNode:
+    return nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source) for source in sources])
+
+
+class ImportedModulesTests(unittest.TestCase):
+    def test_imports(self):
+        modules = kernels.imported_modules(
+            notebook("import math\nimport os.path, json as j", "from collections import abc\nfrom . import local")
+        )
+        self.assertEqual(modules, ["math", "os.path", "json", "collections"])
+
+    def test_top_level_only(self):
+        self.assertEqual(kernels.imported_modules(notebook("def f():\n    import math")), [])
+
+    def test_once(self):
+        self.assertEqual(kernels.imported_modules(notebook("import math", "import math\nimport os")), ["math", "os"])
+
+    def test_magics(self):
+        modules = kernels.imported_modules(notebook("%matplotlib inline\n!pip install numpy\nimport math"))
+        self.assertEqual(modules, ["math"])
+
+    def test_skipped_cells(self):
+        cells = notebook("import (", "import math")
+        cells.cells.insert(0, nbformat.v4.new_markdown_cell("import os"))
+        self.assertEqual(kernels.imported_modules(cells), ["math"])
+
+
+class KernelPoolTests(unittest.TestCase):
+    """A submission is graded on a pre-started kernel of the pool with the same points as on a kernel of its own"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.TemporaryDirectory(prefix="nbworker-")
+        shutil.copytree(FIXTURES / ASSIGNMENT, pathlib.Path(cls.root.name) / "source" / ASSIGNMENT)
+        cls.api = NbGraderAPI(coursedir=CourseDirectory(root=cls.root.name), config=kernels.autograde_config())
+        result = cls.api.generate_assignment(ASSIGNMENT)
+        assert result["success"], result["error"]
+        cls.release_path = str(pathlib.Path(cls.root.name) / "release" / ASSIGNMENT)
+        # a submission with points, so the kernel of the pool has to execute the solution and the tests
+        submission = nbformat.read(str(pathlib.Path(cls.release_path) / FILENAME), as_version=4)
+        for cell in submission.cells:
+            if cell.metadata.get("nbgrader", {}).get("grade_id") == "area":
+                cell.source = "def area(r):\n    return math.pi * r * r"
+        cls.data = nbformat.writes(submission).encode("utf-8")
+        cls.points = engine.grade(cls.api, cls.data, FILENAME, ASSIGNMENT)
+        assert cls.points["test-area"] == 2.0, cls.points
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.gradebook.close()
+        cls.root.cleanup()
+
+    def setUp(self):
+        self.pool = kernels.KernelPool(size=1, exercises=1)
+        self.addCleanup(self.pool.shutdown)
+        patcher = mock.patch.object(kernels, "POOL", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def unpooled(self):
+        """Fails the test if a kernel is started for the notebook instead of taken from the pool"""
+        return mock.patch.object(
+            kernels.Execute, "create_kernel_manager", side_effect=AssertionError("kernel started for the notebook")
+        )
+
+    def test_fill(self):
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        self.assertEqual(len(self.pool.kernels[ASSIGNMENT]), 1)
+        kernel = self.pool.kernels[ASSIGNMENT][0]
+        self.assertEqual(kernel.kernel_name, "python3")
+        # full already
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        self.assertIs(self.pool.kernels[ASSIGNMENT][0], kernel)
+
+    def test_grade(self):
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        kernel = self.pool.kernels[ASSIGNMENT][0]
+        self.pool.serving = ASSIGNMENT
+        with self.unpooled():
+            points = engine.grade(self.api, self.data, FILENAME, ASSIGNMENT)
+        self.assertEqual(points, self.points)
+        # used for this notebook only
+        self.assertEqual(len(self.pool.kernels[ASSIGNMENT]), 0)
+        self.assertFalse(kernels.run_sync(kernel.km.is_alive)())
+
+    def test_other_exercise(self):
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        self.pool.serving = "other"
+        self.assertEqual(engine.grade(self.api, self.data, FILENAME, ASSIGNMENT), self.points)
+        self.assertEqual(len(self.pool.kernels[ASSIGNMENT]), 1)
+
+    def test_other_kernel(self):
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        kernel = self.pool.kernels[ASSIGNMENT][0]
+        self.pool.serving = ASSIGNMENT
+        self.assertIsNone(self.pool.take("other", self.root.name))
+        self.assertFalse(kernels.run_sync(kernel.km.is_alive)())
+
+    def test_evict(self):
+        self.pool.fill(ASSIGNMENT, self.release_path, self.root.name)
+        kernel = self.pool.kernels[ASSIGNMENT][0]
+        self.pool.fill("other", self.release_path, self.root.name)
+        self.assertEqual(list(self.pool.kernels), ["other"])
+        self.assertFalse(kernels.run_sync(kernel.km.is_alive)())
+
+    def test_refill(self):
+        # the grading slot grades on the kernel of the pool and starts the next one after the grading
+        with mock.patch.object(nbworker, "API", self.api):
+            nbworker.refill_kernels_later(ASSIGNMENT)
+            nbworker.wait_for_refill()
+            kernel = self.pool.kernels[ASSIGNMENT][0]
+            with self.unpooled():
+                points = nbworker.grade_in_memory({FILENAME: self.data}, ASSIGNMENT, metrics.Timer())
+            self.assertEqual(points, self.points)
+            nbworker.wait_for_refill()
+        self.assertEqual(len(self.pool.kernels[ASSIGNMENT]), 1)
+        self.assertIsNot(self.pool.kernels[ASSIGNMENT][0], kernel)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import datetime
+import typing
+import unittest
+import uuid
+
+from nbworker.scheduler import Candidate, Scheduler
+
+NOW = datetime.datetime(2026, 10, 18, 12, tzinfo=datetime.timezone.utc)
+LATER = NOW + datetime.timedelta(days=7)
+
+
+class Cursor:
+    """Answers the queries of the scheduler with the given rows, in the order the queries are run"""
+
+    def __init__(self, *results: typing.List[tuple]):
+        self.results = list(results)
+        self.queries = 0
+
+    def execute(self, query: str, params=None) -> None:
+        self.rows = self.results[self.queries]
+        self.queries += 1
+
+    def fetchall(self) -> typing.List[tuple]:
+        return self.rows
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(
+            window=50, max_attempts=3, deadline_window=datetime.timedelta(hours=24), deadline_weight=2
+        )
+        self.names: typing.Dict[uuid.UUID, str] = {}
+        self.minutes = 0
+
+    def candidate(self, name: str, exercise: str = "EX", email: str = "a@example.org", **fields) -> Candidate:
+        """A process named for the assertions, requested a minute after the previous one"""
+        self.minutes += 1
+        fields = {"staff": False, "stop_date": LATER, "cap": None, **fields}
+        candidate = Candidate(uuid.uuid4(), exercise, email, NOW + datetime.timedelta(minutes=self.minutes), **fields)
+        self.names[candidate.process] = name
+        return candidate
+
+    def order(self, candidates: typing.List[Candidate], running: typing.List[typing.Tuple[str, str]] = ()) -> typing.List[str]:
+        return [self.names[process] for process in self.scheduler.order(candidates, list(running), NOW)]
+
+    def test_empty(self):
+        self.assertEqual(self.order([]), [])
+
+    def test_one_user(self):
+        candidates = [self.candidate(f"a{i}") for i in range(3)]
+        self.assertEqual(self.order(candidates), ["a0", "a1", "a2"])
+
+    def test_users_take_turns(self):
+        candidates = [self.candidate(f"a{i}", email="a@example.org") for i in range(3)]
+        candidates += [self.candidate(f"b{i}", email="b@example.org") for i in range(2)]
+        candidates.append(self.candidate("c0", email="c@example.org"))
+        self.assertEqual(self.order(candidates), ["a0", "b0", "c0", "a1", "b1", "a2"])
+
+    def test_running_jobs_of_a_user(self):
+        # a user whose submissions are being graded waits behind the others
+        candidates = [self.candidate("a0", email="a@example.org"), self.candidate("b0", email="b@example.org")]
+        running = [("EX", "a@example.org"), ("EX", "a@example.org")]
+        self.assertEqual(self.order(candidates, running), ["b0", "a0"])
+
+    def test_exercises_take_turns(self):
+        candidates = [self.candidate(f"x{i}", exercise="X", email=f"{i}@example.org") for i in range(3)]
+        candidates.append(self.candidate("y0", exercise="Y"))
+        self.assertEqual(self.order(candidates), ["x0", "y0", "x1", "x2"])
+
+    def test_cap(self):
+        candidates = [self.candidate(f"x{i}", exercise="X", email=f"{i}@example.org", cap=2) for i in range(3)]
+        self.assertEqual(self.order(candidates), ["x0", "x1"])
+        # including the jobs running already
+        self.assertEqual(self.order(candidates, [("X", "other@example.org")]), ["x0"])
+        self.assertEqual(self.order(candidates, [("X", "other@example.org")] * 2), [])
+
+    def test_deadline(self):
+        candidates = [self.candidate(f"x{i}", exercise="X", email=f"{i}@example.org") for i in range(3)]
+        candidates += [
+            self.candidate(f"y{i}", exercise="Y", email=f"y{i}@example.org", stop_date=NOW + datetime.timedelta(hours=1))
+            for i in range(3)
+        ]
+        # Y gets two jobs for every job of X
+        self.assertEqual(self.order(candidates), ["x0", "y0", "y1", "x1", "y2", "x2"])
+
+    def test_staff_first(self):
+        candidates = [self.candidate("a0"), self.candidate("staff0", email="staff@example.org", staff=True, cap=0)]
+        self.assertEqual(self.order(candidates), ["staff0", "a0"])
+
+    def test_plan(self):
+        candidates = [self.candidate(f"a{i}", email="a@example.org") for i in range(2)]
+        candidates.append(self.candidate("b0", email="b@example.org"))
+        cursor = Cursor([tuple(candidate) for candidate in candidates], [("EX", "a@example.org")])
+        self.assertEqual([self.names[process] for process in self.scheduler.plan(cursor)], ["b0", "a0", "a1"])
+
+    def test_plan_empty(self):
+        cursor = Cursor([])
+        self.assertEqual(list(self.scheduler.plan(cursor)), [])
+        # the running jobs are not queried
+        self.assertEqual(cursor.queries, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,5 +19,5 @@ fi
 
 python3 manage.py collectstatic --noinput
 
-exec gunicorn -c gunicorn.conf.py nbblackbox.wsgi &
+exec gunicorn -c gunicorn.conf.py &
 python3 manage.py notify